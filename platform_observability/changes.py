@@ -0,0 +1,186 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from .history import SeriesKey
+from .instruments.core import Record
+
+
+def series_keys(records: list[Record]) -> list[SeriesKey]:
+    """
+    Returns the key of the series of each record: its string fields. Records of the same instrument with the same
+    string fields (like the single record of the gateway instrument) are told apart by their position.
+    """
+    keys = []
+    seen: dict[SeriesKey, int] = {}
+    for record in records:
+        key = tuple((k, v) for k, v in record.items() if isinstance(v, str))
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        keys.append(key + (("#", str(count)),) if count else key)
+    return keys
+
+
+class Changes:
+    """The series that changed or were removed since a given sequence number."""
+
+    sequence: int
+    timestamp: float
+    changed: dict[str, list[Record]]
+    removed: dict[str, list[dict]]
+    reset: bool
+    """Whether the requested sequence number is too old, in which case ``changed`` contains all series."""
+
+    def __init__(self, sequence: int, timestamp: float, reset: bool):
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.reset = reset
+        self.changed = {}
+        self.removed = {}
+
+
+class ChangeTracker:
+    """
+    Takes a snapshot of the records of all instruments at most once per ``max_age`` seconds, shared by all readers,
+    and remembers for every series the sequence number of the snapshot in which it last changed. The sequence
+    number only increases if any series changed, and readers that know the previous sequence number only need to
+    receive the series that changed since. Removed series are remembered for the last ``max_removed`` removals.
+
+    The sequence number of a subset of the instruments (see ``sequence_of``) is the one of the last snapshot in
+    which any of their series changed, so it can be used as the ETag of their records, even while other
+    instruments (like ``system``) change in every snapshot.
+    """
+
+    def __init__(
+        self,
+        collect: Callable[[], dict[str, list[Record]]],
+        max_age: float = 1,
+        max_removed: int = 10_000,
+    ):
+        self.collect = collect
+        self.max_age = max_age
+        self.max_removed = max_removed
+        self.mutex = threading.Lock()
+
+        self.sequence = 0
+        self.timestamp = 0.0
+        self._refreshed = None
+        # instrument -> series -> (sequence of the last change, record)
+        self.series: dict[str, dict[SeriesKey, tuple[int, Record]]] = {}
+        # instrument -> sequence of the last change of any of its series (including removals)
+        self.instrument_sequences: dict[str, int] = {}
+        # (instrument, series) -> sequence of the removal, oldest first
+        self.removed: OrderedDict[tuple[str, SeriesKey], int] = OrderedDict()
+        # removals up to this sequence number have been forgotten
+        self._horizon = 0
+
+    def refresh(self) -> int:
+        """Takes a new snapshot if the current one is older than ``max_age``, and returns its sequence number."""
+        refreshed = self._refreshed
+        if refreshed is not None and time.monotonic() - refreshed < self.max_age:
+            return self.sequence
+
+        with self.mutex:
+            refreshed = self._refreshed
+            if refreshed is not None and time.monotonic() - refreshed < self.max_age:
+                return self.sequence
+
+            samples = self.collect()
+            sequence = self.sequence + 1
+            changed = False
+
+            for name in self.series.keys() - samples.keys():
+                for key in self.series.pop(name):
+                    self._remove(name, key, sequence)
+                self.instrument_sequences[name] = sequence
+                changed = True
+
+            for name, records in samples.items():
+                previous = self.series.get(name, {})
+                current = {}
+                instrument_changed = False
+                for key, record in zip(series_keys(records), records):
+                    last = previous.get(key)
+                    if last is not None and last[1] == record:
+                        current[key] = last
+                    else:
+                        current[key] = (sequence, record)
+                        self.removed.pop((name, key), None)
+                        instrument_changed = True
+                for key in previous.keys() - current.keys():
+                    self._remove(name, key, sequence)
+                    instrument_changed = True
+                self.series[name] = current
+                if instrument_changed:
+                    self.instrument_sequences[name] = sequence
+                    changed = True
+
+            if changed:
+                self.sequence = sequence
+            self.timestamp = time.time()
+            self._refreshed = time.monotonic()
+            return self.sequence
+
+    def _remove(self, name: str, key: SeriesKey, sequence: int):
+        self.removed[(name, key)] = sequence
+        self.removed.move_to_end((name, key))
+        while len(self.removed) > self.max_removed:
+            _, forgotten = self.removed.popitem(last=False)
+            self._horizon = max(self._horizon, forgotten)
+
+    def _sequence_of(self, names: list[str] | None) -> int:
+        if names is None:
+            return self.sequence
+        return max((self.instrument_sequences.get(name, 0) for name in names), default=0)
+
+    def sequence_of(self, names: list[str] = None) -> int:
+        """
+        Returns the sequence number of the last snapshot in which any series of the given instruments (or of all
+        instruments) changed. Takes a new snapshot first if the current one is older than ``max_age``.
+        """
+        self.refresh()
+        with self.mutex:
+            return self._sequence_of(names)
+
+    def snapshot(self, names: list[str] = None) -> tuple[int, float, dict[str, list[Record]]]:
+        """
+        Returns the sequence number (of the given instruments, see ``sequence_of``), timestamp and all records of
+        the current snapshot.
+        """
+        self.refresh()
+        with self.mutex:
+            return (
+                self._sequence_of(names),
+                self.timestamp,
+                {
+                    name: [record for _, record in series.values()]
+                    for name, series in self.series.items()
+                    if names is None or name in names
+                },
+            )
+
+    def changes(self, since: int, names: list[str] = None) -> Changes:
+        """
+        Returns the series of the given instruments that changed or were removed after the snapshot with the given
+        sequence number, with the sequence number of the instruments (see ``sequence_of``).
+        """
+        self.refresh()
+        with self.mutex:
+            reset = since < self._horizon or since > self.sequence
+            changes = Changes(self._sequence_of(names), self.timestamp, reset)
+            for name, series in self.series.items():
+                if names is not None and name not in names:
+                    continue
+                records = [
+                    record for sequence, record in series.values() if reset or sequence > since
+                ]
+                if records:
+                    changes.changed[name] = records
+
+            if not reset:
+                for (name, key), sequence in self.removed.items():
+                    if sequence > since and (names is None or name in names):
+                        labels = {k: v for k, v in key if k != "#"}
+                        changes.removed.setdefault(name, []).append(labels)
+            return changes
@@ -0,0 +1,179 @@
+import logging
+import threading
+from typing import Callable
+
+from localstack.utils.patch import Patches
+
+from .instruments.aggregate import RequestCounter
+
+LOG = logging.getLogger(__name__)
+
+
+class Component:
+    """
+    A part of the extension (instruments and/or tracers) that can be enabled and disabled at runtime. Disabling a
+    component undoes its patches (and whatever ``on_disable`` detaches, like request handlers), so a disabled
+    component has no cost on the hot path, instead of just ignoring the data.
+    """
+
+    name: str
+    instruments: list[str]
+    """The names of the instruments that are reported while the component is enabled."""
+
+    def __init__(
+        self,
+        name: str,
+        instruments: list[str] = None,
+        patches: Patches = None,
+        on_enable: Callable[[], None] = None,
+        on_disable: Callable[[], None] = None,
+    ):
+        self.name = name
+        self.instruments = instruments if instruments is not None else [name]
+        self.patches = patches
+        self.on_enable = on_enable
+        self.on_disable = on_disable
+        self.enabled = False
+
+    def enable(self):
+        if self.enabled:
+            return
+        if self.on_enable:
+            self.on_enable()
+        if self.patches:
+            self.patches.apply()
+        self.enabled = True
+
+    def disable(self):
+        if not self.enabled:
+            return
+        if self.patches:
+            self.patches.undo()
+        if self.on_disable:
+            self.on_disable()
+        self.enabled = False
+
+
+def _check_patch_targets(components: list[Component]):
+    """
+    A patch captures the attribute it replaces when it is created, not when it is applied, so two patches of the
+    same attribute would silently undo each other depending on the order they are enabled in. Such patches must be
+    combined into a single one instead.
+
+    :raises ValueError: if several patches replace the same attribute
+    """
+    targets: dict[tuple[int, str], str] = {}
+    for component in components:
+        if not component.patches:
+            continue
+        for patch in component.patches.patches:
+            key = (id(patch.obj), patch.name)
+            if key in targets:
+                owner = getattr(patch.obj, "__name__", type(patch.obj).__name__)
+                raise ValueError(
+                    f"{owner}.{patch.name} is patched by both {targets[key]} and {component.name}"
+                )
+            targets[key] = component.name
+
+
+def _validate_interval(doc: dict, key: str) -> float | None:
+    value = doc.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        raise ValueError(f"{key} must be a positive number")
+    return float(value)
+
+
+class RuntimeConfiguration:
+    """
+    The settings of the extension that can be changed at runtime: which components are enabled, the sampling and
+    flush intervals, and the operations counted by the gateway instrument. An update is validated as a whole
+    before any of it is applied, and updates are serialized. Components must not patch the same attributes.
+    """
+
+    def __init__(
+        self,
+        components: list[Component],
+        request_counter: RequestCounter,
+        sampling_interval: float = 1,
+        flush_interval: float = 1,
+        on_change: Callable[["RuntimeConfiguration"], None] = None,
+    ):
+        _check_patch_targets(components)
+        self.components = {component.name: component for component in components}
+        self.request_counter = request_counter
+        self.sampling_interval = sampling_interval
+        self.flush_interval = flush_interval
+        self.on_change = on_change
+        self.mutex = threading.RLock()
+
+    def enabled_instruments(self) -> set[str]:
+        """Returns the names of the instruments of all enabled components."""
+        return {
+            instrument
+            for component in self.components.values()
+            if component.enabled
+            for instrument in component.instruments
+        }
+
+    def to_dict(self) -> dict:
+        with self.mutex:
+            return {
+                "components": {name: c.enabled for name, c in self.components.items()},
+                "sampling_interval": self.sampling_interval,
+                "flush_interval": self.flush_interval,
+                "request_filter": self.request_counter.service_request_filter,
+            }
+
+    def update(self, doc: dict):
+        """
+        Applies the given (partial) configuration, in the format returned by ``to_dict``.
+
+        :raises ValueError: if the document is invalid, in which case nothing is applied
+        """
+        if not isinstance(doc, dict):
+            raise ValueError("configuration must be an object")
+
+        components = doc.get("components") or {}
+        if not isinstance(components, dict):
+            raise ValueError("components must be an object of component names to booleans")
+        for name, enabled in components.items():
+            if name not in self.components:
+                raise ValueError(
+                    f"unknown component {name}, must be one of {list(self.components)}"
+                )
+            if not isinstance(enabled, bool):
+                raise ValueError(f"components.{name} must be a boolean")
+
+        sampling_interval = _validate_interval(doc, "sampling_interval")
+        flush_interval = _validate_interval(doc, "flush_interval")
+
+        request_filter = doc.get("request_filter")
+        if request_filter is not None:
+            if not isinstance(request_filter, list) or not all(
+                isinstance(operation, str) for operation in request_filter
+            ):
+                raise ValueError(
+                    "request_filter must be a list of operations (like sqs.SendMessage or sqs.*)"
+                )
+
+        with self.mutex:
+            for name, enabled in components.items():
+                component = self.components[name]
+                if enabled:
+                    LOG.info("enabling %s", name)
+                    component.enable()
+                else:
+                    LOG.info("disabling %s", name)
+                    component.disable()
+
+            if sampling_interval is not None:
+                self.sampling_interval = sampling_interval
+            if flush_interval is not None:
+                self.flush_interval = flush_interval
+            if request_filter is not None:
+                self.request_counter.set_filter(request_filter)
+
+            if self.on_change:
+                self.on_change(self)
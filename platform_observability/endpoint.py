@@ -1,41 +1,190 @@
 import time
 
-from localstack.http import Request, route
-from werkzeug.exceptions import NotFound
+from localstack.http import Request, Response, route
+from werkzeug.exceptions import BadRequest, NotFound, ServiceUnavailable
 
+from .changes import ChangeTracker
+from .configuration import RuntimeConfiguration
+from .history import MetricsHistory
 from .instruments.core import AggregatingInstrument, Instrument, ListCollector
 from .instruments.sns import TopicStatistics
 from .instruments.sqs import QueueStatistics
+from .openmetrics import CONTENT_TYPE, SnapshotCache, render_instruments
+from .stream import CONTENT_TYPE as STREAM_CONTENT_TYPE
+from .stream import TOPICS, EventStream, MetricsPublisher, TooManySubscribers
+from .tracing.lambda_sqs import LambdaSQSEventSourceTracer
+from .tracing.sampling import TraceFilter
 
 
 class MetricsEndpoint:
-    def __init__(self, instruments: dict[str, Instrument]):
+    def __init__(
+        self,
+        instruments: dict[str, Instrument],
+        interval: float = 1,
+        history: MetricsHistory = None,
+        timeout: float = None,
+    ):
+        """
+        :param instruments: the instruments to report, by name
+        :param interval: the maximum age in seconds of the reported metrics, which are shared by all requests
+        :param history: the history of the instruments, if it is recorded
+        :param timeout: seconds after which instruments that have not reported are reported with their last records
+        """
         self.instruments = instruments
+        self.history = history
+        self.aggregator = AggregatingInstrument(instruments, flatten=False, timeout=timeout)
+        self.openmetrics = SnapshotCache(
+            lambda: render_instruments(self.instruments).encode("utf-8"), max_age=interval
+        )
+        self.changes = ChangeTracker(self._collect, max_age=interval)
+
+    def _collect(self) -> dict[str, list]:
+        aggregator = self.aggregator
+        # the instruments are replaced when the configuration changes
+        aggregator.instruments = self.instruments
+        collector = ListCollector()
+        aggregator.measure_and_report(collector)
+        return collector.records[0]
+
+    def close(self):
+        self.aggregator.close()
+
+    def _respond(self, request: Request, names: list[str] | None):
+        """
+        Responds with the current snapshot of the given instruments, or only with the series that changed since
+        the snapshot given with ``?since=<sequence>``. The sequence number of the last snapshot in which any series
+        of the given instruments changed is the ETag, so it only changes with the requested instruments.
+        """
+        since = request.args.get("since", type=int)
+        etag = str(self.changes.sequence_of(names))
+
+        # weak comparison, since proxies may weaken the ETag (e.g., when compressing the response)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        if since is None:
+            sequence, timestamp, records = self.changes.snapshot(names)
+            document = {**records, "timestamp": timestamp, "sequence": sequence}
+        else:
+            changes = self.changes.changes(since, names)
+            sequence = changes.sequence
+            document = {
+                **changes.changed,
+                "timestamp": changes.timestamp,
+                "sequence": sequence,
+                "since": since,
+                "reset": changes.reset,
+                "removed": changes.removed,
+            }
+
+        response = Response.for_json(document)
+        response.set_etag(str(sequence))
+        return response
 
     @route("/_extension/observability/metrics")
     def get_metrics(self, request: Request):
         instrument_filter = request.args.getlist("instrument")
+        return self._respond(request, instrument_filter or None)
+
+    @route("/_extension/observability/metrics/<instrument>")
+    def get_metrics_for_instrument(self, request: Request, instrument: str):
+        if instrument not in self.instruments:
+            raise NotFound(f"unknown instrument {instrument}")
 
-        instruments = self.instruments
-        if instrument_filter:
-            instruments = {k: v for k, v in instruments.items() if v in instrument_filter}
+        return self._respond(request, [instrument])
 
-        aggregator = AggregatingInstrument(instruments, flatten=False)
-        collector = ListCollector()
-        aggregator.measure_and_report(collector)
+    @route("/_extension/observability/metrics/<instrument>/history")
+    def get_history_for_instrument(self, request: Request, instrument: str):
+        if instrument not in self.instruments or not self.history:
+            raise NotFound(f"unknown instrument {instrument}")
 
-        record = collector.records[0]
-        record["timestamp"] = time.time()
-        return record
+        since = request.args.get("since", type=float)
+        return {"timestamp": time.time(), instrument: self.history.query(instrument, since)}
+
+    @route("/_extension/observability/openmetrics")
+    def get_openmetrics(self, request: Request):
+        snapshot = self.openmetrics.get()
+
+        if "gzip" in request.accept_encodings:
+            response = Response(snapshot.gzipped, content_type=CONTENT_TYPE)
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = Response(snapshot.body, content_type=CONTENT_TYPE)
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
 
-    @route("/_extension/observability/metrics/<instrument>")
-    def get_metrics_for_instrument(self, request: Request, instrument: str):
-        collector = ListCollector()
 
+class TracingEndpoint:
+    """Runtime configuration of the trace filters (sampling, allow/deny lists) of the tracers."""
+
+    def __init__(self, tracers: dict[str, LambdaSQSEventSourceTracer]):
+        self.tracers = tracers
+
+    def _get_tracer(self, tracer: str) -> LambdaSQSEventSourceTracer:
         try:
-            instrument_obj = self.instruments[instrument]
+            return self.tracers[tracer]
         except KeyError:
-            raise NotFound(f"unknown instrument {instrument}")
+            raise NotFound(f"unknown tracer {tracer}")
+
+    @route("/_extension/observability/tracing/<tracer>/filter", methods=["GET"])
+    def get_filter(self, request: Request, tracer: str):
+        return self._get_tracer(tracer).filter.to_dict()
+
+    @route("/_extension/observability/tracing/<tracer>/filter", methods=["PUT"])
+    def put_filter(self, request: Request, tracer: str):
+        tracer_obj = self._get_tracer(tracer)
+        try:
+            trace_filter = TraceFilter.from_dict(request.get_json(force=True))
+        except ValueError as e:
+            raise BadRequest(str(e))
+
+        tracer_obj.configure(trace_filter)
+        return trace_filter.to_dict()
+
+
+class ConfigEndpoint:
+    """Runtime configuration of the extension, see ``RuntimeConfiguration``."""
+
+    def __init__(self, configuration: RuntimeConfiguration):
+        self.configuration = configuration
+
+    @route("/_extension/observability/config", methods=["GET"])
+    def get_config(self, request: Request):
+        return self.configuration.to_dict()
+
+    @route("/_extension/observability/config", methods=["PUT"])
+    def put_config(self, request: Request):
+        try:
+            self.configuration.update(request.get_json(force=True))
+        except ValueError as e:
+            raise BadRequest(str(e))
+        return self.configuration.to_dict()
+
+
+class StreamEndpoint:
+    """Live metrics and traces as Server-Sent Events, see ``EventStream``."""
+
+    def __init__(self, stream: EventStream, metrics_publisher: MetricsPublisher):
+        self.stream = stream
+        self.metrics_publisher = metrics_publisher
+
+    @route("/_extension/observability/stream", methods=["GET"])
+    def get_stream(self, request: Request):
+        topics = frozenset(
+            topic.strip() for topic in request.args.get("topics", ",".join(TOPICS)).split(",")
+        )
+        if unknown := topics.difference(TOPICS):
+            raise BadRequest(f"unknown topics {sorted(unknown)}, must be any of {list(TOPICS)}")
+
+        try:
+            subscription = self.metrics_publisher.subscribe(topics)
+        except TooManySubscribers as e:
+            raise ServiceUnavailable(str(e))
 
-        instrument_obj.measure_and_report(collector)
-        return {"timestamp": time.time(), instrument: collector.records}
+        response = Response(self.stream.events(subscription), mimetype=STREAM_CONTENT_TYPE)
+        response.headers["Cache-Control"] = "no-cache"
+        # disables response buffering of reverse proxies
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
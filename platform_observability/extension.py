@@ -1,4 +1,6 @@
+import functools
 import logging
+import os
 import threading
 from pathlib import Path
 
@@ -9,16 +11,48 @@ from localstack.http import Router
 from localstack.utils.analytics import get_session_id
 from localstack.utils.scheduler import Scheduler
 
-from .endpoint import MetricsEndpoint
-from .instruments.aggregate import RequestCounter, SystemMetrics
+from .configuration import Component, RuntimeConfiguration
+from .endpoint import ConfigEndpoint, MetricsEndpoint, StreamEndpoint, TracingEndpoint
+from .history import MetricsHistory
+from .instruments.aggregate import RequestCounter
+from .instruments.cardinality import CardinalityLimit
+from .instruments.core import CompositeInstrument
+from .instruments.dynamodb import TableStatistics
+from .instruments.executor import ExecutorStatistics
 from .instruments.sns import TopicStatistics
 from .instruments.sqs import QueueStatistics
-from .tracing.lambda_ import LambdaLifecycleTracer
+from .instruments.system import SystemMetrics
+from .overhead import OverheadStatistics
+from .stream import EventStream, MetricsPublisher, TracePublisher
+from .tracing.buffer import DROP_NEWEST
+from .tracing.lambda_ import LambdaInvocationStatistics, LambdaLifecycleTracer
 from .tracing.lambda_sqs import LambdaSQSEventSourceTracer
-from .tracing.logging import TraceFileLogger
+from .tracing.logging import NDJSON, RotationPolicy, TraceFileLogger
+from .tracing.sampling import TraceFilter
 
 LOG = logging.getLogger(__name__)
 
+DEFAULT_REQUEST_FILTER = [
+    "sqs.SendMessage",
+    "sqs.ReceiveMessage",
+    "sns.Publish",
+    "dynamodb.PutItem",
+    "dynamodb.GetItem",
+    "dynamodb.BatchWriteItem",
+    "dynamodb.BatchGetItem",
+    "lambda.Invoke",
+]
+
+ALWAYS_ENABLED_INSTRUMENTS = ("tracing", "trace_logging", "observability")
+"""Instruments that report on the extension itself, and do not belong to a component."""
+
+
+def _env_list(name: str, default: list[str]) -> list[str]:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return [item.strip() for item in value.split(",") if item.strip()]
+
 
 class ObservabilityExtension(Extension):
     name = "localstack-extension-platform-observability"
@@ -28,60 +62,204 @@ class ObservabilityExtension(Extension):
             logging.DEBUG if config.DEBUG else logging.INFO
         )
 
+        # the cost of the extension itself
+        self.overhead = OverheadStatistics(
+            sample_rate=float(os.environ.get("OBSERVABILITY_OVERHEAD_SAMPLE_RATE", "0.01"))
+        )
+
         # set up instruments
         self.request_counter = RequestCounter(
-            # TODO: make configurable
-            service_request_filter=[
-                "sqs.SendMessage",
-                "sqs.ReceiveMessage",
-                "sns.Publish",
-                "dynamodb.PutItem",
-                "dynamodb.GetItem",
-                "dynamodb.BatchWriteItem",
-                "dynamodb.BatchGetItem",
-                "lambda.Invoke",
-            ]
+            service_request_filter=_env_list("OBSERVABILITY_REQUEST_FILTER", DEFAULT_REQUEST_FILTER)
         )
         self.system_metrics = SystemMetrics()
-        self.topic_statistics = TopicStatistics()
-        self.queue_statistics = QueueStatistics()
-        self.lambda_tracer = LambdaLifecycleTracer()
-        self.lambda_sqs_event_source_tracer = LambdaSQSEventSourceTracer()
 
-        # /metrics endpoint
-        self.metrics_endpoint = MetricsEndpoint(
-            {
-                "system": self.system_metrics,
-                "gateway": self.request_counter,
-                "sqs": self.queue_statistics,
-                "sns": self.topic_statistics,
-            }
+        # instruments with one series per resource are limited to the most active resources
+        max_series = int(os.environ.get("OBSERVABILITY_MAX_SERIES", "100"))
+        series_idle_ttl = float(os.environ.get("OBSERVABILITY_SERIES_IDLE_TTL", "600"))
+        self.topic_statistics = TopicStatistics(CardinalityLimit(max_series, series_idle_ttl))
+        self.queue_statistics = QueueStatistics(CardinalityLimit(max_series, series_idle_ttl))
+        self.table_statistics = TableStatistics(CardinalityLimit(max_series, series_idle_ttl))
+
+        # set up tracers
+        trace_buffer_size = int(os.environ.get("OBSERVABILITY_TRACE_BUFFER_SIZE", "100000"))
+        trace_buffer_policy = os.environ.get("OBSERVABILITY_TRACE_BUFFER_POLICY", DROP_NEWEST)
+        self.lambda_statistics = LambdaInvocationStatistics(
+            ttl=float(os.environ.get("OBSERVABILITY_LAMBDA_INVOCATION_TTL", "900")),
+            cardinality_limit=CardinalityLimit(max_series, series_idle_ttl),
+        )
+        self.lambda_executors = ExecutorStatistics()
+        self.lambda_tracer = LambdaLifecycleTracer(
+            trace_buffer_size,
+            trace_buffer_policy,
+            statistics=self.lambda_statistics,
+            executors=self.lambda_executors,
+        )
+        self.lambda_sqs_event_source_tracer = LambdaSQSEventSourceTracer(
+            trace_buffer_size,
+            trace_buffer_policy,
+            trace_filter=TraceFilter(
+                sample_rate=float(os.environ.get("OBSERVABILITY_LAMBDA_SQS_SAMPLE_RATE", "1"))
+            ),
         )
 
+        for name, tracer in [
+            ("lambda", self.lambda_tracer),
+            ("lambda_sqs", self.lambda_sqs_event_source_tracer),
+        ]:
+            self.overhead.add_buffer(name, tracer.buffer)
+            tracer.buffer.mutex = self.overhead.timed_lock(f"{name}.buffer", tracer.buffer.mutex)
+        self.lambda_statistics.mutex = self.overhead.timed_lock(
+            "lambda.statistics", self.lambda_statistics.mutex
+        )
+
+        self.scheduler = Scheduler()
+        self.scheduled_tasks = []
+        self.started = False
+
         # lambda trace logs
+        trace_format = os.environ.get("OBSERVABILITY_TRACE_FORMAT", NDJSON)
+        trace_suffix = "ndjson.log" if trace_format == NDJSON else "col"
         lambda_trace_file = Path(
             config.dirs.cache,
             "observability/traces-lambda-events",
-            f"lambda-{get_session_id()}.ndjson.log",
+            f"lambda-{get_session_id()}.{trace_suffix}",
         )
         lambda_sqs_trace_file = Path(
             config.dirs.cache,
             "observability/traces-lambda-sqs",
-            f"lambda-sqs-{get_session_id()}.ndjson.log",
+            f"lambda-sqs-{get_session_id()}.{trace_suffix}",
+        )
+
+        rotation = RotationPolicy(
+            max_segment_bytes=int(os.environ.get("OBSERVABILITY_TRACE_SEGMENT_SIZE", "67108864")),
+            max_segment_age=float(os.environ.get("OBSERVABILITY_TRACE_SEGMENT_AGE", "3600")),
+            max_total_bytes=int(os.environ.get("OBSERVABILITY_TRACE_MAX_DISK", "1073741824")),
+            compress=config.is_env_not_false("OBSERVABILITY_TRACE_COMPRESS"),
         )
 
         self.loggers = [
-            TraceFileLogger(lambda_trace_file, self.lambda_tracer),
-            TraceFileLogger(lambda_sqs_trace_file, self.lambda_sqs_event_source_tracer),
+            TraceFileLogger(
+                lambda_trace_file, self.lambda_tracer, rotation=rotation, format=trace_format
+            ),
+            TraceFileLogger(
+                lambda_sqs_trace_file,
+                self.lambda_sqs_event_source_tracer,
+                rotation=rotation,
+                format=trace_format,
+            ),
         ]
 
-        self.scheduler = Scheduler()
-        self.interval = 1
+        instruments = {
+            "system": self.system_metrics,
+            "gateway": self.request_counter,
+            "sqs": self.queue_statistics,
+            "sns": self.topic_statistics,
+            "dynamodb": self.table_statistics,
+            "lambda": self.lambda_statistics,
+            "lambda_executors": self.lambda_executors,
+            "tracing": CompositeInstrument(
+                [self.lambda_tracer, self.lambda_sqs_event_source_tracer],
+                metric_counters=LambdaSQSEventSourceTracer.metric_counters,
+            ),
+            "trace_logging": CompositeInstrument(
+                self.loggers, metric_counters=TraceFileLogger.metric_counters
+            ),
+        }
+        self.instruments = {
+            name: self.overhead.timed_instrument(name, instrument)
+            for name, instrument in instruments.items()
+        }
+        self.instruments["observability"] = self.overhead
+
+        # instruments that have not reported within the timeout are not waited for
+        collect_timeout = float(os.environ.get("OBSERVABILITY_COLLECT_TIMEOUT", "2")) or None
+
+        # in-memory history of all instruments, sampled in the background
+        self.history = MetricsHistory(
+            {},
+            capacity=int(os.environ.get("OBSERVABILITY_HISTORY_SIZE", "600")),
+            max_series=int(os.environ.get("OBSERVABILITY_HISTORY_MAX_SERIES", "200")),
+            max_columns=int(os.environ.get("OBSERVABILITY_HISTORY_MAX_COLUMNS", "64")),
+            timeout=collect_timeout,
+        )
+
+        # live stream of metric changes and trace events
+        self.stream = EventStream(
+            queue_size=int(os.environ.get("OBSERVABILITY_STREAM_QUEUE_SIZE", "1000")),
+            max_subscribers=int(os.environ.get("OBSERVABILITY_STREAM_MAX_SUBSCRIBERS", "16")),
+            queue_bytes=int(os.environ.get("OBSERVABILITY_STREAM_QUEUE_BYTES", "16777216")),
+        )
+        self.metrics_publisher = MetricsPublisher(self.stream)
+        self.history.add_listener(self.metrics_publisher.on_sample)
+        for logger in self.loggers:
+            logger.add_listener(TracePublisher(self.stream, logger.tracer.name).on_flush)
+
+        # components that can be enabled and disabled at runtime
+        self.request_handlers: CompositeHandler | None = None
+        self.response_handlers: CompositeResponseHandler | None = None
+        self.components = [
+            Component(
+                "system", on_enable=self.system_metrics.start, on_disable=self.system_metrics.stop
+            ),
+            Component(
+                "gateway",
+                on_enable=functools.partial(self._attach_handlers, self.request_counter),
+                on_disable=functools.partial(self._detach_handlers, self.request_counter),
+            ),
+            Component(
+                "sqs",
+                patches=self.overhead.timed_patches("sqs", self.queue_statistics.patches()),
+                on_enable=self.queue_statistics.reset,
+                on_disable=self.queue_statistics.reset,
+            ),
+            Component(
+                "sns", patches=self.overhead.timed_patches("sns", self.topic_statistics.patches())
+            ),
+            Component(
+                "dynamodb",
+                on_enable=functools.partial(self._attach_handlers, self.table_statistics),
+                on_disable=functools.partial(self._detach_handlers, self.table_statistics),
+            ),
+            Component(
+                "lambda",
+                instruments=["lambda", "lambda_executors"],
+                patches=self.overhead.timed_patches("lambda", self.lambda_tracer.patches()),
+            ),
+            Component(
+                "lambda_sqs",
+                instruments=[],
+                patches=self.overhead.timed_patches(
+                    "lambda_sqs", self.lambda_sqs_event_source_tracer.patches()
+                ),
+            ),
+        ]
+        self.configuration = RuntimeConfiguration(
+            self.components,
+            self.request_counter,
+            sampling_interval=float(os.environ.get("OBSERVABILITY_SAMPLING_INTERVAL", "1")),
+            flush_interval=float(os.environ.get("OBSERVABILITY_FLUSH_INTERVAL", "1")),
+            on_change=self._on_configuration_change,
+        )
+
+        # /metrics endpoint
+        self.metrics_endpoint = MetricsEndpoint(
+            {},
+            interval=self.configuration.flush_interval,
+            history=self.history,
+            timeout=collect_timeout,
+        )
+        self.tracing_endpoint = TracingEndpoint({"lambda_sqs": self.lambda_sqs_event_source_tracer})
+        self.config_endpoint = ConfigEndpoint(self.configuration)
+        self.stream_endpoint = StreamEndpoint(self.stream, self.metrics_publisher)
 
     def on_extension_load(self):
-        self.topic_statistics.patches().apply()
-        self.lambda_tracer.patches().apply()
-        self.lambda_sqs_event_source_tracer.patches().apply()
+        disabled = set(_env_list("OBSERVABILITY_DISABLE", []))
+        for name in disabled - {component.name for component in self.components}:
+            LOG.warning("ignoring unknown component %s in OBSERVABILITY_DISABLE", name)
+
+        self.configuration.update(
+            {"components": {c.name: c.name not in disabled for c in self.components}}
+        )
         LOG.info("Metrics extension is loaded")
 
     def on_platform_start(self):
@@ -89,22 +267,97 @@ class ObservabilityExtension(Extension):
         for logger in self.loggers:
             logger.init_file()
 
-        for logger in self.loggers:
-            self.scheduler.schedule(func=logger.flush, period=self.interval)
+        self.started = True
+        self._schedule()
 
         threading.Thread(target=self.scheduler.run, daemon=True, name="trace-logger").start()
 
     def on_platform_shutdown(self):
         self.scheduler.close()
+        self.stream.close()
+        self.metrics_endpoint.close()
+        self.history.close()
+        self.system_metrics.stop()
         for logger in self.loggers:
             logger.close()
 
+    def _schedule(self):
+        for task in self.scheduled_tasks:
+            task.cancel()
+
+        configuration = self.configuration
+        # scheduled through the overhead statistics, which measure how late the tasks run
+        schedule = functools.partial(self.overhead.schedule, self.scheduler)
+        self.scheduled_tasks = [
+            schedule(f"flush.{logger.tracer.name}", logger.flush, configuration.flush_interval)
+            for logger in self.loggers
+        ]
+        if configuration.components["system"].enabled:
+            # sampled before the history, which then reads the fresh sample
+            self.scheduled_tasks.append(
+                schedule(
+                    "system.sample", self.system_metrics.sample, configuration.sampling_interval
+                )
+            )
+        self.scheduled_tasks.append(
+            schedule("history.sample", self.history.sample, configuration.sampling_interval)
+        )
+
+    def _on_configuration_change(self, configuration: RuntimeConfiguration):
+        enabled = configuration.enabled_instruments().union(ALWAYS_ENABLED_INSTRUMENTS)
+        # readers keep using the previous dict until they look up the attribute again
+        instruments = {name: i for name, i in self.instruments.items() if name in enabled}
+        self.metrics_endpoint.instruments = instruments
+        self.metrics_endpoint.openmetrics.max_age = configuration.flush_interval
+        self.metrics_endpoint.changes.max_age = configuration.flush_interval
+        self.history.instruments = instruments
+
+        if self.started:
+            self._schedule()
+
+    def _handler_instruments(self) -> list:
+        """Returns the instruments of the enabled components that collect from the request/response handlers."""
+        components = self.configuration.components
+        return [
+            instrument
+            for name, instrument in [
+                ("gateway", self.request_counter),
+                ("dynamodb", self.table_statistics),
+            ]
+            if components[name].enabled
+        ]
+
+    def _attach_handlers(self, instrument):
+        # handler lists are replaced rather than modified, since they may be iterated concurrently
+        if self.request_handlers is not None:
+            handlers = self.request_handlers
+            if instrument.on_request not in handlers.handlers:
+                handlers.handlers = handlers.handlers + [instrument.on_request]
+        if self.response_handlers is not None:
+            handlers = self.response_handlers
+            if instrument.on_response not in handlers.handlers:
+                handlers.handlers = handlers.handlers + [instrument.on_response]
+
+    def _detach_handlers(self, instrument):
+        if self.request_handlers is not None:
+            handlers = self.request_handlers
+            handlers.handlers = [h for h in handlers.handlers if h != instrument.on_request]
+        if self.response_handlers is not None:
+            handlers = self.response_handlers
+            handlers.handlers = [h for h in handlers.handlers if h != instrument.on_response]
+
     def update_gateway_routes(self, router: Router):
         router.add(self.metrics_endpoint)
+        router.add(self.tracing_endpoint)
+        router.add(self.config_endpoint)
+        router.add(self.stream_endpoint)
 
     def update_request_handlers(self, handlers: CompositeHandler):
-        handlers.append(self.request_counter.on_request)
-        pass
+        self.request_handlers = handlers
+        for instrument in self._handler_instruments():
+            self._attach_handlers(instrument)
 
     def update_response_handlers(self, handlers: CompositeResponseHandler):
-        pass
+        self.response_handlers = handlers
+        for instrument in self._handler_instruments():
+            self._attach_handlers(instrument)
@@ -0,0 +1,219 @@
+import logging
+import math
+import threading
+import time
+from array import array
+from typing import Callable
+
+from .instruments.core import AggregatingInstrument, Instrument, ListCollector, Record
+
+LOG = logging.getLogger(__name__)
+
+SeriesKey = tuple[tuple[str, str], ...]
+
+
+def flatten(record: Record) -> tuple[SeriesKey, dict[str, float]]:
+    """
+    Splits a record into the key identifying its series (all string fields) and its numeric fields. Nested
+    dictionaries (like the gateway latencies) are flattened into dotted field names.
+    """
+    labels = []
+    values = {}
+
+    def _visit(prefix: str, obj: dict):
+        for key, value in obj.items():
+            if isinstance(value, str):
+                if not prefix:
+                    labels.append((key, value))
+            elif isinstance(value, dict):
+                _visit(f"{prefix}{key}.", value)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                values[prefix + key] = value
+
+    _visit("", record)
+    return tuple(labels), values
+
+
+class TimeSeries:
+    """
+    A fixed-size ring buffer of samples, stored column-wise in float arrays. Its memory footprint is at most
+    ``capacity * (max_columns + 1) * 8`` bytes. Columns that appear later (e.g., the latency of an operation that
+    was not called before) are added on the fly and are missing (NaN) for earlier samples.
+
+    Nested fields with dynamic keys (like threads per thread name) keep producing new columns, so once
+    ``max_columns`` columns exist, a new column takes over a column that has no values left in the window. If
+    there is none, the new column is dropped (and counted in ``dropped_columns``).
+    """
+
+    def __init__(self, capacity: int, columns: list[str] = None, max_columns: int = 64):
+        self.capacity = capacity
+        self.max_columns = max_columns
+        self.columns = []
+        self.values = []
+        self._index = {}
+        # the number of samples appended so far, and the number of the last sample with a value per column
+        self._appended = 0
+        self._last_value = []
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.head = 0
+        self.size = 0
+        self.dropped_columns = 0
+        for column in columns or []:
+            self._add_column(column)
+
+    def _add_column(self, column: str) -> bool:
+        if len(self.columns) < self.max_columns:
+            self._index[column] = len(self.columns)
+            self.columns.append(column)
+            self.values.append(array("d", [math.nan]) * self.capacity)
+            self._last_value.append(-1)
+            return True
+
+        # the first sample that is still in the window after the next append
+        first = self._appended - self.capacity + 1
+        for i, last in enumerate(self._last_value):
+            # all values of the column in the window are NaN
+            if last < 0 or last < first:
+                del self._index[self.columns[i]]
+                self._index[column] = i
+                self.columns[i] = column
+                self.values[i] = array("d", [math.nan]) * self.capacity
+                self._last_value[i] = -1
+                return True
+
+        self.dropped_columns += 1
+        return False
+
+    @property
+    def last_timestamp(self) -> float:
+        if not self.size:
+            return 0.0
+        return self.timestamps[(self.head - 1) % self.capacity]
+
+    def append(self, timestamp: float, values: dict[str, float]):
+        for column in values.keys() - self._index.keys():
+            self._add_column(column)
+
+        head = self.head
+        self.timestamps[head] = timestamp
+        last_value = self._last_value
+        appended = self._appended
+        for column, i in self._index.items():
+            value = values.get(column, math.nan)
+            self.values[i][head] = value
+            if not math.isnan(value):
+                last_value[i] = appended
+        self._appended = appended + 1
+        self.head = (head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def read(self, since: float = None) -> dict[str, list]:
+        """Returns all samples newer than ``since`` (oldest first), as a dict of column name to values."""
+        start = (self.head - self.size) % self.capacity
+        positions = [(start + i) % self.capacity for i in range(self.size)]
+        if since is not None:
+            positions = [p for p in positions if self.timestamps[p] > since]
+
+        result = {"timestamp": [self.timestamps[p] for p in positions]}
+        for column, values in zip(self.columns, self.values):
+            result[column] = [None if math.isnan(values[p]) else values[p] for p in positions]
+        return result
+
+
+class MetricsHistory:
+    """
+    Samples all instruments periodically into one ``TimeSeries`` per reported record. The number of series per
+    instrument is capped at ``max_series``; if the cap is reached, the series that was updated least recently is
+    evicted. With the columns of each series capped at ``max_columns``, memory is bounded by
+    ``max_series * capacity * (max_columns + 1) * 8`` bytes per instrument, regardless of uptime or the number of
+    queues/topics.
+
+    The instruments are measured like by the metrics endpoint (see ``AggregatingInstrument``), so with a
+    ``timeout`` a slow instrument does not delay the other tasks of the scheduler thread that samples. Instruments
+    that have not reported in time are left out of the sample.
+    """
+
+    def __init__(
+        self,
+        instruments: dict[str, Instrument],
+        capacity: int = 600,
+        max_series: int = 200,
+        max_columns: int = 64,
+        timeout: float = None,
+    ):
+        """
+        :param instruments: the instruments to sample, by name
+        :param capacity: the number of samples kept per series
+        :param max_series: the maximum number of series per instrument
+        :param max_columns: the maximum number of fields per series
+        :param timeout: seconds to wait for the instruments, or None to measure them one after another
+        """
+        self.instruments = instruments
+        self.capacity = capacity
+        self.max_series = max_series
+        self.max_columns = max_columns
+        self.aggregator = AggregatingInstrument(instruments, flatten=False, timeout=timeout)
+        self.mutex = threading.RLock()
+        self.series: dict[str, dict[SeriesKey, TimeSeries]] = {name: {} for name in instruments}
+        self.listeners: list[Callable[[float, dict[str, list[Record]]], None]] = []
+
+    def add_listener(self, listener: Callable[[float, dict[str, list[Record]]], None]):
+        """Adds a callback that receives the records of all instruments after each sample."""
+        self.listeners.append(listener)
+
+    def sample(self):
+        timestamp = time.time()
+        aggregator = self.aggregator
+        # the instruments are replaced when the configuration changes
+        aggregator.instruments = self.instruments
+        collector = ListCollector()
+        aggregator.measure_and_report(collector)
+
+        samples = {}
+        for name, records in collector.records[0].items():
+            # the last records of instruments that failed or did not report in time are not sampled again
+            if any(record.get("stale") for record in records):
+                continue
+            samples[name] = records
+
+            with self.mutex:
+                series = self.series.setdefault(name, {})
+                for record in records:
+                    key, values = flatten(record)
+                    try:
+                        time_series = series[key]
+                    except KeyError:
+                        if len(series) >= self.max_series:
+                            self._evict(series)
+                        time_series = series[key] = TimeSeries(
+                            self.capacity, list(values.keys()), self.max_columns
+                        )
+                    time_series.append(timestamp, values)
+
+        for listener in self.listeners:
+            try:
+                listener(timestamp, samples)
+            except Exception:
+                LOG.exception("error in history listener %s", listener)
+
+    def close(self):
+        self.aggregator.close()
+
+    @staticmethod
+    def _evict(series: dict[SeriesKey, TimeSeries]):
+        oldest = min(series, key=lambda k: series[k].last_timestamp)
+        del series[oldest]
+
+    def query(self, instrument: str, since: float = None) -> list[dict]:
+        """
+        Returns the sampled window of the given instrument, one entry per series, with the labels of the series
+        and a list of values per column.
+        """
+        with self.mutex:
+            result = []
+            for key, time_series in self.series.get(instrument, {}).items():
+                entry = dict(key)
+                entry.update(time_series.read(since))
+                result.append(entry)
+            return result
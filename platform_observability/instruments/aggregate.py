@@ -1,57 +1,178 @@
-import threading
+import fnmatch
+import sys
+import time
 
 from localstack.aws.api import RequestContext
 from localstack.aws.chain import HandlerChain
 from requests import Response
 
+from ..openmetrics import METRIC_PREFIX, MetricFamily
 from .core import Channel, Instrument
+from .counters import ShardedCounter
+from .histogram import ShardedHistogram
+
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+"""Bucket bounds (in seconds) of the latency histograms in the OpenMetrics exposition."""
+
+
+class _OperationFilter:
+    """
+    The operations counted by the ``RequestCounter``, as exact names (``sqs.SendMessage``) or patterns
+    (``dynamodb.*``). Whether an operation is counted is resolved once and cached, and a filter is never modified
+    after it is created, so it can be swapped atomically while requests are being counted.
+    """
+
+    def __init__(self, operations: list[str]):
+        self.operations = list(operations)
+        self.exact = frozenset(o for o in self.operations if not _is_pattern(o))
+        self.patterns = [o for o in self.operations if _is_pattern(o)]
+        # maps (service name, operation name) to the interned metric key, or None if the operation is not counted
+        self.keys: dict[tuple[str, str], str | None] = {}
+
+    def matches(self, key: str) -> bool:
+        return key in self.exact or any(fnmatch.fnmatchcase(key, p) for p in self.patterns)
+
+    def resolve(self, service_name: str, operation_name: str) -> str | None:
+        key = f"{service_name}.{operation_name}"
+        key = sys.intern(key) if self.matches(key) else None
+        self.keys[(service_name, operation_name)] = key
+        return key
+
+
+def _is_pattern(operation: str) -> bool:
+    return any(c in operation for c in "*?[")
 
 
 class RequestCounter(Instrument):
     name = "requests"
 
     def __init__(self, service_request_filter: list = None):
-        self.service_request_filter = service_request_filter or []
-        self.metrics = dict()
-        self.clear()
+        self._filter = _OperationFilter(service_request_filter or [])
+        self.counter = ShardedCounter()
+        self.latency = ShardedHistogram()
+
+    @property
+    def service_request_filter(self) -> list[str]:
+        return list(self._filter.operations)
+
+    def set_filter(self, service_request_filter: list[str]):
+        """Replaces the counted operations, which may include patterns like ``dynamodb.*``."""
+        self._filter = _OperationFilter(service_request_filter)
 
     def clear(self):
-        self.metrics.clear()
-        self.metrics["total"] = 0
-        for key in self.service_request_filter:
-            self.metrics[key] = 0
+        self.counter.clear()
+        self.latency.clear()
 
     def on_request(self, chain: HandlerChain, context: RequestContext, response: Response):
-        self.metrics["total"] += 1
+        counter = self.counter
+        counter.inc("total")
         if context.service and context.operation:
-            key = f"{context.service.service_name}.{context.operation.name}"
-            if key in self.service_request_filter:
-                self.metrics[f"{context.service.service_name}.{context.operation.name}"] += 1
+            service_name = context.service.service_name
+            operation_name = context.operation.name
+            operation_filter = self._filter
+            try:
+                key = operation_filter.keys[(service_name, operation_name)]
+            except KeyError:
+                key = operation_filter.resolve(service_name, operation_name)
+            if key is not None:
+                counter.inc(key)
+                context.observability_request_start = (key, time.perf_counter_ns())
+
+    def on_response(self, chain: HandlerChain, context: RequestContext, response: Response):
+        request_start = context.get("observability_request_start")
+        if request_start is None:
+            return
+        key, start = request_start
+        # latencies are recorded in microseconds
+        self.latency.record(key, (time.perf_counter_ns() - start) // 1000)
+
+    def _counted_keys(self, counts: dict) -> list[str]:
+        """
+        Returns the keys to report: all exact operations of the filter (even if not called yet), and all counted
+        operations that match the current filter.
+        """
+        operation_filter = self._filter
+        keys = [o for o in operation_filter.operations if o in operation_filter.exact]
+        keys.extend(
+            sorted(
+                key
+                for key in counts
+                if key != "total"
+                and key not in operation_filter.exact
+                and operation_filter.matches(key)
+            )
+        )
+        return keys
 
     def measure_and_report(self, channel: Channel) -> None:
-        channel.put(self.metrics)
+        counts = self.counter.snapshot()
+        record = {"total": counts.get("total", 0)}
+        keys = self._counted_keys(counts)
+        for key in keys:
+            record[key] = counts.get(key, 0)
+
+        latency = self.latency.snapshot()
+        record["latency"] = {key: latency[key].summary() for key in keys if key in latency}
+
+        channel.put(record)
+
+    def metric_families(self, name: str) -> list[MetricFamily]:
+        counts = self.counter.snapshot()
+
+        requests = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_requests", "counter", "Requests handled by the gateway"
+        )
+        requests.add(counts.get("total", 0), suffix="_total")
+
+        operation_requests = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_operation_requests",
+            "counter",
+            "Requests per service operation",
+        )
+        keys = self._counted_keys(counts)
+        for key in keys:
+            operation_requests.add(counts.get(key, 0), {"operation": key}, "_total")
+
+        latency = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_operation_latency_seconds",
+            "histogram",
+            "Latency per service operation",
+        )
+        bounds_us = [int(bound * 1_000_000) for bound in LATENCY_BUCKETS]
+        histograms = self.latency.snapshot()
+        for key in keys:
+            if key not in histograms:
+                continue
+            histogram = histograms[key]
+            latency.add_histogram(
+                LATENCY_BUCKETS,
+                histogram.cumulative_counts(bounds_us),
+                histogram.total / 1_000_000,
+                {"operation": key},
+            )
+
+        return [requests, operation_requests, latency]
 
 
 class ServiceMetrics(Instrument):
     name = "service_metrics"
 
     def update_sqs(self, response: dict):
-        from localstack.services.sqs.models import FifoQueue, StandardQueue, sqs_stores
+        from localstack.services.sqs.models import sqs_stores
+
+        from .sqs import count_visible_messages
 
         response["sqs_queues"] = 0
         response["sqs_queued_messages"] = 0
         response["sqs_inflight_messages"] = 0
 
         for _, _, store in sqs_stores.iter_stores():
-            response["sqs_queues"] += len(store.queues)
+            queues = list(store.queues.values())
+            response["sqs_queues"] += len(queues)
 
-            for queue in store.queues.values():
+            for queue in queues:
                 response["sqs_inflight_messages"] += len(queue.inflight)
-                if isinstance(queue, StandardQueue):
-                    response["sqs_queued_messages"] += queue.visible.qsize()
-                if isinstance(queue, FifoQueue):
-                    for message_group in queue.message_group_queue.queue:
-                        response["sqs_queued_messages"] += len(message_group.messages)
+                response["sqs_queued_messages"] += count_visible_messages(queue)
 
     def update_lambda(self, response: dict):
         response["lambda_functions"] = 0
@@ -65,14 +186,3 @@ class ServiceMetrics(Instrument):
         self.update_sqs(record)
         self.update_lambda(record)
         channel.put(record)
-
-
-class SystemMetrics(Instrument):
-    name = "system"
-
-    def measure_and_report(self, channel: Channel) -> None:
-        record = {
-            "active_thread_count": threading.active_count(),
-            "max_rss": threading.active_count(),
-        }
-        channel.put(record)
@@ -0,0 +1,133 @@
+import operator
+import threading
+import time
+from typing import Callable, Iterable
+
+from .histogram import Histogram
+
+OTHER = "__other__"
+"""Key of the series that aggregates all series beyond the cardinality limit of an instrument."""
+
+
+def _numeric_values(record: dict) -> tuple:
+    return tuple(
+        value
+        for value in record.values()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    )
+
+
+def merge_records(
+    records: Iterable[dict],
+    label: str,
+    merge: dict[str, Callable[[float, float], float]] = None,
+) -> dict:
+    """
+    Merges the numeric fields of the given records into a single ``__other__`` record, with the number of merged
+    series in ``series``. Fields are summed up, except for ages (fields ending in ``_age``), of which the maximum
+    is taken. Nested values (like latency summaries) cannot be merged and are omitted.
+
+    :param merge: functions that merge two values of a field, for fields that cannot be summed up
+    """
+    merged = {label: OTHER, "series": 0}
+    functions = {}
+    for record in records:
+        merged["series"] += 1
+        for field, value in record.items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            if field not in merged:
+                merged[field] = value
+                continue
+            try:
+                function = functions[field]
+            except KeyError:
+                function = functions[field] = _merge_function(field, merge)
+            merged[field] = function(merged[field], value)
+    return merged
+
+
+def _merge_function(field: str, merge: dict | None) -> Callable[[float, float], float]:
+    if merge and field in merge:
+        return merge[field]
+    if field.endswith("_age"):
+        return max
+    return operator.add
+
+
+def merge_histograms(histograms: Iterable[Histogram]) -> Histogram:
+    merged = Histogram()
+    for histogram in histograms:
+        merged.merge(histogram)
+    return merged
+
+
+class CardinalityLimit:
+    """
+    Bounds the number of series reported by an instrument with one series per resource (queue, topic, function),
+    so tests that create thousands of short-lived resources do not grow the metrics without bounds. Series whose
+    values have not changed for ``idle_ttl`` seconds are not reported, the ``max_series`` most active of the
+    remaining series are reported, and the others are summed up into a single ``__other__`` series.
+
+    Instruments only evict the state of deleted resources. The state of idle series is kept, so the monotonic
+    counters of a series that becomes active again continue where they left off instead of starting from 0.
+    """
+
+    def __init__(self, max_series: int = 100, idle_ttl: float = 600):
+        """
+        :param max_series: the maximum number of series reported individually (0 disables the limit)
+        :param idle_ttl: seconds after which unchanged series are not reported anymore (0 disables this)
+        """
+        self.max_series = max_series
+        self.idle_ttl = idle_ttl
+        self.mutex = threading.Lock()
+        # series key -> (numeric values when last changed, time of the last change)
+        self._series: dict[str, tuple[tuple, float]] = {}
+
+    def apply(
+        self,
+        records: list[dict],
+        label: str,
+        activity: Callable[[dict], float],
+        busy: Callable[[dict], bool] = None,
+    ) -> tuple[list[dict], list[dict], set[str]]:
+        """
+        Applies the limit to the current records of an instrument. Series that are not part of ``records`` anymore
+        (e.g., of deleted resources) are forgotten.
+
+        :param records: one record per series
+        :param label: the field holding the key of the series (e.g., ``queue``)
+        :param activity: ranks the series, the most active ones are reported individually
+        :param busy: series for which this returns true are never idle (e.g., queues that still hold messages)
+        :return: a tuple of the records reported individually, the records of the series beyond the limit (to be
+            aggregated into ``__other__``), and the keys of idle series
+        """
+        now = time.monotonic()
+        active = []
+        idle = set()
+
+        with self.mutex:
+            previous = self._series
+            series = {}
+            for record in records:
+                key = record[label]
+                values = _numeric_values(record)
+                try:
+                    last_values, changed = previous[key]
+                    if last_values != values:
+                        changed = now
+                except KeyError:
+                    changed = now
+                series[key] = (values, changed)
+
+                if self.idle_ttl and now - changed > self.idle_ttl and not (busy and busy(record)):
+                    idle.add(key)
+                else:
+                    active.append(record)
+            self._series = series
+
+        if not self.max_series or len(active) <= self.max_series:
+            return active, [], idle
+
+        active.sort(key=activity, reverse=True)
+        return active[: self.max_series], active[self.max_series :], idle
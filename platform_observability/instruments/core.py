@@ -1,7 +1,14 @@
+import functools
 import json
-from collections import defaultdict
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from typing import Protocol
 
+from ..openmetrics import MetricFamily, families_from_records
+
+LOG = logging.getLogger(__name__)
+
 Record = dict
 
 
@@ -11,9 +18,23 @@ class Channel(Protocol):
 
 
 class Instrument:
+    metric_counters: tuple[str, ...] = ()
+    """Fields of the reported records that are monotonic counters, used for the OpenMetrics exposition."""
+
     def measure_and_report(self, channel: Channel) -> None:
         raise NotImplementedError
 
+    def metric_families(self, name: str) -> list[MetricFamily]:
+        """
+        Returns the current measurements as OpenMetrics metric families. By default, this converts the reported
+        records generically, instruments can override this to provide more specific metric types.
+
+        :param name: the name the instrument is registered with
+        """
+        collector = ListCollector()
+        self.measure_and_report(collector)
+        return families_from_records(name, collector.records, self.metric_counters)
+
 
 class ListCollector:
     records: list[Record]
@@ -25,39 +46,131 @@ class ListCollector:
         self.records.append(record)
 
 
-class _NamedAggregator:
-    name: str
-    record: dict
-
-    def __init__(self):
-        self.record = defaultdict(list)
-        self.name = None
-
-    def put(self, record):
-        self.record[self.name].append(record)
+class AggregatingInstrument(Instrument):
+    """
+    Reports the records of all given instruments as a single record, keyed by instrument name. An instrument that
+    raises an exception is reported with its last records, instead of failing the whole report.
 
+    With a ``timeout``, the instruments are measured concurrently on a small thread pool, and instruments that have
+    not reported within the timeout are reported with their last records as well, so reporting takes at most
+    ``timeout`` seconds instead of the sum of all instruments. A slow instrument keeps running in the background
+    and is not measured again until it finished, its result is reported by the next report. Records that are
+    reported again are marked with ``"stale": true``.
+    """
 
-class AggregatingInstrument(Instrument):
     instruments: dict[str, Instrument]
 
-    def __init__(self, instruments: dict[str, Instrument], flatten: bool = True):
+    def __init__(
+        self,
+        instruments: dict[str, Instrument],
+        flatten: bool = True,
+        timeout: float = None,
+        max_workers: int = 4,
+    ):
+        """
+        :param instruments: the instruments to report, by name
+        :param flatten: whether to report single records directly instead of as a list with one record
+        :param timeout: seconds to wait for the instruments, or None to measure them one after another
+        :param max_workers: the number of threads measuring instruments concurrently
+        """
         self.instruments = instruments
         self.flatten = flatten
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.mutex = threading.RLock()
+        self._executor: ThreadPoolExecutor | None = None
+        # instrument name -> the records of its last successful measurement
+        self._last: dict[str, list[Record]] = {}
+        # instrument name -> its measurement that is still running
+        self._pending: dict[str, Future] = {}
+
+    def _measure(self, name: str, instrument: Instrument) -> list[Record]:
+        collector = ListCollector()
+        instrument.measure_and_report(collector)
+        with self.mutex:
+            self._last[name] = collector.records
+        return collector.records
+
+    def _stale(self, name: str) -> list[Record]:
+        with self.mutex:
+            return [{**record, "stale": True} for record in self._last.get(name, [])]
+
+    def _done(self, name: str, future: Future):
+        with self.mutex:
+            if self._pending.get(name) is future:
+                del self._pending[name]
+
+    def _collect(self) -> dict[str, list[Record]]:
+        instruments = self.instruments
+
+        if self.timeout is None:
+            results = {}
+            for name, instrument in instruments.items():
+                try:
+                    results[name] = self._measure(name, instrument)
+                except Exception:
+                    LOG.exception("error while measuring instrument %s", name)
+                    results[name] = self._stale(name)
+            return results
+
+        futures = {}
+        with self.mutex:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="observability-collect"
+                )
+            for name, instrument in instruments.items():
+                future = self._pending.get(name)
+                if future is None:
+                    future = self._executor.submit(self._measure, name, instrument)
+                    self._pending[name] = future
+                    future.add_done_callback(functools.partial(self._done, name))
+                futures[name] = future
+
+        wait(futures.values(), timeout=self.timeout)
+
+        results = {}
+        for name, future in futures.items():
+            if not future.done():
+                LOG.debug("instrument %s did not report within %ss", name, self.timeout)
+                results[name] = self._stale(name)
+                continue
+            try:
+                results[name] = future.result()
+            except Exception:
+                LOG.exception("error while measuring instrument %s", name)
+                results[name] = self._stale(name)
+        return results
 
     def measure_and_report(self, channel: Channel) -> None:
-        collector = _NamedAggregator()
-
-        for name, instrument in self.instruments.items():
-            collector.name = name
-            instrument.measure_and_report(collector)
-
-        record = dict(collector.record)
+        record = {name: records for name, records in self._collect().items() if records}
         if self.flatten:
-            for k, v in collector.record.items():
+            for k, v in record.items():
                 record[k] = v[0] if len(v) == 1 else v
 
         channel.put(record)
 
+    def close(self):
+        """Stops the thread pool, without waiting for running measurements."""
+        with self.mutex:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class CompositeInstrument(Instrument):
+    """Reports the records of all given instruments into the same channel."""
+
+    instruments: list[Instrument]
+
+    def __init__(self, instruments: list[Instrument], metric_counters: tuple[str, ...] = ()):
+        self.instruments = instruments
+        self.metric_counters = metric_counters
+
+    def measure_and_report(self, channel: Channel) -> None:
+        for instrument in self.instruments:
+            instrument.measure_and_report(channel)
+
 
 class JsonPrinter:
     def put(self, record: Record) -> None:
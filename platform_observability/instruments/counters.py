@@ -0,0 +1,153 @@
+import threading
+from typing import Callable, Generic, Hashable, Iterable, TypeVar
+
+T = TypeVar("T")
+
+
+class ThreadShards(Generic[T]):
+    """
+    Holds one shard of state per thread. Writers only ever touch the shard of their own thread, so they need no
+    locking, and readers merge all shards at read time. Shards of threads that have exited are folded into a
+    single retired shard when collected, so thread churn does not grow the number of shards.
+    """
+
+    def __init__(self, factory: Callable[[], T], merge: Callable[[T, T], None]):
+        """
+        :param factory: creates a new, empty shard
+        :param merge: merges the second shard into the first one
+        """
+        self.factory = factory
+        self.merge = merge
+        self.mutex = threading.Lock()
+        self._local = threading.local()
+        self._shards: list[tuple[threading.Thread, T]] = []
+        self._retired = factory()
+
+    def get(self) -> T:
+        """Returns the shard of the calling thread."""
+        try:
+            return self._local.shard
+        except AttributeError:
+            return self._create()
+
+    def _create(self) -> T:
+        shard = self.factory()
+        with self.mutex:
+            self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+        return shard
+
+    def collect(self) -> list[T]:
+        """Returns all shards that currently hold data, including the shard of retired threads."""
+        with self.mutex:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self.merge(self._retired, shard)
+            self._shards = live
+            return [self._retired] + [shard for _, shard in live]
+
+    def clear(self):
+        """Drops all shards. Threads lazily create a new shard on their next write."""
+        with self.mutex:
+            self._local = threading.local()
+            self._shards = []
+            self._retired = self.factory()
+
+
+def discard_keys(shards: ThreadShards[dict], predicate: Callable[[Hashable], bool]):
+    """
+    Removes all keys matching the predicate from all shards. A thread that writes a key concurrently may keep or
+    recreate it, which only matters for keys that are still in use.
+    """
+    for shard in shards.collect():
+        for key in [key for key in shard.copy() if predicate(key)]:
+            shard.pop(key, None)
+
+
+def _merge_counts(target: dict, source: dict):
+    for key, value in source.copy().items():
+        target[key] = target.get(key, 0) + value
+
+
+class ShardedCounter:
+    """
+    A set of named counters that can be incremented concurrently from many threads without locks and without
+    losing increments. Each thread increments its own dict, the dicts are summed up on ``snapshot``.
+    """
+
+    def __init__(self):
+        self.shards: ThreadShards[dict[Hashable, int]] = ThreadShards(dict, _merge_counts)
+
+    def inc(self, key: Hashable, value: int = 1):
+        shard = self.shards.get()
+        shard[key] = shard.get(key, 0) + value
+
+    def snapshot(self) -> dict[Hashable, int]:
+        result = {}
+        for shard in self.shards.collect():
+            _merge_counts(result, shard)
+        return result
+
+    def get(self, key: Hashable) -> int:
+        return sum(shard.get(key, 0) for shard in self.shards.collect())
+
+    def discard(self, predicate: Callable[[Hashable], bool]):
+        """Removes all counters whose key matches the predicate, e.g., of deleted resources."""
+        discard_keys(self.shards, predicate)
+
+    def clear(self):
+        self.shards.clear()
+
+
+class Rates:
+    """
+    Per-second rates of monotonic counters, by key (e.g., per queue). The rates are computed from the difference to
+    the previous sample once ``interval`` seconds passed, and the previous rates are returned until then, so readers
+    that measure right after each other do not see rates over tiny intervals.
+    """
+
+    def __init__(self, interval: float = 1):
+        self.interval = interval
+        self.mutex = threading.Lock()
+        # key -> (time, counters) of the sample the rates were computed from, and the rates
+        self._samples: dict[Hashable, tuple[float, tuple, tuple]] = {}
+
+    def update(self, key: Hashable, counts: tuple, now: float) -> tuple:
+        """
+        Returns the rates per second of the given counters.
+
+        :param key: the key of the counters
+        :param counts: the current values of the counters
+        :param now: the current time (of a monotonic clock)
+        """
+        with self.mutex:
+            previous = self._samples.get(key)
+            if previous is None:
+                rates = (0.0,) * len(counts)
+            else:
+                last_time, last_counts, rates = previous
+                elapsed = now - last_time
+                if elapsed < self.interval:
+                    return rates
+                rates = tuple(
+                    round(max(0, count - last) / elapsed, 3)
+                    for count, last in zip(counts, last_counts)
+                )
+            self._samples[key] = (now, counts, rates)
+            return rates
+
+    def keys(self) -> set[Hashable]:
+        with self.mutex:
+            return set(self._samples)
+
+    def discard(self, keys: Iterable[Hashable]):
+        with self.mutex:
+            for key in keys:
+                self._samples.pop(key, None)
+
+    def clear(self):
+        with self.mutex:
+            self._samples.clear()
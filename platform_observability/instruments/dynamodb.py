@@ -0,0 +1,273 @@
+import time
+
+from localstack.aws.api import RequestContext
+from localstack.aws.chain import HandlerChain
+from localstack.http import Response
+from localstack.utils.aws.arns import dynamodb_table_arn
+
+from ..openmetrics import METRIC_PREFIX, MetricFamily, families_from_records
+from .aggregate import LATENCY_BUCKETS
+from .cardinality import OTHER, CardinalityLimit, merge_histograms, merge_records
+from .core import Channel, Instrument
+from .counters import Rates, ShardedCounter
+from .histogram import ShardedHistogram
+
+READ = "read"
+WRITE = "write"
+
+READ_OPERATIONS = frozenset(["GetItem", "BatchGetItem", "Query", "Scan", "TransactGetItems"])
+WRITE_OPERATIONS = frozenset(
+    ["PutItem", "UpdateItem", "DeleteItem", "BatchWriteItem", "TransactWriteItems"]
+)
+
+# counter keys, counted per table ARN
+_READS = "reads"
+_WRITES = "writes"
+_ERRORS = "errors"
+_READ_ITEMS = "read_items"
+_WRITTEN_ITEMS = "written_items"
+_UNPROCESSED_ITEMS = "unprocessed_items"
+_REQUEST_BYTES = "request_bytes"
+
+_FIELDS = (
+    _READS,
+    _WRITES,
+    _ERRORS,
+    _READ_ITEMS,
+    _WRITTEN_ITEMS,
+    _UNPROCESSED_ITEMS,
+    _REQUEST_BYTES,
+)
+
+
+def _requested_items(operation: str, request: dict) -> dict[str, int]:
+    """Returns the number of items requested per table (name or ARN) by a data plane request."""
+    if operation == "BatchGetItem":
+        return {
+            table: len(items.get("Keys") or [])
+            for table, items in (request.get("RequestItems") or {}).items()
+        }
+    if operation == "BatchWriteItem":
+        return {table: len(items) for table, items in (request.get("RequestItems") or {}).items()}
+    if operation in ("TransactGetItems", "TransactWriteItems"):
+        tables = {}
+        for transact_item in request.get("TransactItems") or []:
+            # a single action (Get, Put, Update, Delete or ConditionCheck) per item
+            for action, parameters in transact_item.items():
+                table = parameters.get("TableName")
+                if table:
+                    # condition checks neither read nor write the item
+                    tables[table] = tables.get(table, 0) + (action != "ConditionCheck")
+        return tables
+    table = request.get("TableName")
+    return {table: 1} if table else {}
+
+
+def _table_arn(table: str, context: RequestContext) -> str:
+    """Tables can be referenced by name or ARN."""
+    if table.startswith("arn:"):
+        return table
+    return dynamodb_table_arn(table, context.account_id, context.region)
+
+
+def _processed_items(operation: str, table: str, requested: int, response: dict) -> tuple[int, int]:
+    """Returns the number of items read or written for a table by a successful request, and the unprocessed ones."""
+    if operation == "GetItem":
+        return (1 if response.get("Item") else 0), 0
+    if operation in ("Query", "Scan"):
+        return response.get("Count") or 0, 0
+    if operation == "BatchGetItem":
+        returned = len((response.get("Responses") or {}).get(table) or [])
+        unprocessed = len(
+            ((response.get("UnprocessedKeys") or {}).get(table) or {}).get("Keys") or []
+        )
+        return returned, unprocessed
+    if operation == "BatchWriteItem":
+        unprocessed = len((response.get("UnprocessedItems") or {}).get(table) or [])
+        return requested - unprocessed, unprocessed
+    return requested, 0
+
+
+class TableStatistics(Instrument):
+    """
+    Data plane operations per DynamoDB table: read and write operations and their rates per second, the items they
+    read and wrote (including the items of batch operations, and the ones DynamoDB did not process), failed
+    operations, request bytes, and latency. The statistics are collected from the request and response handlers of the gateway, so tables are
+    never scanned. Requests spanning several tables (batch and transaction operations) count for every table, their
+    request bytes are split among the tables by their number of items.
+    """
+
+    metric_counters = _FIELDS
+
+    def __init__(self, cardinality_limit: CardinalityLimit = None, rate_interval: float = 1):
+        """
+        :param cardinality_limit: bounds the number of reported tables
+        :param rate_interval: the minimum number of seconds between the samples that rates are computed from
+        """
+        self.counter = ShardedCounter()
+        self.rates = Rates(rate_interval)
+        # latencies are recorded in microseconds
+        self.latency = ShardedHistogram()
+        self.cardinality_limit = cardinality_limit or CardinalityLimit()
+
+    def clear(self):
+        self.counter.clear()
+        self.latency.clear()
+        self.rates.clear()
+
+    def on_request(self, chain: HandlerChain, context: RequestContext, response: Response):
+        service = context.service
+        if service is None or service.service_name != "dynamodb" or context.operation is None:
+            return
+        operation = context.operation.name
+        if operation in READ_OPERATIONS:
+            kind = READ
+        elif operation in WRITE_OPERATIONS:
+            kind = WRITE
+        elif operation == "DeleteTable":
+            kind = None
+        else:
+            return
+
+        tables = _requested_items(operation, context.service_request or {})
+        if tables:
+            context.observability_dynamodb_request = (
+                operation,
+                kind,
+                tables,
+                time.perf_counter_ns(),
+            )
+
+    def on_response(self, chain: HandlerChain, context: RequestContext, response: Response):
+        state = context.get("observability_dynamodb_request")
+        if state is None:
+            return
+        operation, kind, tables, start = state
+        failed = context.service_exception is not None or (
+            response is not None and response.status_code >= 400
+        )
+
+        if kind is None:
+            # the statistics of deleted tables are dropped right away
+            if not failed:
+                self._evict({_table_arn(table, context) for table in tables})
+            return
+
+        elapsed = (time.perf_counter_ns() - start) // 1000
+        counter = self.counter
+        service_response = context.service_response or {}
+        request_bytes = context.request.content_length or 0
+        total_items = sum(tables.values()) or 1
+
+        for table, requested in tables.items():
+            table_arn = _table_arn(table, context)
+            counter.inc((table_arn, _READS if kind == READ else _WRITES))
+            counter.inc((table_arn, operation))
+            counter.inc((table_arn, _REQUEST_BYTES), request_bytes * requested // total_items)
+            self.latency.record(table_arn, elapsed)
+            if failed:
+                counter.inc((table_arn, _ERRORS))
+                continue
+            # batch responses refer to the tables the way the request did
+            processed, unprocessed = _processed_items(operation, table, requested, service_response)
+            counter.inc((table_arn, _READ_ITEMS if kind == READ else _WRITTEN_ITEMS), processed)
+            if unprocessed:
+                counter.inc((table_arn, _UNPROCESSED_ITEMS), unprocessed)
+
+    def _evict(self, table_arns: set[str]):
+        """Drops all statistics of the given tables."""
+
+        def _matches(key) -> bool:
+            return (key[0] if isinstance(key, tuple) else key) in table_arns
+
+        self.counter.discard(_matches)
+        self.latency.discard(_matches)
+        self.rates.discard(table_arns)
+
+    def _collect(self) -> tuple[list[dict], list[dict]]:
+        """
+        Returns the records of the tables that are reported individually, and of the tables beyond the cardinality
+        limit. Idle tables are not reported, but keep their statistics (which are evicted once a table is deleted),
+        so their counters do not start over. Only the reported records hold latency summaries.
+        """
+        latency = self.latency.snapshot()
+        now = time.monotonic()
+        tables: dict[str, dict] = {}
+        for (table_arn, key), count in self.counter.snapshot().items():
+            record = tables.get(table_arn)
+            if record is None:
+                record = tables[table_arn] = {"table_arn": table_arn, "operations": {}}
+                for field in _FIELDS:
+                    record[field] = 0
+            if key in _FIELDS:
+                record[key] = count
+            else:
+                record["operations"][key] = count
+
+        records = []
+        for table_arn, record in sorted(tables.items()):
+            record["read_rate"], record["write_rate"] = self.rates.update(
+                table_arn, (record[_READS], record[_WRITES]), now
+            )
+            records.append(record)
+
+        reported, other, _ = self.cardinality_limit.apply(
+            records, "table_arn", activity=lambda r: r[_READS] + r[_WRITES]
+        )
+        for record in reported:
+            histogram = latency.get(record["table_arn"])
+            record["latency"] = histogram.summary() if histogram is not None else None
+        return reported, other
+
+    def measure_and_report(self, channel: Channel) -> None:
+        reported, other = self._collect()
+        for record in reported:
+            channel.put(record)
+        if other:
+            channel.put(merge_records(other, "table_arn"))
+
+    def metric_families(self, name: str) -> list[MetricFamily]:
+        reported, other = self._collect()
+        records = reported + [merge_records(other, "table_arn")] if other else reported
+        # nested operation counts and latencies are ignored by the generic conversion
+        families = families_from_records(name, records, self.metric_counters)
+
+        operations = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_table_operations", "counter", "Operations per table"
+        )
+        merged: dict[str, int] = {}
+        for record in other:
+            for operation, count in record["operations"].items():
+                merged[operation] = merged.get(operation, 0) + count
+        table_operations = [(record["table_arn"], record["operations"]) for record in reported]
+        if other:
+            table_operations.append((OTHER, merged))
+        for table_arn, counts in table_operations:
+            for operation, count in sorted(counts.items()):
+                operations.add(count, {"table_arn": table_arn, "operation": operation}, "_total")
+
+        reported_tables = {record["table_arn"] for record in reported}
+        other_tables = {record["table_arn"] for record in other}
+        latencies: dict[str, list] = {}
+        for table_arn, histogram in self.latency.snapshot().items():
+            if table_arn in reported_tables:
+                latencies[table_arn] = [histogram]
+            elif table_arn in other_tables:
+                latencies.setdefault(OTHER, []).append(histogram)
+
+        latency = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_operation_latency_seconds",
+            "histogram",
+            "Latency of data plane operations per table",
+        )
+        bounds_us = [int(bound * 1_000_000) for bound in LATENCY_BUCKETS]
+        for table_arn, histograms in sorted(latencies.items()):
+            histogram = merge_histograms(histograms)
+            latency.add_histogram(
+                LATENCY_BUCKETS,
+                histogram.cumulative_counts(bounds_us),
+                histogram.total / 1_000_000,
+                {"table_arn": table_arn},
+            )
+
+        return families + [operations, latency]
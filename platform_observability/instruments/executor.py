@@ -0,0 +1,145 @@
+import threading
+import time
+import weakref
+from concurrent.futures import Executor, Future
+from typing import Callable
+
+from ..openmetrics import METRIC_PREFIX, MetricFamily, families_from_records
+from .core import Channel, Instrument, ListCollector
+from .histogram import Histogram
+
+QUEUE_WAIT_BUCKETS = [0.0001, 0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60]
+"""Bucket bounds (in seconds) of the queue wait histograms in the OpenMetrics exposition."""
+
+
+class InstrumentedExecutor:
+    """
+    Wraps an executor to measure how long submitted tasks wait for a worker thread, and how many tasks are queued
+    and running at any time. All other attributes are delegated to the wrapped executor.
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        name: str,
+        on_submit: Callable[..., None] = None,
+        on_shutdown: Callable[["InstrumentedExecutor"], None] = None,
+    ):
+        self.executor = executor
+        self.name = name
+        self.on_submit = on_submit
+        self.on_shutdown = on_shutdown
+        self.mutex = threading.Lock()
+
+        self.submitted = 0
+        self.completed = 0
+        self.queued = 0
+        self.running = 0
+        # queue wait times are recorded in microseconds
+        self.queue_wait = Histogram()
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        if self.on_submit is not None:
+            self.on_submit(fn, *args, **kwargs)
+        with self.mutex:
+            self.submitted += 1
+            self.queued += 1
+        try:
+            return self.executor.submit(self._run, time.perf_counter_ns(), fn, args, kwargs)
+        except BaseException:
+            with self.mutex:
+                self.queued -= 1
+            raise
+
+    def _run(self, submitted: int, fn: Callable, args: tuple, kwargs: dict):
+        wait = (time.perf_counter_ns() - submitted) // 1000
+        with self.mutex:
+            self.queued -= 1
+            self.running += 1
+            self.queue_wait.record(wait)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self.mutex:
+                self.running -= 1
+                self.completed += 1
+
+    def shutdown(self, *args, **kwargs):
+        try:
+            return self.executor.shutdown(*args, **kwargs)
+        finally:
+            if self.on_shutdown is not None:
+                self.on_shutdown(self)
+
+    def __getattr__(self, name):
+        return getattr(self.executor, name)
+
+    def statistics(self) -> dict:
+        with self.mutex:
+            return {
+                "max_workers": getattr(self.executor, "_max_workers", 0),
+                "queued": self.queued,
+                "running": self.running,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "queue_wait": self.queue_wait.summary(),
+            }
+
+
+class ExecutorStatistics(Instrument):
+    """
+    Reports the saturation (queued and running tasks, and the time tasks wait for a worker) of all executors that
+    were wrapped with ``wrap``, until they are shut down.
+    """
+
+    name = "executors"
+    metric_counters = ("submitted", "completed")
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.executors: weakref.WeakSet[InstrumentedExecutor] = weakref.WeakSet()
+
+    def wrap(
+        self, executor: Executor, name: str, on_submit: Callable[..., None] = None
+    ) -> InstrumentedExecutor:
+        instrumented = InstrumentedExecutor(
+            executor, name, on_submit=on_submit, on_shutdown=self._unregister
+        )
+        with self.mutex:
+            self.executors.add(instrumented)
+        return instrumented
+
+    def _unregister(self, executor: InstrumentedExecutor):
+        with self.mutex:
+            self.executors.discard(executor)
+
+    def measure_and_report(self, channel: Channel) -> None:
+        with self.mutex:
+            executors = list(self.executors)
+        for executor in executors:
+            channel.put({"executor": executor.name, **executor.statistics()})
+
+    def metric_families(self, name: str) -> list[MetricFamily]:
+        # nested queue wait summaries are ignored by the generic conversion
+        collector = ListCollector()
+        self.measure_and_report(collector)
+        families = families_from_records(name, collector.records, self.metric_counters)
+
+        queue_wait = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_queue_wait_seconds",
+            "histogram",
+            "Time tasks wait for a worker thread",
+        )
+        bounds_us = [int(bound * 1_000_000) for bound in QUEUE_WAIT_BUCKETS]
+        with self.mutex:
+            executors = list(self.executors)
+        for executor in executors:
+            with executor.mutex:
+                queue_wait.add_histogram(
+                    QUEUE_WAIT_BUCKETS,
+                    executor.queue_wait.cumulative_counts(bounds_us),
+                    executor.queue_wait.total / 1_000_000,
+                    {"executor": executor.name},
+                )
+
+        return families + [queue_wait]
@@ -0,0 +1,212 @@
+import operator
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Callable, Hashable
+
+from .counters import ThreadShards, discard_keys
+
+SUB_BUCKET_BITS = 4
+"""Each power of two range is split into 2^SUB_BUCKET_BITS linear sub-buckets (~6% relative error)."""
+MAX_VALUE_BITS = 32
+"""Values are clamped to 2^MAX_VALUE_BITS - 1 (with microseconds, roughly 71 minutes)."""
+
+_LINEAR_LIMIT = 1 << (SUB_BUCKET_BITS + 1)
+_MAX_VALUE = (1 << MAX_VALUE_BITS) - 1
+
+
+def _bucket_index(value: int) -> int:
+    if value < _LINEAR_LIMIT:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return (shift << SUB_BUCKET_BITS) + (value >> shift)
+
+
+def _bucket_upper_bound(index: int) -> int:
+    if index < _LINEAR_LIMIT:
+        return index
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    mantissa = index - (shift << SUB_BUCKET_BITS)
+    return ((mantissa + 1) << shift) - 1
+
+
+BUCKET_COUNT = _bucket_index(_MAX_VALUE) + 1
+
+
+class Histogram:
+    """
+    A log-linear (HDR-style) histogram of non-negative integer values with a fixed number of buckets, so its
+    memory footprint is constant regardless of how many values are recorded. Not thread-safe, use
+    ``ShardedHistogram`` to record from multiple threads.
+
+    Merging and percentiles only visit the buckets between the smallest and the largest recorded value, and do
+    so with bulk array operations, since histograms are merged and summarized per series on every scrape.
+    """
+
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * BUCKET_COUNT))
+        self.count = 0
+        self.total = 0
+        self.min = _MAX_VALUE
+        self.max = 0
+
+    def record(self, value: int):
+        if value < 0:
+            value = 0
+        elif value > _MAX_VALUE:
+            value = _MAX_VALUE
+        self.counts[_bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if value < self.min:
+            self.min = value
+
+    def _range(self) -> tuple[int, int]:
+        """Returns the start and end (exclusive) of the buckets that hold values."""
+        return _bucket_index(self.min), _bucket_index(self.max) + 1
+
+    def copy(self) -> "Histogram":
+        histogram = Histogram()
+        histogram.counts = array("Q", self.counts)
+        histogram.count = self.count
+        histogram.total = self.total
+        histogram.min = self.min
+        histogram.max = self.max
+        return histogram
+
+    def merge(self, other: "Histogram"):
+        if not other.count:
+            return
+        start, end = other._range()
+        counts = self.counts
+        if self.count:
+            counts[start:end] = array(
+                "Q", map(operator.add, counts[start:end], other.counts[start:end])
+            )
+        else:
+            counts[start:end] = other.counts[start:end]
+        self.count += other.count
+        self.total += other.total
+        if other.max > self.max:
+            self.max = other.max
+        if other.min < self.min:
+            self.min = other.min
+
+    def percentile(self, percentile: float) -> int:
+        """
+        Returns the value at the given percentile (0-100), i.e., the upper bound of the bucket the value falls
+        into, capped at the largest recorded value.
+        """
+        return self.percentiles([percentile])[0]
+
+    def percentiles(self, percentiles: list[float]) -> list[int]:
+        """Returns the values at the given percentiles (0-100) with a single pass over the buckets."""
+        count = self.count
+        if not count:
+            return [0] * len(percentiles)
+        start, end = self._range()
+        cumulative = list(accumulate(self.counts[start:end]))
+        result = []
+        for percentile in percentiles:
+            rank = max(1, round(count * percentile / 100))
+            index = bisect_left(cumulative, rank)
+            if index < len(cumulative):
+                result.append(min(_bucket_upper_bound(start + index), self.max))
+            else:
+                result.append(self.max)
+        return result
+
+    def cumulative_counts(self, bounds: list[int]) -> list[int]:
+        """
+        Returns the number of recorded values less or equal to each of the given ascending bounds, followed by the
+        total count. Values are attributed to a bound by the upper bound of their bucket.
+        """
+        if not self.count:
+            return [0] * (len(bounds) + 1)
+        start, end = self._range()
+        cumulative = list(accumulate(self.counts[start:end]))
+        result = []
+        seen = 0
+        for bound in bounds:
+            last = _bucket_index(min(max(bound, 0), _MAX_VALUE))
+            if _bucket_upper_bound(last) > bound:
+                last -= 1
+            if last >= start:
+                seen = cumulative[min(last, end - 1) - start]
+            result.append(seen)
+        result.append(max(seen, self.count))
+        return result
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self, scale: int = 1000) -> dict:
+        """
+        Returns the count, mean, common percentiles and max of the histogram, with values divided by ``scale``
+        (by default, microseconds are reported as milliseconds).
+        """
+        p50, p90, p99 = self.percentiles([50, 90, 99])
+        return {
+            "count": self.count,
+            "mean": round(self.mean / scale, 3),
+            "p50": p50 / scale,
+            "p90": p90 / scale,
+            "p99": p99 / scale,
+            "max": self.max / scale,
+        }
+
+
+def _merge_histograms(target: dict, source: dict):
+    for key, histogram in source.copy().items():
+        try:
+            target[key].merge(histogram)
+        except KeyError:
+            target[key] = histogram.copy()
+
+
+class ShardedHistogram:
+    """
+    A set of named histograms that can be recorded into concurrently without locks. Each thread records into its
+    own histograms, which are merged on ``snapshot``.
+    """
+
+    def __init__(self):
+        self.shards: ThreadShards[dict[Hashable, Histogram]] = ThreadShards(dict, _merge_histograms)
+
+    def record(self, key: Hashable, value: int):
+        shard = self.shards.get()
+        try:
+            histogram = shard[key]
+        except KeyError:
+            histogram = shard[key] = Histogram()
+        histogram.record(value)
+
+    def snapshot(self) -> dict[Hashable, Histogram]:
+        """
+        Returns the histograms merged over all shards. Histograms that only a single shard holds are returned as
+        they are instead of being copied, so the result must not be modified (and may still change).
+        """
+        shards: dict[Hashable, list[Histogram]] = {}
+        for shard in self.shards.collect():
+            for key, histogram in shard.copy().items():
+                shards.setdefault(key, []).append(histogram)
+
+        result = {}
+        for key, histograms in shards.items():
+            histogram = histograms[0]
+            if len(histograms) > 1:
+                histogram = histogram.copy()
+                for other in histograms[1:]:
+                    histogram.merge(other)
+            result[key] = histogram
+        return result
+
+    def discard(self, predicate: Callable[[Hashable], bool]):
+        """Removes all histograms whose key matches the predicate, e.g., of deleted resources."""
+        discard_keys(self.shards, predicate)
+
+    def clear(self):
+        self.shards.clear()
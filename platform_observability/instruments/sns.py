@@ -1,51 +1,289 @@
-from collections import defaultdict
-from typing import Iterable
+import time
 
 from localstack.services.sns import publisher
-from localstack.services.sns.models import SnsMessage, SnsSubscription
+from localstack.services.sns.models import SnsMessage, SnsSubscription, sns_stores
 from localstack.services.sns.publisher import (
     PublishDispatcher,
     SnsBatchPublishContext,
     SnsPublishContext,
+    TopicPublisher,
 )
 from localstack.utils.patch import Patches
 
 from platform_observability.instruments import Channel, Instrument
 
+from ..openmetrics import METRIC_PREFIX, MetricFamily, families_from_records
+from .aggregate import LATENCY_BUCKETS
+from .cardinality import OTHER, CardinalityLimit, merge_histograms, merge_records
+from .counters import ShardedCounter
+from .histogram import ShardedHistogram
+
+FAN_OUT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100]
+"""Bucket bounds (in subscriptions) of the fan-out histograms in the OpenMetrics exposition."""
+
+_PUBLISHED = "_observability_published"
+"""Attribute on SNS messages holding the time (perf_counter_ns) they were published to a topic."""
+_FAN_OUT = "_observability_fan_out"
+"""Attribute on SNS messages holding the number of subscriptions they were dispatched to."""
+
+# delivery counter keys, counted per (topic ARN, protocol)
+_DISPATCHED = "dispatched"
+_COMPLETED = "completed"
+_DELIVERED = "delivered"
+_FAILED = "failed"
+
 
 class TopicStatistics(Instrument):
-    def __init__(self):
-        self.topic_publish_count = defaultdict(lambda: 0)
-        self.topic_delivery_count = defaultdict(lambda: 0)
-        self.topic_delivery_failed_count = defaultdict(lambda: 0)
+    """
+    Publishes and deliveries per topic and subscription protocol: the number of subscriptions each message is
+    dispatched to (fan-out), deliveries that are queued or running (in-flight), and the delivery latency from
+    publishing the message until the delivery to the subscription is done, including the time it waits for an SNS
+    publisher thread. All statistics are recorded into sharded counters, since deliveries run concurrently.
+    """
 
-    def iter_topic_arns(self) -> Iterable[str]:
-        topics = set(self.topic_publish_count.keys())
-        yield from topics
+    metric_counters = ("published", "delivered", "failed")
 
-    def measure_and_report(self, channel: Channel) -> None:
-        for topic_arn in self.iter_topic_arns():
-            channel.put(
-                {
-                    "topic_arn": topic_arn,
-                    "published": self.topic_publish_count[topic_arn],
-                    "delivered": self.topic_delivery_count[topic_arn],
-                    "failed": self.topic_delivery_failed_count[topic_arn],
+    def __init__(self, cardinality_limit: CardinalityLimit = None):
+        self.published = ShardedCounter()
+        self.deliveries = ShardedCounter()
+        # latencies are recorded in microseconds
+        self.latency = ShardedHistogram()
+        self.fan_out = ShardedHistogram()
+        self.cardinality_limit = cardinality_limit or CardinalityLimit()
+
+    def clear(self):
+        self.published.clear()
+        self.deliveries.clear()
+        self.latency.clear()
+        self.fan_out.clear()
+
+    def _evict(self, topic_arns: set[str]):
+        """Drops all statistics of the given topics."""
+
+        def _matches(key) -> bool:
+            return (key[0] if isinstance(key, tuple) else key) in topic_arns
+
+        self.published.discard(_matches)
+        self.deliveries.discard(_matches)
+        self.latency.discard(_matches)
+        self.fan_out.discard(_matches)
+
+    def _collect(self) -> tuple[list[dict], list[dict]]:
+        """
+        Returns the records of the topics that are reported individually, and of the topics beyond the cardinality
+        limit. Statistics of deleted topics are evicted. Only the reported records hold latency and fan-out
+        summaries, since summarizing every topic would make a scrape as expensive as if there was no limit.
+        """
+        published = self.published.snapshot()
+        deliveries = self.deliveries.snapshot()
+        latency = self.latency.snapshot()
+        fan_out = self.fan_out.snapshot()
+
+        protocols: dict[str, dict[str, dict]] = {}
+        for (topic_arn, protocol, key), count in deliveries.items():
+            statistics = protocols.setdefault(topic_arn, {}).setdefault(
+                protocol, {_DISPATCHED: 0, _COMPLETED: 0, _DELIVERED: 0, _FAILED: 0}
+            )
+            statistics[key] = count
+
+        topic_arns = set(published) | set(protocols)
+        existing = set()
+        for _, _, store in sns_stores.iter_stores():
+            existing.update(store.topic_subscriptions.keys())
+        deleted = topic_arns - existing
+
+        records = []
+        for topic_arn in sorted(topic_arns - deleted):
+            record = {
+                "topic_arn": topic_arn,
+                "published": published.get(topic_arn, 0),
+                "delivered": 0,
+                "failed": 0,
+                "in_flight": 0,
+                "protocols": {},
+            }
+            for protocol, statistics in sorted(protocols.get(topic_arn, {}).items()):
+                in_flight = max(0, statistics[_DISPATCHED] - statistics[_COMPLETED])
+                record["delivered"] += statistics[_DELIVERED]
+                record["failed"] += statistics[_FAILED]
+                record["in_flight"] += in_flight
+                record["protocols"][protocol] = {
+                    "delivered": statistics[_DELIVERED],
+                    "failed": statistics[_FAILED],
+                    "in_flight": in_flight,
                 }
+            records.append(record)
+
+        # idle topics are not reported, but their statistics are kept, so their counters do not start over.
+        # topics with deliveries in flight are never idle, since their in-flight count is still changing
+        reported, other, _ = self.cardinality_limit.apply(
+            records,
+            "topic_arn",
+            activity=lambda r: r["published"] + r["in_flight"],
+            busy=lambda r: r["in_flight"] > 0,
+        )
+        for record in reported:
+            topic_arn = record["topic_arn"]
+            for protocol, statistics in record["protocols"].items():
+                histogram = latency.get((topic_arn, protocol))
+                statistics["latency"] = histogram.summary() if histogram is not None else None
+            if topic_arn in fan_out:
+                record["fan_out"] = fan_out[topic_arn].summary(scale=1)
+        if deleted:
+            self._evict(deleted)
+        return reported, other
+
+    def measure_and_report(self, channel: Channel) -> None:
+        reported, other = self._collect()
+        for record in reported:
+            channel.put(record)
+        if other:
+            channel.put(merge_records(other, "topic_arn"))
+
+    def metric_families(self, name: str) -> list[MetricFamily]:
+        reported, other = self._collect()
+        records = reported + [merge_records(other, "topic_arn")] if other else reported
+        # nested per-protocol statistics are ignored by the generic conversion
+        families = families_from_records(name, records, self.metric_counters)
+
+        # the per-protocol statistics of the topics beyond the limit are summed up
+        protocols = [(record["topic_arn"], record["protocols"]) for record in reported]
+        if other:
+            merged: dict[str, dict] = {}
+            for record in other:
+                for protocol, statistics in record["protocols"].items():
+                    target = merged.setdefault(
+                        protocol, {"delivered": 0, "failed": 0, "in_flight": 0}
+                    )
+                    for field in target:
+                        target[field] += statistics[field]
+            protocols.append((OTHER, merged))
+
+        deliveries = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_protocol_deliveries",
+            "counter",
+            "Deliveries per topic and subscription protocol",
+        )
+        in_flight = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_protocol_in_flight",
+            "gauge",
+            "Queued and running deliveries per topic and subscription protocol",
+        )
+        for topic_arn, topic_protocols in protocols:
+            for protocol, statistics in topic_protocols.items():
+                labels = {"topic_arn": topic_arn, "protocol": protocol}
+                deliveries.add(
+                    statistics["delivered"], {**labels, "outcome": "delivered"}, "_total"
+                )
+                deliveries.add(statistics["failed"], {**labels, "outcome": "failed"}, "_total")
+                in_flight.add(statistics["in_flight"], labels)
+
+        reported_topics = {record["topic_arn"] for record in reported}
+        other_topics = {record["topic_arn"] for record in other}
+
+        latencies: dict[tuple[str, str], list] = {}
+        for (topic_arn, protocol), histogram in self.latency.snapshot().items():
+            if topic_arn in reported_topics:
+                latencies[(topic_arn, protocol)] = [histogram]
+            elif topic_arn in other_topics:
+                latencies.setdefault((OTHER, protocol), []).append(histogram)
+
+        latency = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_delivery_latency_seconds",
+            "histogram",
+            "Time from publishing a message until its delivery to a subscription is done",
+        )
+        bounds_us = [int(bound * 1_000_000) for bound in LATENCY_BUCKETS]
+        for (topic_arn, protocol), histograms in sorted(latencies.items()):
+            histogram = merge_histograms(histograms)
+            latency.add_histogram(
+                LATENCY_BUCKETS,
+                histogram.cumulative_counts(bounds_us),
+                histogram.total / 1_000_000,
+                {"topic_arn": topic_arn, "protocol": protocol},
             )
 
+        fan_outs: dict[str, list] = {}
+        for topic_arn, histogram in self.fan_out.snapshot().items():
+            if topic_arn in reported_topics:
+                fan_outs[topic_arn] = [histogram]
+            elif topic_arn in other_topics:
+                fan_outs.setdefault(OTHER, []).append(histogram)
+
+        fan_out = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_fan_out",
+            "histogram",
+            "Number of subscriptions a message is dispatched to",
+        )
+        for topic_arn, histograms in sorted(fan_outs.items()):
+            histogram = merge_histograms(histograms)
+            fan_out.add_histogram(
+                FAN_OUT_BUCKETS,
+                histogram.cumulative_counts(FAN_OUT_BUCKETS),
+                histogram.total,
+                {"topic_arn": topic_arn},
+            )
+
+        return families + [deliveries, in_flight, latency, fan_out]
+
     def patches(self) -> Patches:
-        topic_publish_count = self.topic_publish_count
-        topic_delivery_count = self.topic_delivery_count
-        topic_delivery_failed_count = self.topic_delivery_failed_count
+        published = self.published
+        deliveries = self.deliveries
+        latency = self.latency
+        fan_out = self.fan_out
+
+        def _start(message: SnsMessage):
+            setattr(message, _PUBLISHED, time.perf_counter_ns())
+            setattr(message, _FAN_OUT, 0)
 
         def _log_publish_to_topic(fn, self, ctx: SnsPublishContext, topic_arn: str):
-            topic_publish_count[topic_arn] += 1
-            return fn(self, ctx, topic_arn)
+            published.inc(topic_arn)
+            _start(ctx.message)
+            try:
+                return fn(self, ctx, topic_arn)
+            finally:
+                # subscriptions are dispatched synchronously, the deliveries run in the publisher threads
+                fan_out.record(topic_arn, getattr(ctx.message, _FAN_OUT))
 
         def _log_publish_batch_to_topic(fn, self, ctx: SnsBatchPublishContext, topic_arn: str):
-            topic_publish_count[topic_arn] += len(ctx.messages)
-            return fn(self, ctx, topic_arn)
+            published.inc(topic_arn, len(ctx.messages))
+            for message in ctx.messages:
+                _start(message)
+            try:
+                return fn(self, ctx, topic_arn)
+            finally:
+                for message in ctx.messages:
+                    fan_out.record(topic_arn, getattr(message, _FAN_OUT))
+
+        def _log_should_publish(
+            fn,
+            self,
+            subscription_filter_policy: dict,
+            message_ctx: SnsMessage,
+            subscriber: SnsSubscription,
+        ):
+            result = fn(self, subscription_filter_policy, message_ctx, subscriber)
+            # every message that passes is submitted to the publisher threads
+            if result and _PUBLISHED in message_ctx.__dict__:
+                message_ctx.__dict__[_FAN_OUT] += 1
+                deliveries.inc((subscriber["TopicArn"], subscriber["Protocol"], _DISPATCHED))
+            return result
+
+        def _log_publish(fn, self, context: SnsPublishContext, subscriber: SnsSubscription):
+            try:
+                return fn(self, context, subscriber)
+            finally:
+                # messages published to single subscribers (e.g., subscription confirmations) are not tracked
+                messages = getattr(context, "messages", None) or [context.message]
+                now = time.perf_counter_ns()
+                topic_arn = subscriber["TopicArn"]
+                protocol = subscriber["Protocol"]
+                for message in messages:
+                    start = message.__dict__.get(_PUBLISHED)
+                    if start is None:
+                        continue
+                    deliveries.inc((topic_arn, protocol, _COMPLETED))
+                    latency.record((topic_arn, protocol), (now - start) // 1000)
 
         def _log_store_delivery_log(
             fn,
@@ -55,16 +293,15 @@ class TopicStatistics(Instrument):
             topic_attributes: dict[str, str] = None,
             delivery: dict = None,
         ):
-            topic_arn = subscriber["TopicArn"]
-            if success:
-                topic_delivery_count[topic_arn] += 1
-            else:
-                topic_delivery_failed_count[topic_arn] += 1
-
+            deliveries.inc(
+                (subscriber["TopicArn"], subscriber["Protocol"], _DELIVERED if success else _FAILED)
+            )
             return fn(message_context, subscriber, success, topic_attributes, delivery)
 
         patches = Patches()
         patches.function(PublishDispatcher.publish_to_topic, _log_publish_to_topic)
         patches.function(PublishDispatcher.publish_batch_to_topic, _log_publish_batch_to_topic)
+        patches.function(PublishDispatcher._should_publish, _log_should_publish)
+        patches.function(TopicPublisher.publish, _log_publish)
         patches.function(publisher.store_delivery_log, _log_store_delivery_log)
         return patches
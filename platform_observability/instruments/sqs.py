@@ -1,41 +1,386 @@
+import itertools
+import threading
 import time
 from typing import Iterable
 
-from localstack.services.sqs.models import FifoQueue, SqsQueue, StandardQueue, sqs_stores
+from localstack.services.sqs.models import (
+    FifoQueue,
+    MessageGroup,
+    ReceiveMessageResult,
+    SqsMessage,
+    SqsQueue,
+    StandardQueue,
+    sqs_stores,
+)
+from localstack.utils.patch import Patch, Patches
 
 from platform_observability.instruments import Channel, Instrument
 
+from ..openmetrics import METRIC_PREFIX, MetricFamily, families_from_records
+from .aggregate import LATENCY_BUCKETS
+from .cardinality import OTHER, CardinalityLimit, merge_histograms, merge_records
+from .counters import Rates, ShardedCounter
+from .histogram import ShardedHistogram
+
+_VISIBLE_MESSAGES = "_observability_visible_messages"
+"""Attribute on FIFO queues holding the incrementally maintained number of messages in message groups."""
+_QUEUE = "_observability_queue"
+"""Attribute on message groups holding the FIFO queue they belong to."""
+
+_MAX_FIFO_GROUPS = 10
+"""The maximum number of queued message groups looked at for the oldest message of a FIFO queue."""
+
+# message counter keys, counted per queue ARN
+_ENQUEUED = "enqueued"
+_DEQUEUED = "dequeued"
+_DELETED = "deleted"
+
+_COUNTERS = (_ENQUEUED, _DEQUEUED, _DELETED)
+
+
+def _ensure_fifo_visible(queue: FifoQueue) -> int:
+    """
+    Returns the tracked number of visible messages of the FIFO queue. Queues that were created before the patches
+    were applied (e.g., restored from persistence) are counted once. Must be called with the queue mutex held.
+    """
+    try:
+        return queue.__dict__[_VISIBLE_MESSAGES]
+    except KeyError:
+        visible = sum(len(group.messages) for group in list(queue.message_groups.values()))
+        setattr(queue, _VISIBLE_MESSAGES, visible)
+        return visible
+
+
+def count_visible_messages(queue: SqsQueue) -> int:
+    """
+    Returns the number of visible messages in the queue in O(1). For FIFO queues this is the number of
+    messages held in message groups, maintained by the ``QueueStatistics`` patches.
+    """
+    if isinstance(queue, FifoQueue):
+        try:
+            return max(0, queue.__dict__[_VISIBLE_MESSAGES])
+        except KeyError:
+            with queue.mutex:
+                return _ensure_fifo_visible(queue)
+    if isinstance(queue, StandardQueue):
+        return queue.visible.qsize()
+    raise ValueError("unknown queue type")
+
+
+def _oldest_fifo_message(queue: FifoQueue) -> SqsMessage | None:
+    """
+    Returns the oldest message of the first message group that can be received. Groups are queued in the order
+    they become visible, so its messages are (approximately) the ones that wait the longest. Groups that became
+    empty stay in the group queue until a receive skips them, so a few groups are looked at.
+    """
+    group_queue = queue.message_group_queue
+    with group_queue.mutex:
+        groups = list(itertools.islice(group_queue.queue, _MAX_FIFO_GROUPS))
+    for group in groups:
+        # the groups are read without the queue mutex, so their heaps can change meanwhile
+        try:
+            message = group.messages[0]
+        except IndexError:
+            continue
+        # messages deleted with an expired receipt handle can stay at the head of a message group until received
+        if not message.deleted:
+            return message
+    return None
+
+
+def oldest_message_age(queue: SqsQueue, now: float) -> float:
+    """
+    Returns the age in seconds of the oldest visible message in the queue, or 0 if there is none. Only the head of
+    the visible heap of standard queues, and of the first message groups of FIFO queues is looked at, without
+    holding the queue mutex.
+    """
+    if isinstance(queue, FifoQueue):
+        oldest = _oldest_fifo_message(queue)
+    elif isinstance(queue, StandardQueue):
+        with queue.visible.mutex:
+            heads = queue.visible.queue[:1]
+        oldest = heads[0] if heads else None
+    else:
+        raise ValueError("unknown queue type")
+
+    if oldest is None:
+        return 0.0
+    return round(max(0.0, now - oldest.created), 3)
+
 
 class QueueStatistics(Instrument):
+    """
+    Messages per queue: the visible, invisible (in flight) and delayed messages, the messages enqueued (sent),
+    dequeued (received) and deleted, with their rates per second, the age of the oldest visible message, and the
+    latency from receiving a message until it is deleted. A queue that is stuck has an increasing message age and
+    no dequeue rate, even if its number of messages is the same as the one of a queue with a high throughput.
+    """
+
+    metric_counters = _COUNTERS
+
+    def __init__(self, cardinality_limit: CardinalityLimit = None, rate_interval: float = 1):
+        """
+        :param cardinality_limit: bounds the number of reported queues
+        :param rate_interval: the minimum number of seconds between the samples that rates are computed from, so
+            readers that measure right after each other do not see rates over tiny intervals
+        """
+        self.cardinality_limit = cardinality_limit or CardinalityLimit()
+        self.counter = ShardedCounter()
+        self.rates = Rates(rate_interval)
+        # latencies are recorded in microseconds
+        self.delete_latency = ShardedHistogram()
+
     def iter_queues(self) -> Iterable[SqsQueue]:
         for _, _, store in sqs_stores.iter_stores():
-            for queue in store.queues.values():
+            for queue in list(store.queues.values()):
                 yield queue
 
-    def measure_and_report(self, channel: Channel) -> None:
+    def reset(self):
+        """
+        Discards the tracked number of visible messages of all FIFO queues, so they are recounted once on their
+        next use. Must be called when the patches are (re-)applied, since the counts are not maintained without them.
+        """
         for queue in self.iter_queues():
-            delayed = len(queue.delayed)
-            if isinstance(queue, StandardQueue):
-                visible = queue.visible.qsize()
-                invisible = len(queue.inflight)
-            elif isinstance(queue, FifoQueue):
-                visible = 0
-                invisible = 0
-
-                for message_group in queue.message_group_queue.queue:
-                    visible += len(message_group.messages)
-
-                for message_group in queue.inflight_groups:
-                    invisible += len(message_group.messages)
-
-            else:
-                raise ValueError("unknown queue type")
-
-            channel.put(
-                {
-                    "queue": queue.arn,
-                    "visible": visible,
-                    "invisible": invisible,
-                    "delayed": delayed,
-                }
+            if isinstance(queue, FifoQueue):
+                with queue.mutex:
+                    queue.__dict__.pop(_VISIBLE_MESSAGES, None)
+
+    def clear(self):
+        self.counter.clear()
+        self.delete_latency.clear()
+        self.rates.clear()
+
+    def _evict(self, queue_arns: set[str]):
+        """Drops all statistics of the given queues."""
+
+        def _matches(key) -> bool:
+            return (key[0] if isinstance(key, tuple) else key) in queue_arns
+
+        self.counter.discard(_matches)
+        self.delete_latency.discard(_matches)
+        self.rates.discard(queue_arns)
+
+    def _collect(self) -> tuple[list[dict], list[dict]]:
+        """
+        Returns the records of the queues that are reported individually, and of the queues beyond the cardinality
+        limit. Statistics of deleted queues are evicted. Only the reported records hold latency summaries.
+        """
+        counts = self.counter.snapshot()
+        latency = self.delete_latency.snapshot()
+        now = time.time()
+        monotonic = time.monotonic()
+
+        records = []
+        for queue in self.iter_queues():
+            queue_arn = queue.arn
+            counters = tuple(counts.get((queue_arn, key), 0) for key in _COUNTERS)
+            enqueue_rate, dequeue_rate, delete_rate = self.rates.update(
+                queue_arn, counters, monotonic
+            )
+            record = {
+                "queue": queue_arn,
+                "visible": count_visible_messages(queue),
+                "invisible": len(queue.inflight),
+                "delayed": len(queue.delayed),
+                _ENQUEUED: counters[0],
+                _DEQUEUED: counters[1],
+                _DELETED: counters[2],
+                "enqueue_rate": enqueue_rate,
+                "dequeue_rate": dequeue_rate,
+                "delete_rate": delete_rate,
+                "oldest_message_age": oldest_message_age(queue, now),
+            }
+            records.append(record)
+        existing = {record["queue"] for record in records}
+        deleted = (self.rates.keys() | {key[0] for key in counts}) - existing
+
+        # deleted queues are not reported anymore, idle empty queues are left out until they receive messages (and
+        # keep their statistics, so their counters do not start over)
+        reported, other, _ = self.cardinality_limit.apply(
+            records,
+            "queue",
+            activity=lambda r: r["visible"] + r["invisible"] + r["delayed"] + r["enqueue_rate"],
+            busy=lambda r: r["visible"] + r["invisible"] + r["delayed"] > 0,
+        )
+        for record in reported:
+            histogram = latency.get(record["queue"])
+            record["delete_latency"] = histogram.summary() if histogram is not None else None
+        if deleted:
+            self._evict(deleted)
+        return reported, other
+
+    def measure_and_report(self, channel: Channel) -> None:
+        reported, other = self._collect()
+        for record in reported:
+            channel.put(record)
+        if other:
+            channel.put(merge_records(other, "queue"))
+
+    def metric_families(self, name: str) -> list[MetricFamily]:
+        reported, other = self._collect()
+        records = reported + [merge_records(other, "queue")] if other else reported
+        # nested latency summaries are ignored by the generic conversion
+        families = families_from_records(name, records, self.metric_counters)
+
+        reported_queues = {record["queue"] for record in reported}
+        other_queues = {record["queue"] for record in other}
+        latencies: dict[str, list] = {}
+        for queue_arn, histogram in self.delete_latency.snapshot().items():
+            if queue_arn in reported_queues:
+                latencies[queue_arn] = [histogram]
+            elif queue_arn in other_queues:
+                latencies.setdefault(OTHER, []).append(histogram)
+
+        latency = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_receive_to_delete_seconds",
+            "histogram",
+            "Time from receiving a message until it is deleted",
+        )
+        bounds_us = [int(bound * 1_000_000) for bound in LATENCY_BUCKETS]
+        for queue_arn, histograms in sorted(latencies.items()):
+            histogram = merge_histograms(histograms)
+            latency.add_histogram(
+                LATENCY_BUCKETS,
+                histogram.cumulative_counts(bounds_us),
+                histogram.total / 1_000_000,
+                {"queue": queue_arn},
+            )
+
+        return families + [latency]
+
+    def patches(self) -> Patches:
+        """
+        Patches that count the messages sent to, received from and deleted from queues, and record the time from
+        receiving a message until it is deleted. They also keep the number of visible messages of FIFO queues up
+        to date as messages move in and out of their message groups, so it does not have to be computed by
+        iterating over all groups. Standard queues already track all their sizes in O(1).
+        """
+        # set while a FIFO queue removes expired messages from its message group heaps
+        expiring = threading.local()
+        counter = self.counter
+        delete_latency = self.delete_latency
+
+        def _count_dequeued(queue: SqsQueue, result: ReceiveMessageResult):
+            if result.successful:
+                counter.inc((queue.arn, _DEQUEUED), len(result.successful))
+
+        def _count_deleted(queue: SqsQueue, message: SqsMessage):
+            queue_arn = queue.arn
+            counter.inc((queue_arn, _DELETED))
+            if message.last_received is not None:
+                delete_latency.record(
+                    queue_arn, max(0, int((time.time() - message.last_received) * 1_000_000))
+                )
+
+        def _count_put(fn, self, *args, **kwargs) -> SqsMessage:
+            message = fn(self, *args, **kwargs)
+            counter.inc((self.arn, _ENQUEUED))
+            return message
+
+        def _count_fifo_put(fn, self, *args, **kwargs) -> SqsMessage:
+            message = fn(self, *args, **kwargs)
+            # duplicates are accepted, but not enqueued
+            if self.deduplication.get(message.message_deduplication_id) is message:
+                counter.inc((self.arn, _ENQUEUED))
+            return message
+
+        def _count_receive(fn, self, *args, **kwargs) -> ReceiveMessageResult:
+            result = fn(self, *args, **kwargs)
+            _count_dequeued(self, result)
+            return result
+
+        def _count_remove_message(fn, self, message: SqsMessage):
+            # only called for messages that are actually deleted (with a valid receipt handle)
+            _count_deleted(self, message)
+            return fn(self, message)
+
+        def _add_visible(queue: FifoQueue, delta: int):
+            setattr(queue, _VISIBLE_MESSAGES, queue.__dict__.get(_VISIBLE_MESSAGES, 0) + delta)
+
+        def _init_queue(fn, self, *args, **kwargs):
+            fn(self, *args, **kwargs)
+            setattr(self, _VISIBLE_MESSAGES, 0)
+
+        def _link_message_group(fn, self, message_group_id: str) -> MessageGroup:
+            message_group = fn(self, message_group_id)
+            message_group.__dict__[_QUEUE] = self
+            return message_group
+
+        def _track_push(fn, self, message: SqsMessage):
+            # called by FifoQueue._put_message with the queue mutex held, right after it looked up the group.
+            # _put_message itself is not patched here, since the lambda_sqs tracer patches it as well.
+            queue = self.__dict__.get(_QUEUE)
+            if queue is None:
+                return fn(self, message)
+            _ensure_fifo_visible(queue)
+            fn(self, message)
+            _add_visible(queue, 1)
+
+        def _track_receive(fn, self, *args, **kwargs) -> ReceiveMessageResult:
+            if _VISIBLE_MESSAGES not in self.__dict__:
+                with self.mutex:
+                    _ensure_fifo_visible(self)
+            result = fn(self, *args, **kwargs)
+            # messages that were received with a visibility timeout of 0 are put back through _put_message
+            with self.mutex:
+                _add_visible(self, -(len(result.successful) + len(result.dead_letter_messages)))
+            _count_dequeued(self, result)
+            return result
+
+        def _track_remove_message(fn, self, message: SqsMessage):
+            # deleting a message with an expired receipt handle after it was re-queued. the message is marked as
+            # deleted but stays in its message group until it is popped (and skipped) by receive.
+            with self.mutex:
+                _ensure_fifo_visible(self)
+                if message not in self.inflight:
+                    group = self.message_groups.get(message.message_group_id)
+                    if group is not None and message in group.messages:
+                        _add_visible(self, -1)
+                _count_deleted(self, message)
+                return fn(self, message)
+
+        def _track_remove_expired_messages(fn, self):
+            with self.mutex:
+                _ensure_fifo_visible(self)
+                expiring.queue = self
+                try:
+                    return fn(self)
+                finally:
+                    expiring.queue = None
+
+        def _count_expired_messages(heap: list[SqsMessage], message_retention_period: int):
+            expired = remove_expired_messages_from_heap(heap, message_retention_period)
+            queue = getattr(expiring, "queue", None)
+            if queue is not None and expired:
+                # deleted messages were already subtracted when they were removed
+                _add_visible(queue, -sum(1 for message in expired if not message.deleted))
+            return expired
+
+        def _track_clear(fn, self):
+            with self.mutex:
+                fn(self)
+                setattr(self, _VISIBLE_MESSAGES, 0)
+
+        remove_expired_messages_from_heap = SqsQueue.remove_expired_messages_from_heap
+
+        patches = Patches()
+        patches.function(StandardQueue.put, _count_put)
+        patches.function(StandardQueue.receive, _count_receive)
+        patches.function(StandardQueue._on_remove_message, _count_remove_message)
+        patches.function(FifoQueue.put, _count_fifo_put)
+        patches.function(FifoQueue.__init__, _init_queue)
+        patches.function(FifoQueue.get_message_group, _link_message_group)
+        patches.function(MessageGroup.push, _track_push)
+        patches.function(FifoQueue.receive, _track_receive)
+        patches.function(FifoQueue._on_remove_message, _track_remove_message)
+        patches.function(FifoQueue.remove_expired_messages, _track_remove_expired_messages)
+        patches.function(FifoQueue.clear, _track_clear)
+        # a static method, so it cannot go through Patch.function, which would turn it into a bound method
+        patches.add(
+            Patch(
+                SqsQueue,
+                "remove_expired_messages_from_heap",
+                staticmethod(_count_expired_messages),
             )
+        )
+        return patches
@@ -0,0 +1,176 @@
+import gc
+import os
+import re
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+
+from ..openmetrics import METRIC_PREFIX, MetricFamily, families_from_records
+from .core import Channel, Instrument
+from .histogram import Histogram
+
+GC_PAUSE_BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1]
+"""Bucket bounds (in seconds) of the GC pause histograms in the OpenMetrics exposition."""
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# ids and counters in thread names, e.g., ThreadPoolExecutor-3_0 or Thread-12 (run)
+_THREAD_NAME_ID = re.compile(r"[-_]?\d+")
+
+
+def thread_group(name: str) -> str:
+    """Returns the name of a thread without ids, so threads of the same pool are counted together."""
+    return _THREAD_NAME_ID.sub("", name) or name
+
+
+def _read_rss() -> int | None:
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _count_open_fds() -> int | None:
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def _max_rss() -> int:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class SystemMetrics(Instrument):
+    """
+    Resource usage of the LocalStack process: memory, CPU time, file descriptors, threads (grouped by name) and
+    garbage collections. The values are read from ``/proc/self`` (where available) in ``sample``, which is called
+    by the background scheduler, and reporting returns the last sample, so requests never read ``/proc``.
+    """
+
+    name = "system"
+    metric_counters = ("cpu_user_seconds", "cpu_system_seconds", "gc_pause_seconds")
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.record: dict | None = None
+        self._last_cpu: tuple[float, float] | None = None
+
+        # pause times are recorded in microseconds. only the gc callback writes, and collections never overlap
+        self.gc_pauses = [Histogram() for _ in range(len(gc.get_stats()))]
+        self._gc_start = 0
+
+    def start(self):
+        """Starts measuring GC pauses."""
+        if self._on_gc not in gc.callbacks:
+            gc.callbacks.append(self._on_gc)
+
+    def stop(self):
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+
+    def _on_gc(self, phase: str, info: dict):
+        if phase == "start":
+            self._gc_start = time.perf_counter_ns()
+        else:
+            self.gc_pauses[info["generation"]].record(
+                (time.perf_counter_ns() - self._gc_start) // 1000
+            )
+
+    def sample(self):
+        now = time.monotonic()
+        times = os.times()
+        cpu = times.user + times.system
+
+        threads = Counter(thread_group(thread.name) for thread in threading.enumerate())
+
+        gc_generations = []
+        for generation, stats in enumerate(gc.get_stats()):
+            pauses = self.gc_pauses[generation]
+            gc_generations.append(
+                {
+                    "generation": generation,
+                    "collections": stats["collections"],
+                    "collected": stats["collected"],
+                    "uncollectable": stats["uncollectable"],
+                    "pause": pauses.summary(),
+                }
+            )
+
+        with self.mutex:
+            if self._last_cpu is None:
+                cpu_utilization = 0.0
+            else:
+                last_time, last_cpu = self._last_cpu
+                elapsed = now - last_time
+                cpu_utilization = round((cpu - last_cpu) / elapsed, 3) if elapsed > 0 else 0.0
+            self._last_cpu = (now, cpu)
+
+            rss = _read_rss()
+            self.record = {
+                "active_thread_count": sum(threads.values()),
+                "rss_bytes": rss,
+                # the kernel updates the peak lazily, so it can lag behind the current value
+                "max_rss_bytes": max(rss or 0, _max_rss()),
+                "cpu_user_seconds": times.user,
+                "cpu_system_seconds": times.system,
+                # fraction of one core since the previous sample
+                "cpu_utilization": cpu_utilization,
+                "open_fds": _count_open_fds(),
+                "gc_pause_seconds": sum(p.total for p in self.gc_pauses) / 1_000_000,
+                "threads": dict(threads.most_common()),
+                "gc": gc_generations,
+            }
+
+    def _latest(self) -> dict:
+        if self.record is None:
+            self.sample()
+        return self.record
+
+    def measure_and_report(self, channel: Channel) -> None:
+        channel.put(self._latest())
+
+    def metric_families(self, name: str) -> list[MetricFamily]:
+        record = self._latest()
+
+        # nested thread and gc statistics are ignored by the generic conversion
+        families = families_from_records(
+            name,
+            [{k: v for k, v in record.items() if v is not None}],
+            self.metric_counters,
+        )
+
+        threads = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_threads", "gauge", "Live threads per thread name"
+        )
+        for thread_name, count in record["threads"].items():
+            threads.add(count, {"thread_name": thread_name})
+
+        collections = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_gc_collections", "counter", "Garbage collections"
+        )
+        collected = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_gc_collected", "counter", "Objects collected by the GC"
+        )
+        pause = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_gc_pause_duration_seconds", "histogram", "GC pause times"
+        )
+        bounds_us = [int(bound * 1_000_000) for bound in GC_PAUSE_BUCKETS]
+        for generation in record["gc"]:
+            labels = {"generation": str(generation["generation"])}
+            collections.add(generation["collections"], labels, "_total")
+            collected.add(generation["collected"], labels, "_total")
+            pauses = self.gc_pauses[generation["generation"]]
+            pause.add_histogram(
+                GC_PAUSE_BUCKETS,
+                pauses.cumulative_counts(bounds_us),
+                pauses.total / 1_000_000,
+                labels,
+            )
+
+        return families + [threads, collections, collected, pause]
@@ -0,0 +1,180 @@
+"""
+Rendering of instrument data in the OpenMetrics text exposition format
+(https://github.com/OpenObservability/OpenMetrics/blob/main/specification/OpenMetrics.md).
+"""
+import gzip
+import math
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Iterable
+
+if TYPE_CHECKING:
+    from .instruments.core import Instrument
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+METRIC_PREFIX = "localstack"
+
+Labels = dict[str, str]
+
+
+class MetricFamily:
+    """A named metric of a given OpenMetrics type (counter, gauge, histogram) with all its samples."""
+
+    name: str
+    type: str
+    help: str
+    samples: list[tuple[str, Labels, float]]
+
+    def __init__(self, name: str, type: str, help: str = ""):
+        self.name = name
+        self.type = type
+        self.help = help
+        self.samples = []
+
+    def add(self, value: float, labels: Labels = None, suffix: str = ""):
+        """
+        Adds a sample to the family.
+
+        :param value: the sample value
+        :param labels: the labels of the sample
+        :param suffix: the sample name suffix, e.g., ``_total`` for counters or ``_bucket`` for histograms
+        """
+        self.samples.append((suffix, labels or {}, value))
+
+    def add_histogram(
+        self, bounds: list[float], cumulative_counts: list[int], total: float, labels: Labels = None
+    ):
+        """
+        Adds all samples of one histogram to the family.
+
+        :param bounds: the upper bounds of the buckets (without +Inf)
+        :param cumulative_counts: the number of observations less or equal to each bound, plus the total count
+        :param total: the sum of all observations
+        :param labels: the labels of the histogram
+        """
+        labels = labels or {}
+        for bound, count in zip(bounds, cumulative_counts):
+            self.add(count, {**labels, "le": _format_value(bound)}, "_bucket")
+        self.add(cumulative_counts[-1], {**labels, "le": "+Inf"}, "_bucket")
+        self.add(cumulative_counts[-1], labels, "_count")
+        self.add(total, labels, "_sum")
+
+
+def families_from_records(
+    instrument_name: str, records: list[dict], counters: Iterable[str] = ()
+) -> list[MetricFamily]:
+    """
+    Generic conversion of instrument records into metric families. String fields of a record become labels of all
+    numeric fields in the same record, nested values are ignored. Numeric fields are gauges, unless listed in
+    ``counters``.
+
+    :param instrument_name: the name of the instrument, used as part of the metric name
+    :param records: the records reported by the instrument
+    :param counters: the names of the fields that are monotonic counters
+    :return: a list of metric families
+    """
+    counters = set(counters)
+    families: dict[str, MetricFamily] = {}
+
+    for record in records:
+        labels = {k: v for k, v in record.items() if isinstance(v, str)}
+        for field, value in record.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{METRIC_PREFIX}_{instrument_name}_{field}"
+            try:
+                family = families[name]
+            except KeyError:
+                metric_type = "counter" if field in counters else "gauge"
+                family = families[name] = MetricFamily(name, metric_type)
+            family.add(value, labels, "_total" if family.type == "counter" else "")
+
+    return list(families.values())
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def render(families: Iterable[MetricFamily]) -> str:
+    lines = []
+    for family in families:
+        lines.append(f"# TYPE {family.name} {family.type}")
+        if family.help:
+            lines.append(f"# HELP {family.name} {family.help}")
+        for suffix, labels, value in family.samples:
+            if labels:
+                label_str = ",".join(
+                    f'{key}="{_escape_label_value(str(val))}"' for key, val in labels.items()
+                )
+                lines.append(f"{family.name}{suffix}{{{label_str}}} {_format_value(value)}")
+            else:
+                lines.append(f"{family.name}{suffix} {_format_value(value)}")
+    lines.append("# EOF")
+    lines.append("")
+    return "\n".join(lines)
+
+
+def render_instruments(instruments: dict[str, "Instrument"]) -> str:
+    families = []
+    for name, instrument in instruments.items():
+        families.extend(instrument.metric_families(name))
+    return render(families)
+
+
+class Snapshot:
+    """An immutable rendered document, which lazily caches its gzip-compressed form."""
+
+    body: bytes
+    created: float
+
+    def __init__(self, body: bytes, created: float):
+        self.body = body
+        self.created = created
+        self._gzipped = None
+        self._mutex = threading.Lock()
+
+    @property
+    def gzipped(self) -> bytes:
+        if self._gzipped is None:
+            with self._mutex:
+                if self._gzipped is None:
+                    self._gzipped = gzip.compress(self.body, compresslevel=6)
+        return self._gzipped
+
+
+class SnapshotCache:
+    """
+    Renders a document at most once per ``max_age`` seconds and shares it between all concurrent readers. If the
+    snapshot is stale, the first reader renders a new one while all others wait for it, instead of rendering the
+    same document in parallel.
+    """
+
+    def __init__(self, render: Callable[[], bytes], max_age: float):
+        self.render = render
+        self.max_age = max_age
+        self.mutex = threading.Lock()
+        self._snapshot: Snapshot | None = None
+
+    def get(self) -> Snapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - snapshot.created < self.max_age:
+            return snapshot
+
+        with self.mutex:
+            snapshot = self._snapshot
+            if snapshot is not None and time.monotonic() - snapshot.created < self.max_age:
+                return snapshot
+
+            snapshot = Snapshot(self.render(), time.monotonic())
+            self._snapshot = snapshot
+            return snapshot
@@ -0,0 +1,360 @@
+"""
+Self-instrumentation: the cost of the extension itself, reported as the ``observability`` instrument.
+"""
+import itertools
+import threading
+import time
+from typing import Callable
+
+from localstack.utils.patch import Patches, create_patch_proxy
+from localstack.utils.scheduler import ScheduledTask, Scheduler
+
+from .instruments.aggregate import LATENCY_BUCKETS
+from .instruments.core import Channel, Instrument
+from .instruments.counters import ShardedCounter
+from .instruments.histogram import Histogram, ShardedHistogram
+from .openmetrics import METRIC_PREFIX, MetricFamily, families_from_records
+from .tracing.buffer import TraceBuffer
+
+_BOUNDS_US = [int(bound * 1_000_000) for bound in LATENCY_BUCKETS]
+
+
+class TimedLock:
+    """
+    A lock (or reentrant lock) that measures how long threads wait to acquire it. Only contended acquisitions are
+    timed, so acquiring a free lock costs one additional non-blocking acquire. The statistics are updated while
+    holding the lock, so they need no synchronization of their own.
+    """
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.acquisitions = 0
+        self.contended = 0
+        # wait times are recorded in microseconds
+        self.wait = Histogram()
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        lock = self.lock
+        if lock.acquire(False):
+            self.acquisitions += 1
+            return True
+        if not blocking:
+            return False
+
+        start = time.perf_counter_ns()
+        if not lock.acquire(True, timeout):
+            return False
+        self.acquisitions += 1
+        self.contended += 1
+        self.wait.record((time.perf_counter_ns() - start) // 1000)
+        return True
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.lock.release()
+
+
+class _TimedInstrument(Instrument):
+    """Delegates to an instrument, and records how long its reports take."""
+
+    def __init__(self, instrument: Instrument, name: str, durations: ShardedHistogram):
+        self.instrument = instrument
+        self.name = name
+        self.durations = durations
+        self.metric_counters = instrument.metric_counters
+
+    def measure_and_report(self, channel: Channel) -> None:
+        start = time.perf_counter_ns()
+        try:
+            self.instrument.measure_and_report(channel)
+        finally:
+            self.durations.record((self.name, "report"), (time.perf_counter_ns() - start) // 1000)
+
+    def metric_families(self, name: str) -> list[MetricFamily]:
+        start = time.perf_counter_ns()
+        try:
+            return self.instrument.metric_families(name)
+        finally:
+            self.durations.record(
+                (self.name, "openmetrics"), (time.perf_counter_ns() - start) // 1000
+            )
+
+
+class OverheadStatistics(Instrument):
+    """
+    Measures the cost of the extension itself: the time spent in the patches (excluding the patched functions they
+    call), the time instruments take to report, how late the tasks of the background scheduler run, the sizes of
+    the trace buffers, and the time threads wait for the locks of the tracers.
+
+    Patches are timed for every ``1 / sample_rate``-th call only, so the cost of the other calls is incrementing a
+    counter. Calls and time of the patches are extrapolated from the timed calls.
+    """
+
+    name = "observability"
+    metric_counters = ("patch_time_seconds",)
+
+    def __init__(self, sample_rate: float = 0.01):
+        """
+        :param sample_rate: the fraction of patch calls that are timed (0 disables timing the patches)
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        self.sample_rate = sample_rate
+        self.sample_every = round(1 / sample_rate) if sample_rate else 0
+        self.mutex = threading.Lock()
+
+        # patch name -> number of timed calls, and their time spent in the patch in nanoseconds
+        self.patch_samples = ShardedCounter()
+        self.patch_time = ShardedCounter()
+        self.patch_names: list[str] = []
+        # (instrument, operation) -> durations in microseconds
+        self.instrument_durations = ShardedHistogram()
+        # task -> lags and durations in microseconds, only recorded by the scheduler thread
+        self.task_lag: dict[str, Histogram] = {}
+        self.task_duration: dict[str, Histogram] = {}
+        self.buffers: dict[str, TraceBuffer] = {}
+        self.locks: dict[str, TimedLock] = {}
+
+    def timed_patches(self, component: str, patches: Patches) -> Patches:
+        """
+        Replaces the functions of the given (not yet applied) patches with timed ones. The patches are modified in
+        place, since patch functions can refer to their own patch objects.
+        """
+        if not self.sample_every:
+            return patches
+
+        for patch in patches.patches:
+            subject = getattr(patch.new, "__subject__", None)
+            if subject is None:
+                # patches that are not created with Patch.function (e.g., of static methods) do not pass the
+                # patched function, so the time spent in it cannot be told apart
+                continue
+            owner = getattr(patch.obj, "__name__", type(patch.obj).__name__).rsplit(".", 1)[-1]
+            name = f"{component}:{owner}.{patch.name}"
+            self.patch_names.append(name)
+            patch.new = create_patch_proxy(patch.old, self._timed(name, subject))
+        return patches
+
+    def _timed(self, name: str, fn: Callable) -> Callable:
+        every = self.sample_every
+        calls = itertools.count(1)
+        samples = self.patch_samples
+        time_ns = self.patch_time
+
+        def _timed_patch(target, *args, **kwargs):
+            if next(calls) % every:
+                return fn(target, *args, **kwargs)
+
+            inner = 0
+
+            def _target(*target_args, **target_kwargs):
+                nonlocal inner
+                start = time.perf_counter_ns()
+                try:
+                    return target(*target_args, **target_kwargs)
+                finally:
+                    inner += time.perf_counter_ns() - start
+
+            start = time.perf_counter_ns()
+            try:
+                return fn(_target, *args, **kwargs)
+            finally:
+                samples.inc(name)
+                time_ns.inc(name, time.perf_counter_ns() - start - inner)
+
+        return _timed_patch
+
+    def timed_instrument(self, name: str, instrument: Instrument) -> Instrument:
+        return _TimedInstrument(instrument, name, self.instrument_durations)
+
+    def timed_lock(self, name: str, lock) -> TimedLock:
+        """Returns a timed replacement for the given lock, which must not be held yet."""
+        timed = self.locks[name] = TimedLock(lock)
+        return timed
+
+    def add_buffer(self, name: str, buffer: TraceBuffer):
+        self.buffers[name] = buffer
+
+    def schedule(
+        self, scheduler: Scheduler, name: str, func: Callable[[], None], period: float
+    ) -> ScheduledTask:
+        """Schedules a periodic task, and records how late each run starts and how long it takes."""
+        with self.mutex:
+            lag = self.task_lag.setdefault(name, Histogram())
+            duration = self.task_duration.setdefault(name, Histogram())
+
+        def _run():
+            lag.record(int((time.time() - task.deadline) * 1_000_000))
+            start = time.perf_counter_ns()
+            try:
+                func()
+            finally:
+                duration.record((time.perf_counter_ns() - start) // 1000)
+
+        task = ScheduledTask(_run, period=period)
+        scheduler.schedule_task(task)
+        return task
+
+    def _patches(self) -> dict[str, dict]:
+        samples = self.patch_samples.snapshot()
+        time_ns = self.patch_time.snapshot()
+        every = self.sample_every
+        patches = {}
+        for name in self.patch_names:
+            sampled = samples.get(name, 0)
+            patches[name] = {
+                "calls": sampled * every,
+                "sampled": sampled,
+                "time_seconds": time_ns.get(name, 0) * every / 1_000_000_000,
+                "mean_us": round(time_ns.get(name, 0) / sampled / 1000, 3) if sampled else 0.0,
+            }
+        return patches
+
+    def measure_and_report(self, channel: Channel) -> None:
+        patches = self._patches()
+        instruments = {}
+        for (name, operation), histogram in sorted(self.instrument_durations.snapshot().items()):
+            instruments.setdefault(name, {})[operation] = histogram.summary()
+
+        with self.mutex:
+            tasks = {
+                name: {"lag": lag.summary(), "duration": self.task_duration[name].summary()}
+                for name, lag in self.task_lag.items()
+            }
+
+        channel.put(
+            {
+                "sample_rate": self.sample_rate,
+                "patch_time_seconds": sum(patch["time_seconds"] for patch in patches.values()),
+                "patches": patches,
+                "instruments": instruments,
+                "scheduler": tasks,
+                "buffers": {
+                    name: {
+                        "buffered": len(buffer),
+                        "capacity": buffer.capacity,
+                        "high_watermark": buffer.high_watermark,
+                    }
+                    for name, buffer in self.buffers.items()
+                },
+                "locks": {
+                    name: {
+                        "acquisitions": lock.acquisitions,
+                        "contended": lock.contended,
+                        "wait": lock.wait.summary(),
+                    }
+                    for name, lock in self.locks.items()
+                },
+            }
+        )
+
+    def metric_families(self, name: str) -> list[MetricFamily]:
+        patches = self._patches()
+        families = families_from_records(
+            name,
+            [
+                {
+                    "sample_rate": self.sample_rate,
+                    "patch_time_seconds": sum(p["time_seconds"] for p in patches.values()),
+                }
+            ],
+            self.metric_counters,
+        )
+
+        # nested statistics are ignored by the generic conversion
+        calls = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_patch_calls", "counter", "Calls of a patch (extrapolated)"
+        )
+        time_spent = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_patch_seconds",
+            "counter",
+            "Time spent in a patch, excluding the patched function (extrapolated)",
+        )
+        for patch_name, patch in patches.items():
+            calls.add(patch["calls"], {"patch": patch_name}, "_total")
+            time_spent.add(patch["time_seconds"], {"patch": patch_name}, "_total")
+
+        instruments = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_instrument_duration_seconds",
+            "histogram",
+            "Time an instrument takes to report its records or metric families",
+        )
+        for (instrument, operation), histogram in sorted(
+            self.instrument_durations.snapshot().items()
+        ):
+            instruments.add_histogram(
+                LATENCY_BUCKETS,
+                histogram.cumulative_counts(_BOUNDS_US),
+                histogram.total / 1_000_000,
+                {"instrument": instrument, "operation": operation},
+            )
+
+        lag = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_scheduler_lag_seconds",
+            "histogram",
+            "Time a background task starts after it was due",
+        )
+        duration = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_scheduler_task_duration_seconds",
+            "histogram",
+            "Time a background task runs",
+        )
+        with self.mutex:
+            tasks = [
+                (task, self.task_lag[task], self.task_duration[task]) for task in self.task_lag
+            ]
+        for task, task_lag, task_duration in tasks:
+            for family, histogram in ((lag, task_lag), (duration, task_duration)):
+                family.add_histogram(
+                    LATENCY_BUCKETS,
+                    histogram.cumulative_counts(_BOUNDS_US),
+                    histogram.total / 1_000_000,
+                    {"task": task},
+                )
+
+        buffered = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_trace_buffered", "gauge", "Records in a trace buffer"
+        )
+        for buffer_name, buffer in self.buffers.items():
+            buffered.add(len(buffer), {"tracer": buffer_name})
+
+        acquisitions = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_lock_acquisitions", "counter", "Acquisitions of a lock"
+        )
+        contended = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_lock_contended",
+            "counter",
+            "Acquisitions of a lock that had to wait",
+        )
+        wait = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_lock_wait_seconds",
+            "histogram",
+            "Time threads waited to acquire a lock",
+        )
+        for lock_name, lock in self.locks.items():
+            labels = {"lock": lock_name}
+            acquisitions.add(lock.acquisitions, labels, "_total")
+            contended.add(lock.contended, labels, "_total")
+            wait.add_histogram(
+                LATENCY_BUCKETS,
+                lock.wait.cumulative_counts(_BOUNDS_US),
+                lock.wait.total / 1_000_000,
+                labels,
+            )
+
+        return families + [
+            calls,
+            time_spent,
+            instruments,
+            lag,
+            duration,
+            buffered,
+            acquisitions,
+            contended,
+            wait,
+        ]
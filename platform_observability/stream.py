@@ -0,0 +1,259 @@
+"""
+Live streaming of metrics and traces as Server-Sent Events (https://html.spec.whatwg.org/multipage/server-sent-events.html).
+"""
+import json
+import threading
+from collections import deque
+from typing import Iterator, NamedTuple
+
+from .history import SeriesKey, flatten
+from .instruments.core import Record
+
+METRICS = "metrics"
+"""Changed metric values, published every sampling interval."""
+TRACES = "traces"
+"""Trace events, published every flush interval."""
+
+TOPICS = (METRICS, TRACES)
+
+CONTENT_TYPE = "text/event-stream"
+
+_KEEPALIVE = b": keepalive\n\n"
+
+
+def format_event(event: str, data) -> bytes:
+    data = json.dumps(data, separators=(",", ":"), default=str)
+    return f"event: {event}\ndata: {data}\n\n".encode("utf-8")
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscription:
+    """
+    The queue of serialized events of one subscriber, bounded by the number of events and by their size in bytes.
+    If the subscriber does not keep up, the oldest events are dropped, and the subscriber is told how many were
+    dropped with the next batch it reads. The newest event is always kept, even if it exceeds ``max_bytes``.
+    """
+
+    def __init__(self, topics: frozenset[str], capacity: int, max_bytes: int = 16 * 1024 * 1024):
+        self.topics = topics
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.condition = threading.Condition()
+        self.events: deque[bytes] = deque()
+        self.bytes = 0
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, event: bytes):
+        with self.condition:
+            events = self.events
+            events.append(event)
+            self.bytes += len(event)
+            while len(events) > 1 and (len(events) > self.capacity or self.bytes > self.max_bytes):
+                self.bytes -= len(events.popleft())
+                self.dropped += 1
+            self.condition.notify()
+
+    def get(self, timeout: float) -> list[bytes]:
+        """Waits up to ``timeout`` seconds for events, and returns all queued events."""
+        with self.condition:
+            if not self.events and not self.closed:
+                self.condition.wait(timeout)
+            events = list(self.events)
+            self.events.clear()
+            self.bytes = 0
+            dropped, self.dropped = self.dropped, 0
+
+        if dropped:
+            events.insert(0, format_event("dropped", {"events": dropped}))
+        return events
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+
+class EventStream:
+    """
+    Fans out events to all subscribers of their topic. Each event is serialized once and shared by all
+    subscribers, and publishing never blocks on a subscriber, since every subscriber has its own bounded queue that
+    is drained by the thread serving its response.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = 1000,
+        max_subscribers: int = 16,
+        keepalive: float = 15,
+        queue_bytes: int = 16 * 1024 * 1024,
+    ):
+        """
+        :param queue_size: the maximum number of events queued per subscriber
+        :param max_subscribers: the maximum number of concurrent subscribers (each one occupies a thread)
+        :param keepalive: seconds after which an idle stream sends a comment, to detect closed connections
+        :param queue_bytes: the maximum size in bytes of the events queued per subscriber
+        """
+        self.queue_size = queue_size
+        self.queue_bytes = queue_bytes
+        self.max_subscribers = max_subscribers
+        self.keepalive = keepalive
+        self.mutex = threading.Lock()
+        # replaced rather than modified, so publishers can iterate it without locking
+        self.subscriptions: tuple[Subscription, ...] = ()
+
+        self.published = 0
+        self.dropped = 0
+
+    def has_subscribers(self, topic: str) -> bool:
+        """Publishers check this first, to skip building events nobody receives."""
+        return any(topic in subscription.topics for subscription in self.subscriptions)
+
+    def subscribe(self, topics: frozenset[str]) -> Subscription:
+        """
+        :raises TooManySubscribers: if ``max_subscribers`` are already subscribed
+        """
+        subscription = Subscription(topics, self.queue_size, self.queue_bytes)
+        with self.mutex:
+            if len(self.subscriptions) >= self.max_subscribers:
+                raise TooManySubscribers(f"at most {self.max_subscribers} subscribers are allowed")
+            self.subscriptions = self.subscriptions + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.mutex:
+            self.subscriptions = tuple(s for s in self.subscriptions if s is not subscription)
+            self.dropped += subscription.dropped
+        subscription.close()
+
+    def publish(self, topic: str, data) -> None:
+        subscriptions = [s for s in self.subscriptions if topic in s.topics]
+        if not subscriptions:
+            return
+        event = format_event(topic, data)
+        for subscription in subscriptions:
+            subscription.put(event)
+        # events are published by both the history sampler and the trace flush threads
+        with self.mutex:
+            self.published += 1
+
+    def events(self, subscription: Subscription) -> Iterator[bytes]:
+        """
+        Returns the response body of a subscriber. Queued events are written in batches, and the subscription is
+        removed once the client disconnects (the server closes the generator).
+        """
+        try:
+            yield b": connected\n\n"
+            while not subscription.closed:
+                events = subscription.get(self.keepalive)
+                yield b"".join(events) if events else _KEEPALIVE
+        finally:
+            self.unsubscribe(subscription)
+
+    def close(self):
+        with self.mutex:
+            subscriptions, self.subscriptions = self.subscriptions, ()
+        for subscription in subscriptions:
+            subscription.close()
+
+
+class MetricsPublisher:
+    """
+    Publishes the samples of the ``MetricsHistory`` to the ``metrics`` topic of an event stream. Only the fields that
+    changed since the previous sample are published, new subscribers first receive all current values.
+    """
+
+    def __init__(self, stream: EventStream):
+        self.stream = stream
+        self.mutex = threading.Lock()
+        self.timestamp = 0.0
+        self.samples: dict[str, list[Record]] = {}
+        # instrument -> series -> last values, only maintained while there are subscribers
+        self.values: dict[str, dict[SeriesKey, dict[str, float]]] | None = None
+
+    def _values(self) -> dict[str, dict[SeriesKey, dict[str, float]]]:
+        if self.values is None:
+            self.values = {
+                name: dict(flatten(record) for record in records)
+                for name, records in self.samples.items()
+            }
+        return self.values
+
+    def on_sample(self, timestamp: float, samples: dict[str, list[Record]]):
+        with self.mutex:
+            self.timestamp = timestamp
+            if not self.stream.has_subscribers(METRICS):
+                # new subscribers start from the latest sample
+                self.samples = samples
+                self.values = None
+                return
+
+            values = self._values()
+            delta = {}
+            for name, records in samples.items():
+                series = values.setdefault(name, {})
+                changes = []
+                for record in records:
+                    key, current = flatten(record)
+                    last = series.get(key) or {}
+                    changed = {k: v for k, v in current.items() if last.get(k) != v}
+                    series[key] = current
+                    if changed:
+                        changes.append({**dict(key), **changed})
+                if changes:
+                    delta[name] = changes
+
+            # published under the mutex, so deltas are never sent before the snapshot of a new subscriber
+            if delta:
+                self.stream.publish(METRICS, {"timestamp": timestamp, "metrics": delta})
+
+    def subscribe(self, topics: frozenset[str]) -> Subscription:
+        """
+        Subscribes to the stream, and sends all current values to the new subscriber first if it subscribes to the
+        ``metrics`` topic. Both happen under the mutex, so no delta can be published to the subscriber before its
+        snapshot.
+
+        :raises TooManySubscribers: if the stream has too many subscribers already
+        """
+        with self.mutex:
+            subscription = self.stream.subscribe(topics)
+            if METRICS not in topics:
+                return subscription
+            snapshot = {
+                name: [{**dict(key), **values} for key, values in series.items()]
+                for name, series in self._values().items()
+            }
+            subscription.put(
+                format_event(METRICS, {"timestamp": self.timestamp, "metrics": snapshot})
+            )
+            return subscription
+
+
+class TracePublisher:
+    """
+    Publishes the events flushed from a tracer to the ``traces`` topic of an event stream. A flush can hold up to
+    the capacity of the trace buffer, so it is split into stream events of at most ``batch_size`` trace events,
+    which subscribers that do not keep up can drop one by one.
+    """
+
+    def __init__(self, stream: EventStream, tracer: str, batch_size: int = 1000):
+        self.stream = stream
+        self.tracer = tracer
+        self.batch_size = batch_size
+
+    def on_flush(self, records: list[NamedTuple]):
+        if not self.stream.has_subscribers(TRACES):
+            return
+        for start in range(0, len(records), self.batch_size):
+            self.stream.publish(
+                TRACES,
+                {
+                    "tracer": self.tracer,
+                    "events": [
+                        record._asdict() for record in records[start : start + self.batch_size]
+                    ],
+                },
+            )
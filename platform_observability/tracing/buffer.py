@@ -0,0 +1,66 @@
+import threading
+from collections import deque
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+DROP_NEWEST = "drop_newest"
+"""If the buffer is full, new records are discarded."""
+DROP_OLDEST = "drop_oldest"
+"""If the buffer is full, the oldest buffered record is discarded to make room for the new one."""
+
+POLICIES = (DROP_NEWEST, DROP_OLDEST)
+
+
+class TraceBuffer(Generic[T]):
+    """
+    A bounded buffer for trace records with swap-on-flush double buffering: ``flush`` swaps the buffer for a new
+    empty one while holding the lock, so writers are never blocked by copying or writing the flushed records. If
+    the consumer falls behind and the buffer reaches its capacity, records are dropped according to the policy, and
+    the drops are counted.
+    """
+
+    def __init__(self, capacity: int = 100_000, policy: str = DROP_NEWEST):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown policy {policy}, must be one of {POLICIES}")
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+
+        self.capacity = capacity
+        self.policy = policy
+        self.mutex = threading.Lock()
+        self._records: deque[T] = deque()
+
+        self.recorded = 0
+        self.dropped = 0
+        self.high_watermark = 0
+
+    def append(self, record: T) -> None:
+        with self.mutex:
+            records = self._records
+            if len(records) >= self.capacity:
+                self.dropped += 1
+                if self.policy == DROP_NEWEST:
+                    return
+                records.popleft()
+            records.append(record)
+            self.recorded += 1
+            if len(records) > self.high_watermark:
+                self.high_watermark = len(records)
+
+    def flush(self) -> list[T]:
+        with self.mutex:
+            records, self._records = self._records, deque()
+        return list(records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def statistics(self) -> dict:
+        return {
+            "buffered": len(self._records),
+            "capacity": self.capacity,
+            "high_watermark": self.high_watermark,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,248 @@
+"""
+A compact columnar segment format for trace records, as an alternative to ndjson for large traces.
+
+A segment is a sequence of self-contained blocks, one per flush (or per ``BLOCK_ROWS`` records). Each block stores
+the records column-wise: float and int fields as fixed-width little-endian 64-bit columns, all other fields (ARNs,
+event names, request ids, ...) dictionary-encoded as 32-bit codes into a per-block dictionary. Block layout::
+
+    magic (4 bytes) | version (u16) | reserved (u16) | rows (u32) | header length (u32)
+    header (utf-8 json: record type, columns, dictionaries), zero-padded to 8 bytes
+    column data, each column zero-padded to 8 bytes
+
+Writing only needs the standard library. Reading (``ColumnarReader``) memory-maps the segment and returns NumPy
+arrays, which is an optional dependency (``pip install localstack-extension-platform-observability[analysis]``).
+"""
+import gzip
+import json
+import mmap
+import struct
+import sys
+import typing
+from array import array
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, NamedTuple
+
+if TYPE_CHECKING:
+    import numpy
+
+MAGIC = b"LSTC"
+VERSION = 1
+BLOCK_ROWS = 65536
+"""Maximum number of records per block."""
+
+_BLOCK_HEADER = struct.Struct("<4sHHII")
+
+FLOAT64 = "float64"
+INT64 = "int64"
+DICT = "dict"
+
+_ARRAY_TYPECODES = {FLOAT64: "d", INT64: "q", DICT: "I"}
+_NUMPY_DTYPES = {FLOAT64: "<f8", INT64: "<i8", DICT: "<u4"}
+
+
+def _padding(length: int) -> int:
+    return -length % 8
+
+
+def _column_types(record_type: type[NamedTuple]) -> list[tuple[str, str]]:
+    try:
+        hints = typing.get_type_hints(record_type)
+    except Exception:
+        hints = {}
+
+    columns = []
+    for field in record_type._fields:
+        hint = hints.get(field)
+        if hint is float:
+            columns.append((field, FLOAT64))
+        elif hint is int:
+            columns.append((field, INT64))
+        else:
+            columns.append((field, DICT))
+    return columns
+
+
+class BlockEncoder:
+    """Encodes lists of records of one NamedTuple type into columnar blocks."""
+
+    def __init__(self, record_type: type[NamedTuple]):
+        self.record_type = record_type
+        self.columns = _column_types(record_type)
+
+    def encode(self, records: list[NamedTuple]) -> bytes:
+        rows = len(records)
+        header = {
+            "type": self.record_type.__name__,
+            "columns": [{"name": name, "type": kind} for name, kind in self.columns],
+            "dictionaries": {},
+        }
+        data = []
+        for index, (name, kind) in enumerate(self.columns):
+            values = [record[index] for record in records]
+            if kind == DICT:
+                dictionary = {}
+                values = [dictionary.setdefault(value, len(dictionary)) for value in values]
+                header["dictionaries"][name] = list(dictionary)
+            column = array(_ARRAY_TYPECODES[kind], values)
+            if sys.byteorder != "little":
+                column.byteswap()
+            data.append(column.tobytes())
+
+        header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        parts = [
+            _BLOCK_HEADER.pack(MAGIC, VERSION, 0, rows, len(header_bytes)),
+            header_bytes,
+            bytes(_padding(_BLOCK_HEADER.size + len(header_bytes))),
+        ]
+        for column in data:
+            parts.append(column)
+            parts.append(bytes(_padding(len(column))))
+        return b"".join(parts)
+
+
+class DictionaryColumn(NamedTuple):
+    """A dictionary-encoded column: ``values[codes[i]]`` is the value of row ``i``."""
+
+    codes: "numpy.ndarray"
+    values: list
+
+    def decode(self) -> "numpy.ndarray":
+        """Materializes the column as an object array."""
+        import numpy
+
+        values = numpy.empty(len(self.values), dtype=object)
+        values[:] = self.values
+        return values[self.codes]
+
+
+class Block(NamedTuple):
+    record_type: str
+    rows: int
+    columns: dict[str, "numpy.ndarray | DictionaryColumn"]
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError(
+            "reading columnar trace segments requires numpy, "
+            "install it with `pip install localstack-extension-platform-observability[analysis]`"
+        ) from e
+    return numpy
+
+
+class ColumnarReader:
+    """
+    Reads a columnar trace segment. Uncompressed segments are memory-mapped, so numeric columns of a block are
+    zero-copy views into the file. Compressed segments (``.gz``) are decompressed into memory first.
+    """
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self.numpy = _import_numpy()
+        self._file = None
+        self._buffer = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self):
+        if self._buffer is not None:
+            return
+        if self.path.suffix == ".gz":
+            with gzip.open(self.path, "rb") as fd:
+                self._buffer = fd.read()
+            return
+        self._file = self.path.open("rb")
+        if self.path.stat().st_size:
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._buffer = b""
+
+    def close(self):
+        # views into the mmap may still be referenced by the caller, in which case the mmap is closed on gc
+        if isinstance(self._buffer, mmap.mmap):
+            try:
+                self._buffer.close()
+            except BufferError:
+                pass
+        self._buffer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def blocks(self, columns: list[str] = None) -> Iterator[Block]:
+        """
+        Iterates over all blocks of the segment.
+
+        :param columns: the columns to return, all columns if not set
+        """
+        self.open()
+        numpy = self.numpy
+        buffer = self._buffer
+        offset = 0
+        end = len(buffer)
+
+        while offset + _BLOCK_HEADER.size <= end:
+            magic, version, _, rows, header_length = _BLOCK_HEADER.unpack_from(buffer, offset)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"invalid block at offset {offset} in {self.path}")
+            offset += _BLOCK_HEADER.size
+            header = json.loads(bytes(buffer[offset : offset + header_length]))
+            offset += header_length
+            offset += _padding(offset)
+
+            result = {}
+            for column in header["columns"]:
+                name, kind = column["name"], column["type"]
+                dtype = numpy.dtype(_NUMPY_DTYPES[kind])
+                size = rows * dtype.itemsize
+                if columns is None or name in columns:
+                    data = numpy.frombuffer(buffer, dtype=dtype, count=rows, offset=offset)
+                    if kind == DICT:
+                        data = DictionaryColumn(data, header["dictionaries"][name])
+                    result[name] = data
+                offset += size + _padding(size)
+
+            yield Block(header["type"], rows, result)
+
+    def read(
+        self, columns: list[str] = None, record_type: str = None
+    ) -> dict[str, "numpy.ndarray | DictionaryColumn"]:
+        """
+        Reads the given columns of all blocks into contiguous arrays. The dictionaries of the blocks are merged,
+        so codes of dictionary columns are comparable across the whole segment.
+
+        :param columns: the columns to return, all columns if not set
+        :param record_type: only read blocks of the given record type (e.g., ``LambdaLifecycleEvent``)
+        """
+        numpy = self.numpy
+        parts: dict[str, list] = {}
+        dictionaries: dict[str, dict] = {}
+
+        for block in self.blocks(columns):
+            if record_type is not None and block.record_type != record_type:
+                continue
+            for name, data in block.columns.items():
+                if isinstance(data, DictionaryColumn):
+                    dictionary = dictionaries.setdefault(name, {})
+                    mapping = numpy.fromiter(
+                        (dictionary.setdefault(value, len(dictionary)) for value in data.values),
+                        dtype=numpy.uint32,
+                        count=len(data.values),
+                    )
+                    data = mapping[data.codes]
+                parts.setdefault(name, []).append(data)
+
+        result = {}
+        for name, arrays in parts.items():
+            data = arrays[0] if len(arrays) == 1 else numpy.concatenate(arrays)
+            if name in dictionaries:
+                data = DictionaryColumn(data, list(dictionaries[name]))
+            result[name] = data
+        return result
@@ -1,6 +1,7 @@
 import logging
 import threading
 import time
+from collections import OrderedDict
 from typing import NamedTuple
 
 from localstack.services.lambda_.invocation import event_manager
@@ -10,8 +11,26 @@ from localstack.services.lambda_.invocation.event_manager import (
     SQSInvocation,
 )
 from localstack.services.lambda_.invocation.lambda_models import Invocation
+from localstack.services.lambda_.invocation.models import lambda_stores
 from localstack.utils.patch import Patch, Patches
 
+from platform_observability.instruments import Channel, Instrument
+from platform_observability.instruments.cardinality import (
+    OTHER,
+    CardinalityLimit,
+    merge_histograms,
+    merge_records,
+)
+from platform_observability.instruments.executor import ExecutorStatistics
+from platform_observability.instruments.histogram import Histogram
+from platform_observability.openmetrics import (
+    METRIC_PREFIX,
+    MetricFamily,
+    families_from_records,
+)
+
+from .buffer import DROP_NEWEST, TraceBuffer
+
 LOG = logging.getLogger(__name__)
 
 
@@ -23,34 +42,327 @@ class LambdaLifecycleEvent(NamedTuple):
     failure_cause: str | None = None
 
 
-class LambdaLifecycleTracer:
-    records: list[LambdaLifecycleEvent]
+STAGES = {
+    "queued": ("enqueued", "submitted"),
+    "startup": ("submitted", "invoking"),
+    "execution": ("invoking", "end"),
+    "total": ("enqueued", "end"),
+}
+"""Stage name -> (start event, end event) of an invocation."""
+
+STAGE_LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900]
+"""Bucket bounds (in seconds) of the stage latency histograms in the OpenMetrics exposition."""
+
+
+def _function_exists(function_arn: str) -> bool:
+    # arn:aws:lambda:<region>:<account>:function:<name>[:<qualifier>]
+    parts = function_arn.split(":")
+    if len(parts) < 7:
+        return True
+    return parts[6] in lambda_stores[parts[4]][parts[3]].functions
+
+
+class _Invocation:
+    __slots__ = ("function", "enqueued", "submitted", "invoking", "updated")
+
+    def __init__(self, function: str, updated: float):
+        self.function = function
+        self.enqueued = None
+        self.submitted = None
+        self.invoking = None
+        self.updated = updated
+
+
+class _FunctionStatistics:
+    __slots__ = ("inflight", "completed", "failed", "retries", "expired", "latency")
 
     def __init__(self):
-        self.records = []
-        self.mutex = threading.RLock()
+        self.inflight = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.expired = 0
+        # latencies are recorded in microseconds
+        self.latency = {stage: Histogram() for stage in STAGES}
+
+
+class LambdaInvocationStatistics(Instrument):
+    """
+    Correlates the lifecycle events of async invocations by their request id as they happen, and records the
+    durations between the stages into per-function histograms. Invocations that are not updated within ``ttl``
+    seconds are evicted and counted as expired, as are the oldest invocations once more than ``max_inflight`` are
+    tracked, so memory is bounded even if events are lost.
+    """
+
+    name = "lambda"
+    metric_counters = ("completed", "failed", "retries", "expired")
+
+    def __init__(
+        self,
+        ttl: float = 900,
+        max_inflight: int = 100_000,
+        cardinality_limit: CardinalityLimit = None,
+    ):
+        self.ttl = ttl
+        self.max_inflight = max_inflight
+        self.cardinality_limit = cardinality_limit or CardinalityLimit()
+        self.mutex = threading.Lock()
+        # ordered by last update, so stale invocations are always at the front
+        self._inflight: OrderedDict[str, _Invocation] = OrderedDict()
+        self._functions: dict[str, _FunctionStatistics] = {}
+
+    def _function(self, function: str) -> _FunctionStatistics:
+        try:
+            return self._functions[function]
+        except KeyError:
+            statistics = self._functions[function] = _FunctionStatistics()
+            return statistics
+
+    def on_event(self, event: LambdaLifecycleEvent):
+        timestamp = event.timestamp
+        name = event.event
 
-    def flush(self) -> list[LambdaLifecycleEvent]:
         with self.mutex:
-            records = list(self.records)
-            self.records.clear()
-            return records
+            inflight = self._inflight
+            invocation = inflight.get(event.request_id)
 
-    def _record_invocation(
-        self, event_name: str, invocation: Invocation, failure_cause: str = None
+            if name == "successful" or name == "failed":
+                if invocation is not None:
+                    del inflight[event.request_id]
+                    self._complete(invocation, timestamp, name == "failed")
+                self._evict(timestamp)
+                return
+
+            if invocation is None:
+                invocation = inflight[event.request_id] = _Invocation(event.lambda_arn, timestamp)
+                self._function(invocation.function).inflight += 1
+            else:
+                invocation.updated = timestamp
+                inflight.move_to_end(event.request_id)
+
+            if name == "enqueued":
+                invocation.enqueued = invocation.enqueued or timestamp
+            elif name == "submitted":
+                invocation.submitted = invocation.submitted or timestamp
+            elif name == "invoking":
+                # with retries, the last invoke attempt leads to the outcome
+                invocation.invoking = timestamp
+            elif name == "retry":
+                self._function(invocation.function).retries += 1
+
+            self._evict(timestamp)
+
+    def _complete(self, invocation: _Invocation, end: float, failed: bool):
+        statistics = self._function(invocation.function)
+        statistics.inflight -= 1
+        if failed:
+            statistics.failed += 1
+        else:
+            statistics.completed += 1
+
+        for stage, (start_event, end_event) in STAGES.items():
+            start = getattr(invocation, start_event)
+            stop = end if end_event == "end" else getattr(invocation, end_event)
+            if start is not None and stop is not None:
+                statistics.latency[stage].record(round((stop - start) * 1_000_000))
+
+    def _evict(self, now: float):
+        inflight = self._inflight
+        deadline = now - self.ttl
+        while inflight:
+            request_id, invocation = next(iter(inflight.items()))
+            if invocation.updated >= deadline and len(inflight) <= self.max_inflight:
+                break
+            del inflight[request_id]
+            statistics = self._function(invocation.function)
+            statistics.inflight -= 1
+            statistics.expired += 1
+
+    def clear(self):
+        with self.mutex:
+            self._inflight.clear()
+            self._functions.clear()
+
+    def _collect(self) -> tuple[list[dict], list[dict]]:
+        """
+        Returns the records of the functions that are reported individually, and of the functions beyond the
+        cardinality limit. Statistics of idle functions that were deleted are evicted (events of a function can
+        still arrive after it was deleted). Idle functions that still exist keep their statistics, so their counters
+        do not start over. Only the reported records hold latency summaries. Must be called with the mutex held.
+        """
+        self._evict(time.time())
+        records = [
+            {
+                "function": function,
+                "inflight": statistics.inflight,
+                "completed": statistics.completed,
+                "failed": statistics.failed,
+                "retries": statistics.retries,
+                "expired": statistics.expired,
+            }
+            for function, statistics in self._functions.items()
+        ]
+        reported, other, idle = self.cardinality_limit.apply(
+            records,
+            "function",
+            activity=lambda r: r["inflight"] + r["completed"] + r["failed"],
+            busy=lambda r: r["inflight"] > 0,
+        )
+        for record in reported:
+            record["latency"] = {
+                stage: histogram.summary()
+                for stage, histogram in self._functions[record["function"]].latency.items()
+            }
+        for function in idle:
+            if not _function_exists(function):
+                del self._functions[function]
+        return reported, other
+
+    def measure_and_report(self, channel: Channel) -> None:
+        with self.mutex:
+            reported, other = self._collect()
+        for record in reported:
+            channel.put(record)
+        if other:
+            channel.put(merge_records(other, "function"))
+
+    def metric_families(self, name: str) -> list[MetricFamily]:
+        latency = MetricFamily(
+            f"{METRIC_PREFIX}_{name}_stage_latency_seconds",
+            "histogram",
+            "Duration of the stages of async lambda invocations",
+        )
+        bounds_us = [int(bound * 1_000_000) for bound in STAGE_LATENCY_BUCKETS]
+
+        with self.mutex:
+            reported, other = self._collect()
+            histograms = [
+                (record["function"], self._functions[record["function"]].latency)
+                for record in reported
+            ]
+            if other:
+                histograms.append(
+                    (
+                        OTHER,
+                        {
+                            stage: merge_histograms(
+                                self._functions[record["function"]].latency[stage]
+                                for record in other
+                            )
+                            for stage in STAGES
+                        },
+                    )
+                )
+
+            for function, stages in histograms:
+                for stage, histogram in stages.items():
+                    latency.add_histogram(
+                        STAGE_LATENCY_BUCKETS,
+                        histogram.cumulative_counts(bounds_us),
+                        histogram.total / 1_000_000,
+                        {"function": function, "stage": stage},
+                    )
+
+        # nested latencies are ignored by the generic conversion
+        records = reported + [merge_records(other, "function")] if other else reported
+        families = families_from_records(name, records, self.metric_counters)
+        return families + [latency]
+
+
+_REQUEST_ID_KEY = '"request_id": "'
+_INVOKED_ARN_KEY = '"invoked_arn": "'
+_MESSAGE_IDS_KEY = "_observability_invocation_ids"
+
+
+def _parse_string_value(body: str, key: str) -> str:
+    # the keys follow the (potentially large) payload, so they are searched from the end
+    start = body.rindex(key) + len(key)
+    end = body.index('"', start)
+    value = body[start:end]
+    if "\\" in value:
+        raise ValueError("escaped value")
+    return value
+
+
+def parse_invocation_ids(body: str) -> tuple[str, str]:
+    """
+    Extracts the request id and the invoked ARN from an encoded ``SQSInvocation``, without decoding the payload.
+    ``SQSInvocation.encode`` uses ``json.dumps`` with the default separators, and all quotes within string values
+    are escaped, so the keys can only match top-level keys. Falls back to a full decode if the format differs.
+
+    :param body: the body of the SQS message
+    :return: a tuple of request id and invoked ARN
+    """
+    try:
+        return (
+            _parse_string_value(body, _REQUEST_ID_KEY),
+            _parse_string_value(body, _INVOKED_ARN_KEY),
+        )
+    except ValueError:
+        invocation = SQSInvocation.decode(body).invocation
+        return invocation.request_id, invocation.invoked_arn
+
+
+def get_invocation_ids(message: dict) -> tuple[str, str]:
+    """
+    Returns the request id and invoked ARN of an event invoke message received by a ``Poller``. The ids are parsed
+    once and then cached in the message dict, which is passed on from ``invoker_pool.submit`` to ``handle_message``.
+    """
+    try:
+        return message[_MESSAGE_IDS_KEY]
+    except KeyError:
+        ids = message[_MESSAGE_IDS_KEY] = parse_invocation_ids(message["Body"])
+        return ids
+
+
+class LambdaLifecycleTracer(Instrument):
+    name = "lambda"
+    metric_counters = ("recorded", "dropped")
+
+    buffer: TraceBuffer[LambdaLifecycleEvent]
+
+    def __init__(
+        self,
+        buffer_size: int = 100_000,
+        buffer_policy: str = DROP_NEWEST,
+        statistics: LambdaInvocationStatistics = None,
+        executors: ExecutorStatistics = None,
     ):
+        self.buffer = TraceBuffer(buffer_size, buffer_policy)
+        self.statistics = statistics
+        self.executors = executors or ExecutorStatistics()
+
+    def flush(self) -> list[LambdaLifecycleEvent]:
+        return self.buffer.flush()
+
+    def measure_and_report(self, channel: Channel) -> None:
+        channel.put({"tracer": self.name, **self.buffer.statistics()})
+
+    def _record(self, event_name: str, request_id: str, lambda_arn: str, failure_cause: str = None):
         event = LambdaLifecycleEvent(
             timestamp=time.time(),
             event=event_name,
-            request_id=invocation.request_id,
-            lambda_arn=invocation.invoked_arn,
+            request_id=request_id,
+            lambda_arn=lambda_arn,
             failure_cause=failure_cause,
         )
-        with self.mutex:
-            self.records.append(event)
+        self.buffer.append(event)
+        if self.statistics is not None:
+            self.statistics.on_event(event)
+
+    def _record_invocation(
+        self, event_name: str, invocation: Invocation, failure_cause: str = None
+    ):
+        self._record(event_name, invocation.request_id, invocation.invoked_arn, failure_cause)
+
+    def _record_message(self, event_name: str, message: dict):
+        request_id, lambda_arn = get_invocation_ids(message)
+        self._record(event_name, request_id, lambda_arn)
 
     def patches(self) -> Patches:
         record_invocation = self._record_invocation
+        record_message = self._record_message
+        executors = self.executors
 
         # LambdaEventManager patches
         def _log_enqueue_event(fn, self, invocation: Invocation):
@@ -59,21 +371,22 @@ class LambdaLifecycleTracer:
 
         # Poller patches
         def _poller_init(fn, self, *args, **kwargs):
-            # this patch just exists to patch invoker_pool
             fn(self, *args, **kwargs)
-            Patch.function(self.invoker_pool.submit, _log_invoker_pool_submit).apply()
+            # the pool has not started any threads yet, so it can be replaced by an instrumented one
+            self.invoker_pool = executors.wrap(
+                self.invoker_pool,
+                self.version_manager.function_version.qualified_arn,
+                on_submit=_log_invoker_pool_submit,
+            )
 
-        def _log_invoker_pool_submit(self, fn, handle_message, message: dict):
-            sqs_invocation = SQSInvocation.decode(message["Body"])
-            record_invocation("submitted", sqs_invocation.invocation)
-            return fn(handle_message, message)
+        def _log_invoker_pool_submit(handle_message, message: dict):
+            # pools of pollers created while the patches were applied stay instrumented after they are undone
+            if poller_init_patch.is_applied:
+                record_message("submitted", message)
 
         def _log_handle_message(fn, self, message: dict):
-            sqs_invocation = SQSInvocation.decode(message["Body"])
-            record_invocation(
-                "invoking",
-                sqs_invocation.invocation,
-            )
+            # the message is decoded by handle_message itself, the tracer only extracts the ids
+            record_message("invoking", message)
             return fn(self, message)
 
         def _log_process_success_destination(
@@ -120,10 +433,8 @@ class LambdaLifecycleTracer:
             event_manager.LambdaEventManager.enqueue_event,
             _log_enqueue_event,
         )
-        patches.function(
-            event_manager.Poller.__init__,
-            _poller_init,
-        )
+        poller_init_patch = Patch.function(event_manager.Poller.__init__, _poller_init)
+        patches.add(poller_init_patch)
         patches.function(
             event_manager.Poller.handle_message,
             _log_handle_message,
@@ -15,6 +15,12 @@ from localstack.services.lambda_.invocation.lambda_service import LambdaService
 from localstack.services.sqs.models import FifoQueue, SqsMessage, StandardQueue
 from localstack.utils.patch import Patches
 
+from platform_observability.instruments import Channel, Instrument
+from platform_observability.instruments.counters import ShardedCounter
+
+from .buffer import DROP_NEWEST, TraceBuffer
+from .sampling import TraceFilter
+
 LOG = logging.getLogger(__name__)
 
 
@@ -38,22 +44,67 @@ class LambdaSQSEventSourceEvent(NamedTuple):
     failure_cause: str | None = None
 
 
-class LambdaSQSEventSourceTracer:
-    records: list[LambdaSQSEventSourceEvent]
+class LambdaSQSEventSourceTracer(Instrument):
+    """
+    Traces SQS messages through lambda event source mappings. Which messages are traced is determined by a
+    ``TraceFilter`` (sampling by message id, and allow/deny lists of queue and function ARNs), which can be replaced
+    at runtime with ``configure``. The tracer reports how many events it filtered, and the time spent recording.
+    """
+
+    name = "lambda_sqs"
+    metric_counters = ("recorded", "dropped", "filtered", "sampled_out", "overhead_us")
+
+    buffer: TraceBuffer[LambdaSQSEventSourceEvent]
+    filter: TraceFilter
 
-    def __init__(self):
-        self.records = []
-        self.mutex = threading.RLock()
-        self.queues = set()
+    def __init__(
+        self,
+        buffer_size: int = 100_000,
+        buffer_policy: str = DROP_NEWEST,
+        trace_filter: TraceFilter = None,
+    ):
+        self.buffer = TraceBuffer(buffer_size, buffer_policy)
+        self.filter = trace_filter or TraceFilter()
+        self.counter = ShardedCounter()
+        self.mutex = threading.Lock()
+        # event source queue arn -> function arns of its event source mappings
+        self.queues: dict[str, set[str]] = {}
+        # the queues for which message_queued events are recorded, checked on every put of every queue
+        self.traced_queues: frozenset[str] = frozenset()
 
     def flush(self) -> list[LambdaSQSEventSourceEvent]:
+        return self.buffer.flush()
+
+    def configure(self, trace_filter: TraceFilter):
         with self.mutex:
-            records = list(self.records)
-            self.records.clear()
-            return records
+            self.filter = trace_filter
+            self._update_traced_queues()
+
+    def _update_traced_queues(self):
+        trace_filter = self.filter
+        self.traced_queues = frozenset(
+            queue
+            for queue, functions in self.queues.items()
+            if any(trace_filter.accepts_arns(queue, function) for function in functions)
+        )
+
+    def measure_and_report(self, channel: Channel) -> None:
+        counts = self.counter.snapshot()
+        channel.put(
+            {
+                "tracer": self.name,
+                **self.buffer.statistics(),
+                "filtered": counts.get("filtered", 0),
+                "sampled_out": counts.get("sampled_out", 0),
+                "overhead_us": counts.get("overhead_ns", 0) // 1000,
+                "sample_rate": self.filter.sample_rate,
+            }
+        )
 
-    def _register_queue_arn(self, sqs_queue_arn: str):
-        self.queues.add(sqs_queue_arn)
+    def _register_queue_arn(self, sqs_queue_arn: str, function_arn: str):
+        with self.mutex:
+            self.queues.setdefault(sqs_queue_arn, set()).add(function_arn)
+            self._update_traced_queues()
 
     def _record_invocation(
         self,
@@ -64,17 +115,29 @@ class LambdaSQSEventSourceTracer:
         request_id: str | None = None,
         failure_cause: str | None = None,
     ):
-        event = LambdaSQSEventSourceEvent(
-            timestamp=time.time(),
-            event=event,
-            event_source_arn=event_source_arn,
-            message_id=message_id,
-            request_id=request_id,
-            lambda_arn=lambda_arn,
-            failure_cause=failure_cause,
-        )
-        with self.mutex:
-            self.records.append(event)
+        start = time.perf_counter_ns()
+        try:
+            trace_filter = self.filter
+            if not trace_filter.accepts_arns(event_source_arn, lambda_arn):
+                self.counter.inc("filtered")
+                return
+            if not trace_filter.sampled(message_id):
+                self.counter.inc("sampled_out")
+                return
+
+            event = LambdaSQSEventSourceEvent(
+                timestamp=time.time(),
+                event=event,
+                event_source_arn=event_source_arn,
+                message_id=message_id,
+                request_id=request_id,
+                lambda_arn=lambda_arn,
+                failure_cause=failure_cause,
+            )
+            self.buffer.append(event)
+        finally:
+            # filtered and sampled out events count as well, so the overhead shows what filtering saves
+            self.counter.inc("overhead_ns", time.perf_counter_ns() - start)
 
     def patches(self) -> Patches:
         record_invocation = self._record_invocation
@@ -205,12 +268,12 @@ class LambdaSQSEventSourceTracer:
         ):
             source_arn = event_source_mapping.get("EventSourceArn") or ""
             if ":sqs:" in source_arn:
-                tracer._register_queue_arn(source_arn)
+                tracer._register_queue_arn(source_arn, event_source_mapping.get("FunctionArn"))
 
             return fn(event_source_mapping, lambda_service)
 
         def _log_put_message(fn, self, message: SqsMessage):
-            if self.arn in tracer.queues:
+            if self.arn in tracer.traced_queues:
                 record_invocation(
                     message_id=message.message_id,
                     event_source_arn=self.arn,
@@ -1,39 +1,419 @@
+import glob
+import gzip
 import json
 import logging
+import math
+import os
+import shutil
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from json.encoder import encode_basestring_ascii
 from pathlib import Path
-from typing import NamedTuple, Protocol
+from typing import BinaryIO, Callable, NamedTuple, Protocol
+
+from platform_observability.instruments import Channel, Instrument
+from platform_observability.instruments.histogram import Histogram
+
+from .columnar import BLOCK_ROWS, BlockEncoder
 
 LOG = logging.getLogger(__name__)
 
+NDJSON = "ndjson"
+"""One json object per line and record."""
+COLUMNAR = "columnar"
+"""Dictionary-encoded columnar blocks, see ``platform_observability.tracing.columnar``."""
+
+FORMATS = (NDJSON, COLUMNAR)
+
+
+def _encode_float(value: float) -> str:
+    # json.dumps writes NaN and infinities as NaN, Infinity and -Infinity (which json.loads reads back)
+    return float.__repr__(value) if math.isfinite(value) else json.dumps(value)
+
+
+_VALUE_ENCODERS = {
+    str: encode_basestring_ascii,
+    float: _encode_float,
+    int: int.__repr__,
+    bool: lambda value: "true" if value else "false",
+    type(None): lambda value: "null",
+}
+
+
+def make_record_encoder(fields: tuple[str, ...]) -> Callable[[NamedTuple], str]:
+    """
+    Creates an encoder for NamedTuple records with the given fields, which creates the same ndjson line as
+    ``json.dumps(record._asdict()) + "\\n"``, but without creating an intermediary dict per record and with the
+    encoded field names computed only once.
+    """
+    prefixes = [f"{{{encode_basestring_ascii(fields[0])}: "]
+    prefixes.extend(f", {encode_basestring_ascii(field)}: " for field in fields[1:])
+    encoders = _VALUE_ENCODERS
+
+    def _encode(record: NamedTuple) -> str:
+        parts = []
+        for prefix, value in zip(prefixes, record):
+            parts.append(prefix)
+            parts.append(encoders.get(type(value), json.dumps)(value))
+        parts.append("}\n")
+        return "".join(parts)
+
+    return _encode
+
 
 class TraceCollector(Protocol):
     def flush(self) -> list[NamedTuple]:
         ...
 
 
-class TraceFileLogger:
-    def __init__(self, file: Path, tracer: TraceCollector):
+class RotationPolicy:
+    """
+    Determines when the active trace file is rotated into a closed segment, and how closed segments are kept.
+    A value of 0 disables the respective limit.
+    """
+
+    max_segment_bytes: int
+    """Rotate the active file once it reaches this size."""
+    max_segment_age: float
+    """Rotate the active file once it has been open for this many seconds."""
+    max_total_bytes: int
+    """Delete the oldest closed segments once all files of the logger exceed this size."""
+    compress: bool
+    """Whether to gzip closed segments."""
+
+    def __init__(
+        self,
+        max_segment_bytes: int = 64 * 1024 * 1024,
+        max_segment_age: float = 3600,
+        max_total_bytes: int = 1024 * 1024 * 1024,
+        compress: bool = True,
+    ):
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.max_total_bytes = max_total_bytes
+        self.compress = compress
+
+
+class TraceFileLogger(Instrument):
+    """
+    Periodically writes the records of a tracer as ndjson to a file. The file is kept open, records are encoded
+    into a reusable buffer which is written in chunks of ``chunk_size`` bytes. The logger reports its own
+    statistics (records and bytes written, flush latency) as instrument.
+
+    With a ``RotationPolicy``, the active file is renamed to ``<file>.<sequence>`` once it gets too large or too
+    old, and a new active file is started. Closed segments are compressed to ``<file>.<sequence>.gz`` and evicted
+    oldest-first on a background thread, so the flush path only ever pays for the rename.
+
+    With ``format=COLUMNAR``, each flush is written as columnar blocks instead of ndjson lines.
+    """
+
+    metric_counters = ("records", "bytes", "flushes", "errors", "rotations", "evicted_bytes")
+
+    def __init__(
+        self,
+        file: Path,
+        tracer: TraceCollector,
+        chunk_size: int = 1024 * 1024,
+        rotation: RotationPolicy = None,
+        format: str = NDJSON,
+    ):
+        if format not in FORMATS:
+            raise ValueError(f"unknown format {format}, must be one of {FORMATS}")
+
         self.file = file
         self.tracer = tracer
+        self.chunk_size = chunk_size
+        self.rotation = rotation
+        self.format = format
         self.mutex = threading.RLock()
 
+        self._fd: BinaryIO | None = None
+        self._buffer = bytearray()
+        self._encoders: dict[type, Callable[[NamedTuple], str]] = {}
+        self._block_encoders: dict[type, BlockEncoder] = {}
+
+        self._segment_bytes = 0
+        self._segment_opened = 0.0
+        self._sequence = 0
+        self._compressor: ThreadPoolExecutor | None = None
+        # segments handed over to the compressor that are not finished yet, they are never evicted
+        self._pending_segments: set[Path] = set()
+        self.rotations = 0
+        self.evicted_bytes = 0
+
+        self.records_written = 0
+        self.bytes_written = 0
+        self.flushes = 0
+        self.errors = 0
+        self.flush_latency = Histogram()
+        self.last_flush_duration = 0
+        self.listeners: list[Callable[[list[NamedTuple]], None]] = []
+        # serializes flushes so listeners see the records in the order they were written. It is always acquired
+        # before the mutex, never while holding it, and listeners are called without the mutex.
+        self._flush_mutex = threading.Lock()
+
+    def add_listener(self, listener: Callable[[list[NamedTuple]], None]):
+        """Adds a callback that receives the records of each flush, after they were written."""
+        self.listeners.append(listener)
+
     def init_file(self):
-        self.file.parent.mkdir(parents=True, exist_ok=True)
-        self.file.touch(exist_ok=True)
+        with self.mutex:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            # partially compressed segments left behind by a previous process, their segments are compressed again
+            for tmp in self.file.parent.glob(f"{glob.escape(self.file.name)}.*.gz.tmp"):
+                LOG.debug("removing stale trace segment %s", tmp)
+                tmp.unlink(missing_ok=True)
+            segments = self.segments()
+            if segments:
+                self._sequence = max(self._segment_sequence(segment) for segment in segments)
+            if self.rotation is not None and self.rotation.compress:
+                for segment in segments:
+                    if segment.suffix != ".gz":
+                        self._submit_segment(segment)
+            self._open()
+
+    def _open(self):
+        if self._fd is None:
+            self._fd = self.file.open("ab", buffering=0)
+            self._segment_bytes = self._fd.tell()
+            self._segment_opened = time.monotonic()
 
     def close(self):
+        # flushed before taking the mutex, so the listeners are not called while holding it
         self.flush()
+        with self.mutex:
+            if self._fd is not None:
+                self._fd.close()
+                self._fd = None
+            compressor, self._compressor = self._compressor, None
+        # the compressor takes the mutex when it finishes a segment
+        if compressor is not None:
+            compressor.shutdown(wait=True)
 
-    def flush(self):
+    def segments(self) -> list[Path]:
+        """Returns the closed segments of this logger, oldest first."""
+        pattern = f"{glob.escape(self.file.name)}.*"
+        segments = [
+            segment
+            for segment in self.file.parent.glob(pattern)
+            if self._segment_sequence(segment) is not None
+        ]
+        return sorted(segments, key=self._segment_sequence)
+
+    def _segment_sequence(self, segment: Path) -> int | None:
+        suffix = segment.name[len(self.file.name) + 1 :]
+        if suffix.endswith(".gz"):
+            suffix = suffix[:-3]
+        return int(suffix) if suffix.isdigit() else None
+
+    def _should_rotate(self) -> bool:
+        rotation = self.rotation
+        if rotation is None or not self._segment_bytes:
+            return False
+        if rotation.max_segment_bytes and self._segment_bytes >= rotation.max_segment_bytes:
+            return True
+        if rotation.max_segment_age:
+            return time.monotonic() - self._segment_opened >= rotation.max_segment_age
+        return False
+
+    def rotate(self):
+        """Closes the active file as a new segment and hands it over to the background compressor."""
         with self.mutex:
-            records = self.tracer.flush()
+            if self._fd is not None:
+                self._fd.close()
+                self._fd = None
+
+            self._sequence += 1
+            segment = self.file.with_name(f"{self.file.name}.{self._sequence:06d}")
+            os.replace(self.file, segment)
+            self._open()
+            self.rotations += 1
+            self._submit_segment(segment)
+
+    def _submit_segment(self, segment: Path):
+        """Hands a closed segment over to the background compressor. Must be called with the mutex held."""
+        if self._compressor is None:
+            self._compressor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="trace-compressor"
+            )
+        self._pending_segments.add(segment)
+        self._compressor.submit(self._finish_segment, segment)
+
+    def _finish_segment(self, segment: Path):
+        try:
+            if self.rotation.compress:
+                compressed = segment.with_name(f"{segment.name}.gz")
+                tmp = segment.with_name(f"{segment.name}.gz.tmp")
+                with segment.open("rb") as fd_in, gzip.open(tmp, "wb", compresslevel=6) as fd_out:
+                    shutil.copyfileobj(fd_in, fd_out, length=self.chunk_size)
+                os.replace(tmp, compressed)
+                segment.unlink()
+        except Exception:
+            LOG.exception("error while finishing trace segment %s", segment)
+        finally:
+            with self.mutex:
+                self._pending_segments.discard(segment)
+
+        if self.rotation.max_total_bytes:
+            try:
+                self._evict_segments()
+            except Exception:
+                LOG.exception("error while evicting trace segments of %s", self.file)
+
+    def _evict_segments(self):
+        """
+        Deletes the oldest finished segments until all files fit into ``max_total_bytes``. Runs on the compressor
+        thread, segments that are still waiting for it count towards the total but are not deleted.
+        """
+        with self.mutex:
+            total = self._segment_bytes
+            pending = set(self._pending_segments)
+
+        segments = []
+        for segment in self.segments():
+            size = segment.stat().st_size
+            total += size
+            if segment not in pending:
+                segments.append((segment, size))
+
+        evicted = 0
+        for segment, size in segments:
+            if total <= self.rotation.max_total_bytes:
+                break
+            LOG.debug("evicting trace segment %s", segment)
+            segment.unlink(missing_ok=True)
+            total -= size
+            evicted += size
+
+        if evicted:
+            with self.mutex:
+                self.evicted_bytes += evicted
+
+    def _get_encoder(self, record: NamedTuple) -> Callable[[NamedTuple], str]:
+        record_type = type(record)
+        try:
+            return self._encoders[record_type]
+        except KeyError:
+            encoder = self._encoders[record_type] = make_record_encoder(record_type._fields)
+            return encoder
+
+    def _write(self, records: list[NamedTuple]):
+        if self.format == COLUMNAR:
+            self._write_columnar(records)
+        else:
+            self._write_ndjson(records)
+
+    def _write_columnar(self, records: list[NamedTuple]):
+        self._open()
+        fd = self._fd
+
+        # one block per run of records of the same type
+        start = 0
+        while start < len(records):
+            record_type = type(records[start])
+            end = start + 1
+            limit = min(len(records), start + BLOCK_ROWS)
+            while end < limit and type(records[end]) is record_type:
+                end += 1
+
+            try:
+                encoder = self._block_encoders[record_type]
+            except KeyError:
+                encoder = self._block_encoders[record_type] = BlockEncoder(record_type)
+
+            block = encoder.encode(records[start:end])
+            fd.write(block)
+            self.bytes_written += len(block)
+            self._segment_bytes += len(block)
+            start = end
+
+        self.records_written += len(records)
+
+    def _write_ndjson(self, records: list[NamedTuple]):
+        self._open()
+        buffer = self._buffer
+        chunk_size = self.chunk_size
+        fd = self._fd
+
+        encoder = self._get_encoder(records[0])
+        encoder_type = type(records[0])
+        for record in records:
+            if type(record) is not encoder_type:
+                encoder = self._get_encoder(record)
+                encoder_type = type(record)
+            buffer += encoder(record).encode("utf-8")
+            if len(buffer) >= chunk_size:
+                fd.write(buffer)
+                self.bytes_written += len(buffer)
+                self._segment_bytes += len(buffer)
+                del buffer[:]
+
+        if buffer:
+            fd.write(buffer)
+            self.bytes_written += len(buffer)
+            self._segment_bytes += len(buffer)
+            del buffer[:]
+
+        self.records_written += len(records)
+
+    def flush(self):
+        with self._flush_mutex:
+            with self.mutex:
+                records = self._flush()
             if not records:
                 return
 
+            # listeners (e.g., the event stream) are not part of the write path
+            for listener in self.listeners:
+                try:
+                    listener(records)
+                except Exception:
+                    LOG.exception("error in trace listener %s", listener)
+
+    def _flush(self) -> list[NamedTuple]:
+        """Writes the records of the tracer and returns them. Must be called with the mutex held."""
+        start = time.perf_counter_ns()
+        records = self.tracer.flush()
+        if not records:
+            return records
+
+        try:
+            self._write(records)
+        except Exception:
+            self.errors += 1
+            LOG.exception("error while flushing to %s", self.file)
+        finally:
+            del self._buffer[:]
+
+        if self._should_rotate():
             try:
-                with self.file.open("a") as fd:
-                    records = [json.dumps(record._asdict()) + "\n" for record in records]
-                    fd.writelines(records)
+                self.rotate()
             except Exception:
-                LOG.exception("error while flushing to %s", self.file)
+                self.errors += 1
+                LOG.exception("error while rotating %s", self.file)
+
+        self.flushes += 1
+        self.last_flush_duration = (time.perf_counter_ns() - start) // 1000
+        self.flush_latency.record(self.last_flush_duration)
+        return records
+
+    def measure_and_report(self, channel: Channel) -> None:
+        with self.mutex:
+            latency = self.flush_latency
+            p50, p99 = latency.percentiles([50, 99])
+            channel.put(
+                {
+                    "file": str(self.file),
+                    "records": self.records_written,
+                    "bytes": self.bytes_written,
+                    "flushes": self.flushes,
+                    "errors": self.errors,
+                    "rotations": self.rotations,
+                    "evicted_bytes": self.evicted_bytes,
+                    "last_flush": self.last_flush_duration / 1000,
+                    "flush_p50": p50 / 1000,
+                    "flush_p99": p99 / 1000,
+                    "flush_max": latency.max / 1000,
+                }
+            )
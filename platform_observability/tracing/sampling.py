@@ -0,0 +1,110 @@
+import fnmatch
+import zlib
+from typing import Iterable
+
+_MAX_CACHED_ARNS = 10_000
+
+
+class ArnFilter:
+    """
+    An allow and deny list of ARN patterns (with ``*`` and ``?`` wildcards). An ARN passes if it matches no deny
+    pattern, and any allow pattern (or there are no allow patterns). Results are cached per ARN.
+    """
+
+    def __init__(self, allow: Iterable[str] = (), deny: Iterable[str] = ()):
+        self.allow = tuple(allow)
+        self.deny = tuple(deny)
+        self._cache: dict[str, bool] = {}
+
+    def __bool__(self):
+        return bool(self.allow or self.deny)
+
+    def __call__(self, arn: str) -> bool:
+        try:
+            return self._cache[arn]
+        except KeyError:
+            pass
+
+        result = not any(fnmatch.fnmatchcase(arn, pattern) for pattern in self.deny) and (
+            not self.allow or any(fnmatch.fnmatchcase(arn, pattern) for pattern in self.allow)
+        )
+        if len(self._cache) >= _MAX_CACHED_ARNS:
+            self._cache.clear()
+        self._cache[arn] = result
+        return result
+
+    def to_dict(self) -> dict:
+        return {"allow": list(self.allow), "deny": list(self.deny)}
+
+
+def _parse_patterns(doc: dict, key: str) -> ArnFilter:
+    value = doc.get(key) or {}
+    if not isinstance(value, dict):
+        raise ValueError(f"{key} must be an object with allow and deny lists")
+    for field in ("allow", "deny"):
+        patterns = value.get(field) or []
+        if not isinstance(patterns, list) or not all(isinstance(p, str) for p in patterns):
+            raise ValueError(f"{key}.{field} must be a list of ARN patterns")
+    return ArnFilter(value.get("allow") or [], value.get("deny") or [])
+
+
+class TraceFilter:
+    """
+    Decides which messages a tracer records. Sampling is head-based and keyed on the message id, so either all
+    events of a message are recorded or none. Instances are immutable, tracers swap the whole filter to reconfigure
+    it, so the hot path never sees a partially updated configuration.
+    """
+
+    sample_rate: float
+    """Fraction of messages that are recorded (0 to 1)."""
+
+    def __init__(
+        self,
+        sample_rate: float = 1.0,
+        event_source_arns: ArnFilter = None,
+        function_arns: ArnFilter = None,
+    ):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        self.sample_rate = sample_rate
+        self.event_source_arns = event_source_arns or ArnFilter()
+        self.function_arns = function_arns or ArnFilter()
+        self._threshold = int(sample_rate * (1 << 32))
+
+    def sampled(self, message_id: str | None) -> bool:
+        if self._threshold >= 1 << 32 or message_id is None:
+            return True
+        # crc32 is stable across processes, unlike hash()
+        return zlib.crc32(message_id.encode("utf-8")) < self._threshold
+
+    def accepts_arns(self, event_source_arn: str, function_arn: str | None) -> bool:
+        if self.event_source_arns and not self.event_source_arns(event_source_arn):
+            return False
+        if function_arn is not None and self.function_arns and not self.function_arns(function_arn):
+            return False
+        return True
+
+    def to_dict(self) -> dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "event_source_arns": self.event_source_arns.to_dict(),
+            "function_arns": self.function_arns.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, doc: dict) -> "TraceFilter":
+        """
+        Creates a filter from its dict representation (as returned by ``to_dict``).
+
+        :raises ValueError: if the document is invalid
+        """
+        if not isinstance(doc, dict):
+            raise ValueError("trace filter must be an object")
+        sample_rate = doc.get("sample_rate", 1.0)
+        if isinstance(sample_rate, bool) or not isinstance(sample_rate, (int, float)):
+            raise ValueError("sample_rate must be a number")
+        return cls(
+            sample_rate=float(sample_rate),
+            event_source_arns=_parse_patterns(doc, "event_source_arns"),
+            function_arns=_parse_patterns(doc, "function_arns"),
+        )
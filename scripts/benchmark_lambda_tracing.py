@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Measures the per-message overhead of the lambda lifecycle tracer on the async invoke path of the lambda poller.
+
+For each payload size, it measures (in microseconds per message):
+
+* ``off``: decoding the message, which the poller does anyway (``SQSInvocation.decode`` in ``handle_message``)
+* ``decode``: the tracing work of the previous tracer, which decoded the message on submit and on handle_message
+* ``on``: the tracing work of the current tracer, which only extracts the request id and ARN once per message
+
+The tracing work is measured in isolation, since its cost is small compared to the variance of decoding large
+payloads.
+
+Requires localstack-core to be installed (``pip install -e .[dev]``).
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import timeit
+import uuid
+from datetime import datetime
+
+from localstack.services.lambda_.invocation.event_manager import SQSInvocation
+from localstack.services.lambda_.invocation.lambda_models import Invocation
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from platform_observability.tracing.lambda_ import LambdaLifecycleTracer  # noqa: E402
+
+
+def create_message(payload_size: int) -> dict:
+    payload = json.dumps({"data": "x" * payload_size}).encode()
+    invocation = Invocation(
+        payload=payload,
+        invoked_arn="arn:aws:lambda:us-east-1:000000000000:function:benchmark",
+        client_context=base64.b64encode(b'{"custom": {"request_id": "nested"}}').decode(),
+        invocation_type="Event",
+        invoke_time=datetime.now(),
+        request_id=str(uuid.uuid4()),
+    )
+    return {"MessageId": str(uuid.uuid4()), "Body": SQSInvocation(invocation).encode()}
+
+
+def run(payload_size: int, number: int) -> dict:
+    tracer = LambdaLifecycleTracer(buffer_size=number * 10)
+    message = create_message(payload_size)
+
+    def _off():
+        SQSInvocation.decode(message["Body"])
+
+    def _decode():
+        tracer._record_invocation("submitted", SQSInvocation.decode(message["Body"]).invocation)
+        tracer._record_invocation("invoking", SQSInvocation.decode(message["Body"]).invocation)
+
+    def _on():
+        # a fresh message dict per call, like the poller receives it
+        received = dict(message)
+        tracer._record_message("submitted", received)
+        tracer._record_message("invoking", received)
+
+    result = {"payload_size": payload_size}
+    for name, fn in [("off", _off), ("decode", _decode), ("on", _on)]:
+        tracer.buffer.flush()
+        seconds = min(timeit.repeat(fn, number=number, repeat=5))
+        result[name] = round(seconds / number * 1_000_000, 3)
+    result["overhead_decode"] = round(result["decode"] / result["off"] * 100, 1)
+    result["overhead_on"] = round(result["on"] / result["off"] * 100, 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="Benchmark lambda tracing",
+        description="Print the per-message cost (in microseconds) of the lambda tracer",
+    )
+    parser.add_argument("--payload-sizes", type=int, nargs="+", default=[100, 10_000, 250_000])
+    parser.add_argument("--number", type=int, default=2000, help="messages per measurement")
+    args = parser.parse_args()
+
+    print(f"{'payload':>10} {'off':>10} {'decode':>10} {'on':>10} {'decode %':>10} {'on %':>10}")
+    for payload_size in args.payload_sizes:
+        r = run(payload_size, args.number)
+        print(
+            f"{r['payload_size']:>10} {r['off']:>10} {r['decode']:>10} {r['on']:>10} "
+            f"{r['overhead_decode']:>10} {r['overhead_on']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+"""
+Measures the overhead of the patches and instruments of the extension in-process, without a running LocalStack.
+All costs are in microseconds:
+
+* ``patches``: the per-call overhead of each patch of ``TopicStatistics``, ``LambdaLifecycleTracer`` and
+  ``LambdaSQSEventSourceTracer``. Each patch is called around a no-op stand-in for the patched function, with
+  stand-in arguments, so only the work of the patch itself is measured (``off`` is the call of the stand-in).
+* ``queues``: the per-message cost of sending, receiving and deleting a message of a ``StandardQueue`` and a
+  ``FifoQueue``, without (``off``) and with (``on``) the patches of ``QueueStatistics`` and
+  ``LambdaSQSEventSourceTracer`` applied, and the queue traced.
+* ``requests``: the per-request cost of the ``RequestCounter`` handlers, for a counted operation, an operation that is
+  not counted, and a request without a service (``off`` is creating the request context).
+* ``scrape``: the cost of reporting the records and of creating the OpenMetrics families of the SNS, SQS and lambda
+  instruments, by number of topics, queues and functions.
+* ``flush``: the cost per record of ``TraceFileLogger.flush``, per format.
+
+The results can be stored as JSON with ``--output``, and compared to those of a previous run (e.g., of the previous
+version) with ``--compare``, which exits with 1 if a cost increased by more than ``--threshold`` percent.
+
+Requires localstack-core to be installed (``pip install -e .[dev]``).
+"""
+import argparse
+import base64
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable
+
+from localstack.aws.api import RequestContext
+from localstack.aws.api.lambda_ import InvocationType
+from localstack.services.lambda_.invocation.event_manager import SQSInvocation
+from localstack.services.lambda_.invocation.lambda_models import Invocation
+from localstack.services.sns.models import SnsMessage, sns_stores
+from localstack.services.sqs.models import FifoQueue, StandardQueue, sqs_stores
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from platform_observability.instruments.aggregate import RequestCounter  # noqa: E402
+from platform_observability.instruments.core import ListCollector  # noqa: E402
+from platform_observability.instruments.sns import (  # noqa: E402
+    _DELIVERED,
+    _DISPATCHED,
+    _FAN_OUT,
+    _PUBLISHED,
+    TopicStatistics,
+)
+from platform_observability.instruments.sqs import QueueStatistics  # noqa: E402
+from platform_observability.tracing.lambda_ import (  # noqa: E402
+    LambdaInvocationStatistics,
+    LambdaLifecycleEvent,
+    LambdaLifecycleTracer,
+)
+from platform_observability.tracing.lambda_sqs import LambdaSQSEventSourceTracer  # noqa: E402
+from platform_observability.tracing.logging import FORMATS, TraceFileLogger  # noqa: E402
+
+SECTIONS = ("patches", "queues", "requests", "scrape", "flush")
+
+COMPARED_FIELDS = ("on_us", "report_us", "openmetrics_us", "record_us")
+"""The fields of the results that are compared with ``--compare``."""
+MIN_REGRESSION_US = 0.2
+"""Increases of a cost smaller than this are considered noise, since some patches cost less than a microsecond."""
+
+REPEAT = 5
+
+ACCOUNT_ID = "000000000000"
+REGION = "us-east-1"
+TOPIC_ARN = f"arn:aws:sns:{REGION}:{ACCOUNT_ID}:benchmark"
+QUEUE_ARN = f"arn:aws:sqs:{REGION}:{ACCOUNT_ID}:benchmark"
+FUNCTION_ARN = f"arn:aws:lambda:{REGION}:{ACCOUNT_ID}:function:benchmark"
+BATCH_SIZE = 10
+
+SUBSCRIBER = {
+    "TopicArn": TOPIC_ARN,
+    "Protocol": "sqs",
+    "SubscriptionArn": f"{TOPIC_ARN}:{uuid.uuid4()}",
+    "Endpoint": QUEUE_ARN,
+}
+
+
+def measure(fn: Callable, number: int, setup: Callable = None) -> float:
+    """Returns the best time of ``REPEAT`` measurements of ``fn``, in microseconds per call."""
+    timer = timeit.Timer(fn)
+    # warms up caches and lazily initialized state
+    timer.timeit(max(1, number // 10))
+    best = float("inf")
+    for _ in range(REPEAT):
+        if setup:
+            setup()
+        best = min(best, timer.timeit(number))
+    return round(best / number * 1_000_000, 3)
+
+
+def _noop(*args, **kwargs):
+    return None
+
+
+def _passes(*args, **kwargs):
+    return True
+
+
+def create_invocation() -> Invocation:
+    return Invocation(
+        payload=b'{"data": "benchmark"}',
+        invoked_arn=FUNCTION_ARN,
+        client_context=base64.b64encode(b'{"custom": {}}').decode(),
+        invocation_type="Event",
+        invoke_time=datetime.now(),
+        request_id=str(uuid.uuid4()),
+    )
+
+
+def _published_message() -> SnsMessage:
+    # the state of a message after it went through the patched publish_to_topic
+    message = SnsMessage(type="Notification", message="benchmark")
+    setattr(message, _PUBLISHED, time.perf_counter_ns())
+    setattr(message, _FAN_OUT, 0)
+    return message
+
+
+def _sqs_records() -> list[dict]:
+    return [
+        {"messageId": str(uuid.uuid4()), "eventSourceARN": QUEUE_ARN, "body": "benchmark"}
+        for _ in range(BATCH_SIZE)
+    ]
+
+
+def create_stand_ins() -> dict[str, tuple[Callable[[], tuple], Callable]]:
+    """
+    Returns the stand-in arguments and original function of each patched function, keyed by ``<owner>.<name>``.
+    The arguments are created per call, since patches can modify them (e.g., cache ids in message dicts).
+    """
+    invocation = create_invocation()
+    sqs_invocation = SQSInvocation(invocation)
+    poller_message = {"MessageId": str(uuid.uuid4()), "Body": sqs_invocation.encode()}
+    pool = ThreadPoolExecutor(max_workers=1)
+    poller = SimpleNamespace(
+        invoker_pool=pool,
+        version_manager=SimpleNamespace(
+            function_version=SimpleNamespace(qualified_arn=f"{FUNCTION_ARN}:$LATEST")
+        ),
+    )
+    queue = SimpleNamespace(arn=QUEUE_ARN)
+    source = {"EventSourceArn": QUEUE_ARN, "FunctionArn": FUNCTION_ARN}
+
+    def _init_poller(self, *args, **kwargs):
+        self.invoker_pool = pool
+
+    def _invoke_and_call_back(
+        self, request_id, function_arn, context, payload, invocation_type, callback=None
+    ):
+        if callback:
+            callback(result=None, error=None)
+
+    return {
+        # TopicStatistics
+        "PublishDispatcher.publish_to_topic": (
+            lambda: (None, SimpleNamespace(message=SnsMessage("Notification", "x")), TOPIC_ARN),
+            _noop,
+        ),
+        "PublishDispatcher.publish_batch_to_topic": (
+            lambda: (
+                None,
+                SimpleNamespace(
+                    messages=[SnsMessage("Notification", "x") for _ in range(BATCH_SIZE)]
+                ),
+                TOPIC_ARN,
+            ),
+            _noop,
+        ),
+        "PublishDispatcher._should_publish": (
+            lambda: (None, {}, _published_message(), SUBSCRIBER),
+            _passes,
+        ),
+        "TopicPublisher.publish": (
+            lambda: (None, SimpleNamespace(message=_published_message()), SUBSCRIBER),
+            _noop,
+        ),
+        "publisher.store_delivery_log": (
+            lambda: (_published_message(), SUBSCRIBER, True, None, None),
+            _noop,
+        ),
+        # LambdaLifecycleTracer
+        "LambdaEventManager.enqueue_event": (lambda: (None, invocation), _noop),
+        "Poller.__init__": (lambda: (poller,), _init_poller),
+        "Poller.handle_message": (lambda: (None, dict(poller_message)), _noop),
+        "Poller.process_success_destination": (lambda: (None, sqs_invocation, None, None), _noop),
+        "Poller.process_failure_destination": (
+            lambda: (None, sqs_invocation, None, None, "FunctionError"),
+            _noop,
+        ),
+        "Poller.process_throttles_and_system_errors": (
+            lambda: (None, sqs_invocation, RuntimeError()),
+            _noop,
+        ),
+        # LambdaSQSEventSourceTracer
+        "FifoQueue._put_message": (
+            lambda: (queue, SimpleNamespace(message_id=str(uuid.uuid4()))),
+            _noop,
+        ),
+        "StandardQueue._put_message": (
+            lambda: (queue, SimpleNamespace(message_id=str(uuid.uuid4()))),
+            _noop,
+        ),
+        "EventSourceListener.start_listeners_for_asf": (lambda: (source, None), _noop),
+        "SQSEventSourceListener._process_messages_for_event_source": (
+            lambda: (
+                None,
+                source,
+                [{"MessageId": str(uuid.uuid4())} for _ in range(BATCH_SIZE)],
+            ),
+            _noop,
+        ),
+        "LambdaService.invoke": (
+            lambda: (None, "benchmark", None, REGION, ACCOUNT_ID, "Event", None, "request", b"{}"),
+            _noop,
+        ),
+        "EventSourceAsfAdapter._invoke_async": (
+            lambda: (None, "request", FUNCTION_ARN, {}, {"Records": _sqs_records()}, "Event"),
+            _noop,
+        ),
+        "EventSourceAsfAdapter._invoke_sync": (
+            lambda: (
+                None,
+                "request",
+                FUNCTION_ARN,
+                {},
+                {"Records": _sqs_records()},
+                InvocationType.RequestResponse,
+            ),
+            _invoke_and_call_back,
+        ),
+    }
+
+
+def run_patches(number: int) -> dict:
+    lambda_tracer = LambdaLifecycleTracer(
+        buffer_size=number * 10, statistics=LambdaInvocationStatistics()
+    )
+    sqs_tracer = LambdaSQSEventSourceTracer(buffer_size=number * BATCH_SIZE * 10)
+    # the worst case, every message of the queue is traced
+    sqs_tracer._register_queue_arn(QUEUE_ARN, FUNCTION_ARN)
+    instruments = {
+        "sns": TopicStatistics(),
+        "lambda": lambda_tracer,
+        "lambda_sqs": sqs_tracer,
+    }
+    stand_ins = create_stand_ins()
+
+    def _reset():
+        lambda_tracer.flush()
+        lambda_tracer.executors.executors.clear()
+        sqs_tracer.flush()
+
+    results = {}
+    for instrument_name, instrument in instruments.items():
+        for patch in instrument.patches().patches:
+            owner = getattr(patch.obj, "__name__", type(patch.obj).__name__).rsplit(".", 1)[-1]
+            key = f"{owner}.{patch.name}"
+            name = f"{instrument_name}:{key}"
+            if key not in stand_ins:
+                # a new patch, which needs a stand-in to be measured
+                results[name] = {"skipped": True}
+                continue
+
+            create_args, original = stand_ins[key]
+            # the function the patch wraps, without the proxy that passes the original function
+            new = getattr(patch.new, "__subject__", patch.new)
+            off = measure(lambda: original(*create_args()), number, _reset)
+            on = measure(lambda: new(original, *create_args()), number, _reset)
+            results[name] = {"off_us": off, "on_us": on, "overhead_us": round(on - off, 3)}
+    return results
+
+
+def run_queues(number: int) -> dict:
+    queue_statistics = QueueStatistics()
+    sqs_tracer = LambdaSQSEventSourceTracer(buffer_size=number * REPEAT * 2)
+    patches = [queue_statistics.patches(), sqs_tracer.patches()]
+    deduplication_ids = itertools.count()
+
+    def _cycle(queue) -> Callable[[], None]:
+        fifo = isinstance(queue, FifoQueue)
+
+        def _send_receive_delete():
+            message = {"MessageId": str(uuid.uuid4()), "Body": "benchmark"}
+            if fifo:
+                queue.put(
+                    message,
+                    message_group_id="benchmark",
+                    message_deduplication_id=str(next(deduplication_ids)),
+                )
+            else:
+                queue.put(message)
+            result = queue.receive()
+            queue.remove(result.receipt_handles[0])
+
+        return _send_receive_delete
+
+    def _create_queues() -> dict:
+        return {
+            "standard": StandardQueue("benchmark", REGION, ACCOUNT_ID),
+            "fifo": FifoQueue("benchmark.fifo", REGION, ACCOUNT_ID, {"FifoQueue": "true"}),
+        }
+
+    off = {name: measure(_cycle(queue), number) for name, queue in _create_queues().items()}
+
+    for p in patches:
+        p.apply()
+    try:
+        queues = _create_queues()
+        for queue in queues.values():
+            sqs_tracer._register_queue_arn(queue.arn, FUNCTION_ARN)
+        on = {
+            name: measure(_cycle(queue), number, sqs_tracer.flush) for name, queue in queues.items()
+        }
+    finally:
+        for p in patches:
+            p.undo()
+
+    return {
+        name: {
+            "off_us": off[name],
+            "on_us": on[name],
+            "overhead_us": round(on[name] - off[name], 3),
+        }
+        for name in off
+    }
+
+
+def run_requests(number: int) -> dict:
+    counter = RequestCounter(["sqs.SendMessage", "sns.Publish"])
+    services = {
+        "counted": ("sqs", "SendMessage"),
+        "not_counted": ("sqs", "ListQueues"),
+        "no_service": None,
+    }
+
+    results = {}
+    for name, operation in services.items():
+
+        def _new_context() -> RequestContext:
+            context = RequestContext()
+            if operation:
+                context.service = SimpleNamespace(service_name=operation[0])
+                context.operation = SimpleNamespace(name=operation[1])
+            return context
+
+        def _handle():
+            context = _new_context()
+            counter.on_request(None, context, None)
+            counter.on_response(None, context, None)
+
+        off = measure(_new_context, number)
+        on = measure(_handle, number)
+        results[name] = {"off_us": off, "on_us": on, "overhead_us": round(on - off, 3)}
+    return results
+
+
+def _populate_topics(count: int) -> tuple[TopicStatistics, Callable[[], None]]:
+    statistics = TopicStatistics()
+    store = sns_stores[ACCOUNT_ID][REGION]
+    topic_arns = [f"{TOPIC_ARN}-{i}" for i in range(count)]
+    for i, topic_arn in enumerate(topic_arns):
+        store.topic_subscriptions[topic_arn] = []
+        statistics.published.inc(topic_arn, i + 1)
+        statistics.fan_out.record(topic_arn, 1)
+        for protocol in ("sqs", "lambda"):
+            statistics.deliveries.inc((topic_arn, protocol, _DISPATCHED), i + 1)
+            statistics.deliveries.inc((topic_arn, protocol, _DELIVERED), i + 1)
+            statistics.latency.record((topic_arn, protocol), 1000 + i)
+
+    def _remove():
+        for arn in topic_arns:
+            store.topic_subscriptions.pop(arn, None)
+
+    return statistics, _remove
+
+
+def _populate_queues(count: int) -> tuple[QueueStatistics, Callable[[], None]]:
+    store = sqs_stores[ACCOUNT_ID][REGION]
+    names = [f"benchmark-{i}" for i in range(count)]
+    for i, name in enumerate(names):
+        queue = store.queues[name] = StandardQueue(name, REGION, ACCOUNT_ID)
+        for _ in range(i % 10 + 1):
+            queue.put({"MessageId": str(uuid.uuid4()), "Body": "benchmark"})
+
+    def _remove():
+        for name in names:
+            store.queues.pop(name, None)
+
+    return QueueStatistics(), _remove
+
+
+def _populate_functions(count: int) -> tuple[LambdaInvocationStatistics, Callable[[], None]]:
+    statistics = LambdaInvocationStatistics()
+    now = time.time()
+    for i in range(count):
+        function_arn = f"{FUNCTION_ARN}-{i}"
+        for j in range(5):
+            request_id = f"{i}-{j}"
+            for offset, event in enumerate(("enqueued", "submitted", "invoking", "successful")):
+                statistics.on_event(
+                    LambdaLifecycleEvent(now + offset * 0.01, event, request_id, function_arn)
+                )
+    return statistics, _noop
+
+
+def run_scrape(number: int, resource_counts: list[int]) -> dict:
+    populate = {"sns": _populate_topics, "sqs": _populate_queues, "lambda": _populate_functions}
+
+    results = {}
+    for name, create in populate.items():
+        for count in resource_counts:
+            instrument, remove = create(count)
+            try:
+                # scrapes are much more expensive than patches, and rarer
+                scrapes = max(1, number // max(count, 100))
+                report = measure(lambda: instrument.measure_and_report(ListCollector()), scrapes)
+                openmetrics = measure(lambda: instrument.metric_families(name), scrapes)
+            finally:
+                remove()
+            results[f"{name}:{count}"] = {"report_us": report, "openmetrics_us": openmetrics}
+    return results
+
+
+class _PreparedRecords:
+    """A stand-in tracer, which returns the same records on every flush."""
+
+    def __init__(self, records: list):
+        self.records = records
+
+    def flush(self) -> list:
+        return list(self.records)
+
+
+def run_flush(records: int) -> dict:
+    now = time.time()
+    events = [
+        LambdaLifecycleEvent(
+            now + i * 0.001, "invoking", str(uuid.uuid4()), f"{FUNCTION_ARN}-{i % 20}"
+        )
+        for i in range(records)
+    ]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for trace_format in FORMATS:
+            logger = TraceFileLogger(
+                Path(directory) / f"benchmark-{trace_format}.log",
+                _PreparedRecords(events),
+                format=trace_format,
+            )
+            logger.init_file()
+            try:
+                flush_us = measure(logger.flush, 1)
+            finally:
+                logger.close()
+            results[trace_format] = {
+                "record_us": round(flush_us / records, 3),
+                "records_per_second": int(records / flush_us * 1_000_000),
+                "bytes_per_record": round(logger.bytes_written / logger.records_written, 1),
+            }
+    return results
+
+
+def _version(distribution: str) -> str | None:
+    try:
+        return version(distribution)
+    except PackageNotFoundError:
+        return None
+
+
+def _costs(results: dict) -> dict[str, float]:
+    return {
+        f"{section}/{name}/{field}": value
+        for section, entries in results.items()
+        for name, fields in entries.items()
+        for field, value in fields.items()
+        if field in COMPARED_FIELDS
+    }
+
+
+def compare(baseline: dict, results: dict, threshold: float) -> list[str]:
+    """Prints the change of all costs compared to the baseline, and returns the keys of the regressed ones."""
+    previous = _costs(baseline["results"])
+    regressions = []
+    print(f"\n{'compared to':<70} {baseline.get('version') or 'baseline'}")
+    for key, value in _costs(results).items():
+        before = previous.get(key)
+        if not before:
+            continue
+        change = (value - before) / before * 100
+        regressed = change > threshold and value - before > MIN_REGRESSION_US
+        if regressed:
+            regressions.append(key)
+        print(
+            f"{key:<70} {before:>10} {value:>10} {change:>+8.1f}%{' REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="Benchmark overhead",
+        description="Print the overhead (in microseconds) of the patches and instruments of the extension",
+    )
+    parser.add_argument("--sections", nargs="+", choices=SECTIONS, default=list(SECTIONS))
+    parser.add_argument("--number", type=int, default=10_000, help="calls per measurement")
+    parser.add_argument(
+        "--resources",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000],
+        help="numbers of topics, queues and functions to scrape",
+    )
+    parser.add_argument("--records", type=int, default=100_000, help="records per flush")
+    parser.add_argument("--output", help="file to store the results in as JSON")
+    parser.add_argument("--compare", help="results of a previous run to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=20,
+        help="percent increase of a cost that is a regression",
+    )
+    args = parser.parse_args()
+
+    runs = {
+        "patches": lambda: run_patches(args.number),
+        "queues": lambda: run_queues(args.number),
+        "requests": lambda: run_requests(args.number),
+        "scrape": lambda: run_scrape(args.number, args.resources),
+        "flush": lambda: run_flush(args.records),
+    }
+    results = {}
+    for section in args.sections:
+        results[section] = runs[section]()
+        for name, fields in results[section].items():
+            values = " ".join(f"{field}={value}" for field, value in fields.items())
+            print(f"{section:<10} {name:<70} {values}")
+
+    if args.output:
+        document = {
+            "version": _version("localstack-extension-platform-observability"),
+            "localstack_version": _version("localstack-core"),
+            "python": platform.python_version(),
+            "timestamp": time.time(),
+            "number": args.number,
+            "results": results,
+        }
+        with open(args.output, "w") as fd:
+            json.dump(document, fd, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
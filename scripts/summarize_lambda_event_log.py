@@ -1,50 +1,255 @@
 #!/usr/bin/env python3
+"""
+Summarizes lambda lifecycle trace logs (<volume>/cache/observability/traces-lambda-events/) into per-function
+stage latency percentiles.
+
+The logs are streamed in chunks, so memory usage only depends on the chunk size and the number of invocations
+that are in flight at a chunk boundary, not on the size of the log. Latencies are aggregated into fixed,
+log-spaced histograms per function and stage, which can be merged, so multiple (rotated, possibly gzipped)
+segments can be processed in parallel.
+"""
 import argparse
-import json
-import sys
+from concurrent.futures import ProcessPoolExecutor
 from typing import TypedDict
 
+import numpy as np
 import pandas as pd
 
 
 class LambdaLifecycleEvent(TypedDict):
     """
-    Event payload as written to <volume>/cache/observability/traces-lambda/ 
+    Event payload as written to <volume>/cache/observability/traces-lambda-events/
     """
+
     timestamp: float
     event: str
     request_id: str
     lambda_arn: str
     failure_cause: str | None
 
-def summarize(events: list[LambdaLifecycleEvent]):
-    df = pd.DataFrame(events)
-    # convert timestamps to make them human readable
-    df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
-    # pivot dataframe to have one line per lambda event invocation
-    grouped = df.pivot_table(columns=["event"], index=["request_id", "lambda_arn"], values="timestamp", aggfunc=lambda x: ",".join(x.astype(str)))
-    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.max_colwidth', 150, 'display.expand_frame_repr', False):
-        print(grouped)
-        
+
+STAGES = {
+    "queued": ("enqueued", "submitted"),
+    "startup": ("submitted", "invoking"),
+    "execution": ("invoking", "end"),
+    "total": ("enqueued", "end"),
+}
+"""Stage name -> (start event, end event), durations are computed per invocation."""
+
+END_EVENTS = ["successful", "failed"]
+
+# log-spaced bucket bounds from 1us to ~2.7h, ~1.5% relative error
+BUCKETS = np.geomspace(1e-6, 1e4, 1601)
+
+
+class Summary:
+    """Mergeable per-function aggregates: a latency histogram per (function, stage) and outcome counters."""
+
+    def __init__(self):
+        self.histograms: dict[tuple[str, str], np.ndarray] = {}
+        self.maxima: dict[tuple[str, str], float] = {}
+        self.sums: dict[tuple[str, str], float] = {}
+        self.outcomes = pd.DataFrame(columns=["successful", "failed", "retries"], dtype="int64")
+
+    def add_durations(self, lambda_arn: str, stage: str, durations: np.ndarray):
+        durations = durations[~np.isnan(durations)]
+        if not durations.size:
+            return
+        key = (lambda_arn, stage)
+        counts = np.bincount(np.searchsorted(BUCKETS, durations), minlength=len(BUCKETS) + 1)
+        if key in self.histograms:
+            self.histograms[key] += counts
+            self.maxima[key] = max(self.maxima[key], durations.max())
+            self.sums[key] += durations.sum()
+        else:
+            self.histograms[key] = counts
+            self.maxima[key] = durations.max()
+            self.sums[key] = durations.sum()
+
+    def add_outcomes(self, outcomes: pd.DataFrame):
+        self.outcomes = self.outcomes.add(outcomes, fill_value=0).astype("int64")
+
+    def merge(self, other: "Summary"):
+        for key, counts in other.histograms.items():
+            if key in self.histograms:
+                self.histograms[key] += counts
+                self.maxima[key] = max(self.maxima[key], other.maxima[key])
+                self.sums[key] += other.sums[key]
+            else:
+                self.histograms[key] = counts
+                self.maxima[key] = other.maxima[key]
+                self.sums[key] = other.sums[key]
+        self.add_outcomes(other.outcomes)
+
+    def percentile(self, key: tuple[str, str], percentile: float) -> float:
+        counts = self.histograms[key]
+        cumulative = np.cumsum(counts)
+        index = np.searchsorted(cumulative, max(1, round(cumulative[-1] * percentile / 100)))
+        if index >= len(BUCKETS):
+            return self.maxima[key]
+        return min(BUCKETS[index], self.maxima[key])
+
+    def to_frame(self) -> pd.DataFrame:
+        rows = []
+        for key, counts in sorted(self.histograms.items()):
+            count = int(counts.sum())
+            rows.append(
+                {
+                    "lambda_arn": key[0],
+                    "stage": key[1],
+                    "count": count,
+                    "mean_ms": self.sums[key] / count * 1000,
+                    "p50_ms": self.percentile(key, 50) * 1000,
+                    "p90_ms": self.percentile(key, 90) * 1000,
+                    "p99_ms": self.percentile(key, 99) * 1000,
+                    "max_ms": self.maxima[key] * 1000,
+                }
+            )
+        return pd.DataFrame(rows).set_index(["lambda_arn", "stage"]) if rows else pd.DataFrame()
+
+
+def process_events(summary: Summary, events: pd.DataFrame, require_start: bool = True) -> pd.DataFrame:
+    """
+    Computes the stage durations of all invocations in ``events`` that have completed, and adds them to the summary.
+
+    :param require_start: if set, invocations without an ``enqueued`` event are treated as not completed, since
+        their first events may be in another segment
+    :return: the events of invocations that have not completed yet
+    """
+    if events.empty:
+        return events
+
+    grouped = events.groupby(["request_id", "lambda_arn", "event"], sort=False)["timestamp"]
+    first = grouped.min().unstack("event")
+    last = grouped.max().unstack("event")
+    sizes = grouped.size().unstack("event")
+
+    ends = first.reindex(columns=END_EVENTS)
+    completed = ends.notna().any(axis=1)
+    if require_start:
+        completed &= first["enqueued"].notna() if "enqueued" in first else False
+    if not completed.any():
+        return events
+
+    invocations = pd.DataFrame(index=first.index[completed])
+    invocations["enqueued"] = first["enqueued"] if "enqueued" in first else np.nan
+    invocations["submitted"] = first["submitted"] if "submitted" in first else np.nan
+    # with retries, the last invoke attempt leads to the outcome
+    invocations["invoking"] = last["invoking"] if "invoking" in last else np.nan
+    invocations["end"] = ends[completed].min(axis=1)
+
+    for lambda_arn, group in invocations.groupby(level="lambda_arn", sort=False):
+        for stage, (start, end) in STAGES.items():
+            summary.add_durations(lambda_arn, stage, (group[end] - group[start]).to_numpy())
+
+    outcomes = sizes[completed].reindex(columns=END_EVENTS + ["retry"]).fillna(0)
+    outcomes = outcomes.groupby(level="lambda_arn").sum().astype("int64")
+    summary.add_outcomes(outcomes.rename(columns={"retry": "retries"}))
+
+    pending = first.index[~completed].get_level_values("request_id")
+    return events[events["request_id"].isin(pending)]
+
+
+def read_chunks(path: str, chunk_size: int):
+    # compression (e.g. for rotated .gz segments) is inferred from the file name
+    with pd.read_json(
+        path,
+        lines=True,
+        chunksize=chunk_size,
+        dtype={"timestamp": "float64", "event": "str", "request_id": "str", "lambda_arn": "str"},
+        convert_dates=False,
+    ) as reader:
+        for chunk in reader:
+            yield chunk[["timestamp", "event", "request_id", "lambda_arn"]]
+
+
+def summarize_file(path: str, chunk_size: int) -> tuple[Summary, pd.DataFrame]:
+    """
+    Summarizes a single log file.
+
+    :return: the summary and the events of invocations that did not complete within the file (they may continue in
+        the next segment)
+    """
+    summary = Summary()
+    pending = None
+    for chunk in read_chunks(path, chunk_size):
+        events = chunk if pending is None else pd.concat([pending, chunk], ignore_index=True)
+        pending = process_events(summary, events)
+    return summary, pending
+
+
+def summarize(paths: list[str], chunk_size: int, workers: int) -> tuple[Summary, int]:
+    """
+    Summarizes all given log files, in parallel if ``workers > 1``.
+
+    :return: the summary and the number of invocations that never completed
+    """
+    summary = Summary()
+    pending = []
+
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(summarize_file, paths, [chunk_size] * len(paths)))
+    else:
+        results = [summarize_file(path, chunk_size) for path in paths]
+
+    for file_summary, file_pending in results:
+        summary.merge(file_summary)
+        if file_pending is not None:
+            pending.append(file_pending)
+
+    # invocations that span multiple segments
+    incomplete = 0
+    if pending:
+        remaining = process_events(
+            summary, pd.concat(pending, ignore_index=True), require_start=False
+        )
+        incomplete = remaining["request_id"].nunique()
+
+    return summary, incomplete
+
 
 def main():
     parser = argparse.ArgumentParser(
-        prog='Summarize lambda event logs',
-        description='Print a table of lambda events, and when which event was processed'
+        prog="Summarize lambda event logs",
+        description="Print per-function latency percentiles of the stages of lambda invocations",
+    )
+    parser.add_argument(
+        "input_files", nargs="+", help="ndjson trace logs, including rotated (.gz) segments"
     )
-    # operation (put, get)
-    parser.add_argument("input_file")
+    parser.add_argument(
+        "--chunk-size", type=int, default=500_000, help="number of events read at once"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="number of processes to read files in parallel"
+    )
+    parser.add_argument("--csv", help="write the summary as CSV to the given file")
     args = parser.parse_args()
 
-    events: list[LambdaLifecycleEvent] = []
-    # read the ndjson file
-    with open(args.input_file, mode="rt") as f:
-        for line in f:
-            line = line.strip()
-            events.append(json.loads(line))
-    
-    summarize(events)
-    
+    summary, incomplete = summarize(args.input_files, args.chunk_size, args.workers)
+
+    with pd.option_context(
+        "display.max_rows",
+        None,
+        "display.max_columns",
+        None,
+        "display.max_colwidth",
+        150,
+        "display.expand_frame_repr",
+        False,
+        "display.float_format",
+        "{:.3f}".format,
+    ):
+        stages = summary.to_frame()
+        print(stages)
+        print()
+        print(summary.outcomes)
+        if incomplete:
+            print(f"\n{incomplete} invocations did not complete")
+
+    if args.csv:
+        stages.to_csv(args.csv)
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()